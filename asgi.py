@@ -0,0 +1,58 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from asgiref.sync import sync_to_async
+    from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+except ImportError:
+    WsgiToAsgi = None
+
+from website import create_app
+
+# ASGI entry point, for serving under an ASGI server instead of a WSGI one:
+#
+#     pip install asgiref uvicorn
+#     uvicorn asgi:app --workers 2
+#
+# The Flask app is unchanged; each request runs on a thread from a pool of
+# ASGI_THREADS per worker process, so a process holds that many requests while
+# they wait on CoinGecko or the database. asgiref's own WsgiToAsgi would run
+# every request on its one thread-sensitive thread, one at a time, so the
+# instance below hands run_wsgi_app to that pool instead. Upstream calls are
+# still capped per process by CG_MAX_CONCURRENCY; raise it along with
+# ASGI_THREADS. /portfolio?q= runs its search and its DB reads concurrently in
+# either mode (views._portfolio_page).
+
+if WsgiToAsgi is None:
+    raise RuntimeError("The ASGI entry point needs asgiref: pip install asgiref uvicorn")
+
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", "64"))
+
+_executor = ThreadPoolExecutor(ASGI_THREADS, thread_name_prefix="asgi")
+_run_wsgi_app = WsgiToAsgiInstance.__dict__["run_wsgi_app"].func     # undecorated
+
+
+class _PooledInstance(WsgiToAsgiInstance):
+    async def run_wsgi_app(self, body):
+        await sync_to_async(_run_wsgi_app, thread_sensitive=False, executor=_executor)(self, body)
+
+
+class _PooledWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _PooledInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+flask_app = create_app()
+_wsgi = _PooledWsgiToAsgi(flask_app)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    await _wsgi(scope, receive, send)
@@ -0,0 +1,111 @@
+"""Budget evaluation cost vs. number of budgets and number of transactions.
+
+    python bench/budgets.py [--json]
+
+Builds throwaway SQLite databases, seeds the spend rollups, then times
+budgets.evaluate_all() (rollup lookups) against a direct SUM over the
+transaction table. The first should track the budget count only.
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flask import Flask
+from sqlalchemy import func
+from website import db
+from website.models import User, Category, Transaction, Budget
+from website import budgets, rollups
+
+MONTH = "2025-06"
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    db.init_app(app)
+    return app
+
+
+def seed(users, cats, txns_per_user, budgets_per_user):
+    rnd = random.Random(7)
+    db.session.execute(User.__table__.insert(), [
+        {"id": u, "email": f"u{u}@x", "username": f"u{u}", "password": "x"} for u in range(1, users + 1)])
+    db.session.execute(Category.__table__.insert(), [
+        {"id": (u - 1) * cats + c + 1, "name": f"c{c}", "user_id": u}
+        for u in range(1, users + 1) for c in range(cats)])
+    rows = []
+    for u in range(1, users + 1):
+        for _ in range(txns_per_user):
+            rows.append({"user_id": u, "amount": rnd.randint(1, 5000), "txn": "DEBIT" if rnd.random() < .8 else "CREDIT",
+                         "category_id": (u - 1) * cats + rnd.randrange(cats) + 1, "note": None,
+                         "txn_date": datetime(2024 + rnd.randrange(2), rnd.randint(1, 12), rnd.randint(1, 28))})
+    db.session.execute(Transaction.__table__.insert(), rows)
+    db.session.execute(Budget.__table__.insert(), [
+        {"user_id": u, "category_id": (u - 1) * cats + c + 1, "amount": 10000}
+        for u in range(1, users + 1) for c in range(budgets_per_user)])
+    for u in range(1, users + 1):
+        rollups.rebuild(u)
+    db.session.commit()
+
+
+def scan_all():
+    # the same answer straight from the transaction table
+    q = (db.session.query(Budget.id, func.coalesce(func.sum(Transaction.amount), 0))
+         .outerjoin(Transaction, (Transaction.user_id == Budget.user_id)
+                    & (Transaction.category_id == Budget.category_id)
+                    & (Transaction.txn == "DEBIT")
+                    & (func.strftime("%Y-%m", Transaction.txn_date) == MONTH))
+         .group_by(Budget.id))
+    return q.all()
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t = perf_counter()
+        fn()
+        el = perf_counter() - t
+        best = el if best is None else min(best, el)
+    return best
+
+
+def run(users, txns_per_user, budgets_per_user, cats=10):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, "bench.db"))
+        with app.app_context():
+            db.create_all()
+            seed(users, cats, txns_per_user, budgets_per_user)
+            res = {
+                "users": users, "txns": users * txns_per_user, "budgets": users * budgets_per_user,
+                "evaluate_ms": round(timed(lambda: budgets.evaluate_all(MONTH)) * 1000, 2),
+                "scan_ms": round(timed(scan_all) * 1000, 2),
+            }
+            db.session.remove()
+            db.engine.dispose()
+        return res
+
+
+def main():
+    cases = [
+        # budgets fixed, transactions growing
+        (1000, 20, 3), (1000, 100, 3), (1000, 400, 3),
+        # transactions fixed, budgets growing
+        (1000, 100, 1), (1000, 100, 5), (1000, 100, 10),
+    ]
+    results = [run(*c) for c in cases]
+    if "--json" in sys.argv:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'users':>6} {'txns':>8} {'budgets':>8} {'evaluate ms':>12} {'scan ms':>10}")
+    for r in results:
+        print(f"{r['users']:>6} {r['txns']:>8} {r['budgets']:>8} {r['evaluate_ms']:>12} {r['scan_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Local stand-in for the CoinGecko endpoints the app calls.
+
+    python bench/cg_stub.py [--port 8765] [--delay-ms 0]
+
+then run the app with CG_PRO_URL=CG_PUB_URL=http://127.0.0.1:8765. Any coin id
+is known; prices are derived from the id, so runs are reproducible. --delay-ms
+adds fixed latency per response to imitate the real API.
+"""
+import json
+import os
+import sys
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import parse_qs, urlsplit
+
+# per BTC, roughly as /exchange_rates reports them
+FX = {"inr": 9500000.0, "usd": 112000.0, "eur": 96000.0, "gbp": 83000.0, "jpy": 16500000.0,
+      "aud": 170000.0, "cad": 154000.0, "sgd": 144000.0, "chf": 89000.0, "aed": 411000.0}
+TRENDING = ["bitcoin", "ethereum", "solana", "dogecoin", "cardano", "ripple", "polkadot"]
+
+
+def price(cg_id):
+    return round(10 + zlib.crc32(cg_id.encode()) % 500000 / 10, 2)
+
+
+def market_row(cg_id, rank):
+    return {"id": cg_id, "symbol": cg_id.split("-")[-1][:5], "name": cg_id.replace("-", " ").title(),
+            "image": "", "current_price": price(cg_id), "market_cap_rank": rank,
+            "price_change_percentage_24h": (zlib.crc32(cg_id.encode()) % 2000 - 1000) / 100}
+
+
+def respond(path, query):
+    """(status, JSON-able body) for a request path and parsed query."""
+    if path.endswith("/coins/markets"):
+        ids = [i for i in query.get("ids", [""])[0].split(",") if i]
+        return 200, [market_row(i, n) for n, i in enumerate(ids, 1)]
+    if path.endswith("/search/trending"):
+        return 200, {"coins": [{"item": {"id": i, "name": i.title(), "symbol": i[:3], "thumb": "",
+                                         "market_cap_rank": n}} for n, i in enumerate(TRENDING, 1)]}
+    if path.endswith("/search"):
+        q = query.get("query", [""])[0].lower()
+        return 200, {"coins": [{"id": i, "name": i.title(), "symbol": i[:3], "thumb": "", "market_cap_rank": n}
+                               for n, i in enumerate(TRENDING, 1) if q in i]}
+    if "/coins/" in path:
+        cg_id = path.rsplit("/", 1)[-1]
+        row = market_row(cg_id, None)
+        return 200, {"id": cg_id, "name": row["name"], "symbol": row["symbol"],
+                     "market_data": {"current_price": {"inr": row["current_price"]}}}
+    if path.endswith("/exchange_rates"):
+        return 200, {"rates": {k: {"name": k.upper(), "unit": k, "value": v, "type": "fiat"} for k, v in FX.items()}}
+    if path.endswith("/simple/price"):
+        ids = [i for i in query.get("ids", [""])[0].split(",") if i]
+        return 200, {i: {"inr": price(i)} for i in ids}
+    return 404, {"error": "not found"}
+
+
+def serve(port=0, delay=0.0):
+    """Start the stub on a daemon thread. -> (server, base URL)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            status, body = respond(url.path, parse_qs(url.query))
+            if delay:
+                sleep(delay)
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="cg-stub", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def use_stub(base):
+    """Point the app's CoinGecko client at base; call before importing website."""
+    os.environ.update({"CG_PRO_URL": base, "CG_PUB_URL": base, "CG_RATE_PER_MIN": "0", "CG_API_KEY": ""})
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    port = int(args[args.index("--port") + 1]) if "--port" in args else 8765
+    delay = float(args[args.index("--delay-ms") + 1]) / 1000 if "--delay-ms" in args else 0.0
+    server, base = serve(port, delay)
+    print(f"CoinGecko stub on {base}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,127 @@
+"""Write throughput of home() and trade() with several worker processes on one database.
+
+    python bench/concurrent_writes.py [--workers 4] [--requests 200] [--json]
+
+Each worker is a separate process with its own app (like gunicorn workers),
+logged in as its own user, alternating "add transaction" and "buy" POSTs.
+Runs twice on a throwaway SQLite file: "legacy" (rollback journal, FULL sync,
+deferred transactions, as before) and "tuned" (the defaults: WAL, NORMAL,
+BEGIN IMMEDIATE for writes). With DATABASE_URL set it runs once against that
+database instead (e.g. a scratch PostgreSQL; tables are created if missing).
+"""
+import json
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+PROFILES = {
+    "legacy": {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL",
+               "SQLITE_MMAP_SIZE": "0", "SQLITE_IMMEDIATE_WRITES": "0"},
+    "tuned": {"SQLITE_JOURNAL_MODE": "WAL", "SQLITE_SYNCHRONOUS": "NORMAL",
+              "SQLITE_MMAP_SIZE": str(256 * 1024 * 1024), "SQLITE_IMMEDIATE_WRITES": "1"},
+}
+
+
+def _app(env):
+    os.environ.update(env)
+    from website import create_app
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+    return app
+
+
+def worker(n, env, requests, ready, go, out):
+    app = _app(env)
+    c = app.test_client()
+    name = f"bench{os.getpid()}"
+    for _ in range(10):     # the legacy setup can fail this with "database is locked" too
+        c.post("/register", data=dict(username=name, email=f"{name}@x.com", password="password1", cpass="password1"))
+        c.post("/login", data=dict(email=f"{name}@x.com", password="password1"))
+        if c.get("/").status_code == 200:
+            break
+    ready.wait()
+    go.wait()
+
+    lat, errors = [], 0
+    t0 = perf_counter()
+    for i in range(requests):
+        t = perf_counter()
+        if i % 2:
+            r = c.post("/portfolio/trade", data=dict(form_type="crypto_buy", coin_id="1", quantity="0.01",
+                                                     price_per_coin="100", total_spent="1"))
+        else:
+            r = c.post("/", data=dict(form_type="transaction", date="2025-06-01", txn="DEBIT",
+                                      amount=str(1 + i % 50), note=f"w{n}"))
+        lat.append(perf_counter() - t)
+        errors += r.status_code != 302 or "/login" in r.headers.get("Location", "")
+    out.put({"seconds": perf_counter() - t0, "lat": lat, "errors": errors})
+
+
+def run(label, env, workers, requests):
+    app = _app(env)
+    from website import db
+    from website.models import Coin, Trade, Transaction
+    with app.app_context():
+        if not db.session.query(Coin.id).filter_by(id=1).first():
+            db.session.add(Coin(id=1, cg_id="bitcoin", coin="Bitcoin", symbol="btc"))
+            db.session.commit()
+        db.engine.dispose()
+
+    ctx = mp.get_context("spawn")
+    ready, go, out = ctx.Barrier(workers + 1), ctx.Event(), ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(n, env, requests, ready, go, out)) for n in range(workers)]
+    for p in procs:
+        p.start()
+    ready.wait()
+    t0 = perf_counter()
+    go.set()
+    results = [out.get() for _ in procs]
+    wall = perf_counter() - t0
+    for p in procs:
+        p.join()
+
+    with app.app_context():
+        written = Transaction.query.count() + Trade.query.count()
+        db.engine.dispose()
+
+    lat = sorted(x for r in results for x in r["lat"])
+    total = len(lat)
+    return {
+        "backend": label, "workers": workers, "requests": total, "rows_written": written,
+        "seconds": round(wall, 2), "writes_per_sec": round(written / wall, 1),
+        "p50_ms": round(lat[total // 2] * 1000, 1), "p95_ms": round(lat[int(total * 0.95)] * 1000, 1),
+        "errors": sum(r["errors"] for r in results),
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    workers = int(args[args.index("--workers") + 1]) if "--workers" in args else 4
+    requests = int(args[args.index("--requests") + 1]) if "--requests" in args else 200
+    base = {"MARKET_REFRESH": "0", "REQUEST_LOG": "0", "SECRET_KEY": os.getenv("SECRET_KEY") or "bench"}
+
+    results = []
+    if os.getenv("DATABASE_URL"):
+        results.append(run(os.environ["DATABASE_URL"].split(":", 1)[0], base, workers, requests))
+    else:
+        for name, profile in PROFILES.items():
+            with tempfile.TemporaryDirectory() as tmp:
+                env = dict(base, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}", **profile)
+                results.append(run(f"sqlite-{name}", env, workers, requests))
+                os.environ.pop("DATABASE_URL", None)
+
+    if "--json" in args:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'backend':>14} {'workers':>8} {'requests':>8} {'written':>8} {'sec':>7} {'writes/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for r in results:
+        print(f"{r['backend']:>14} {r['workers']:>8} {r['requests']:>8} {r['rows_written']:>8} {r['seconds']:>7} {r['writes_per_sec']:>9} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Batch FIFO (fifo_batch.batch_fifo) against the scalar replay, on random trade histories.
+
+    python bench/fifo_check.py [--groups 2000] [--seed 1] [--verbose]
+
+Builds --groups (user, coin) histories of 1-40 trades with 8-decimal
+quantities and cent totals; about one in five also sells more than it holds
+at some point, which the batch hands to the scalar replay. Each group's
+qty / invested / realized from batch_fifo must equal fifo_pnl_for_coin's
+with invested and realized quantized to cents. Exits 1 on any difference.
+"""
+import os
+import random
+import sys
+from decimal import Decimal
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+
+from website.fifo import fifo_pnl_for_coin
+from website.fifo_batch import CENTS, batch_fifo
+from website.lots import to_units
+
+
+def _arg(args, name, default, cast=int):
+    return cast(args[args.index(name) + 1]) if name in args else default
+
+
+def history(rnd):
+    trades, held = [], Decimal(0)
+    oversell = rnd.random() < 0.2
+    for _ in range(rnd.randint(1, 40)):
+        if held > 0 and rnd.random() < 0.45:
+            qty = held * Decimal(rnd.randint(1, 120)) / 100 if oversell else held * Decimal(rnd.randint(1, 100)) / 100
+            side = "SELL"
+        else:
+            qty, side = Decimal(rnd.randint(1, 10 ** 9)).scaleb(-8), "BUY"
+        qty = qty.quantize(Decimal("0.00000001"))
+        if qty <= 0:
+            continue
+        total = Decimal(rnd.randint(1, 10 ** 9)).scaleb(-2)
+        held = max(Decimal(0), held + qty if side == "BUY" else held - qty)
+        trades.append(SimpleNamespace(side=side, quantity=qty, total=total))
+    return trades
+
+
+def main():
+    args = sys.argv[1:]
+    rnd = random.Random(_arg(args, "--seed", 1))
+    groups = [history(rnd) for _ in range(_arg(args, "--groups", 2000))]
+
+    rows = [(g, t) for g, trades in enumerate(groups) for t in trades]
+    cols = {
+        "user_id": np.ones(len(rows), dtype=np.int64),
+        "coin_id": np.array([g for g, _ in rows], dtype=np.int64),
+        "is_buy": np.array([t.side == "BUY" for _, t in rows], dtype=bool),
+        "qty": np.array([to_units(t.quantity) for _, t in rows], dtype=np.int64),
+        "total": np.array([int(t.total.scaleb(2)) for _, t in rows], dtype=np.int64),
+    }
+    res = batch_fifo(cols)
+
+    bad = 0
+    for i, g in enumerate(res["coin_id"]):
+        want = fifo_pnl_for_coin(groups[int(g)], Decimal(0))
+        want = (want["qty"], want["invested"].quantize(CENTS), want["realized"].quantize(CENTS))
+        got = (res["qty"][i], res["invested"][i], res["realized"][i])
+        if got != want:
+            bad += 1
+            if "--verbose" in args:
+                print(f"group {int(g)}: batch {got} replay {want}")
+    print(f"{len(res['coin_id'])} groups, {len(rows)} trades, {bad} different")
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
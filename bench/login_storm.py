@@ -0,0 +1,149 @@
+"""Page latency while a burst of logins is being hashed.
+
+    python bench/login_storm.py [--seconds 10] [--storm 16] [--workers 1] [--tolerance 3] [--json]
+
+Serves the app from a threaded werkzeug server on a throwaway SQLite database
+(bench/synth.py data, CoinGecko from bench/cg_stub.py) and times GET /portfolio
+for one logged-in user: first on its own for --seconds, then for --seconds more
+while --storm threads log in as other users back to back, each from its own
+address and waiting out Retry-After when turned away (429 from passwords.py).
+Prints p50/p99 for both phases, the login outcomes and the
+password_hash_* lines from /metrics. Exits 1 if the p99 under the storm is more
+than --tolerance times the quiet p99.
+
+--workers sets HASH_WORKERS; --workers 0 hashes inline on the request threads,
+as before the pool, for comparison.
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import requests
+from werkzeug.serving import make_server
+
+import cg_stub
+import synth
+from suite import percentiles
+
+
+def _arg(args, name, default, cast=int):
+    return cast(args[args.index(name) + 1]) if name in args else default
+
+
+def login(session, base, n):
+    # each synthetic user logs in from its own address (the app runs with PROXY_HOPS=1)
+    return session.post(f"{base}/login", data=dict(email=synth.email(n), password=synth.PASSWORD),
+                        headers={"X-Forwarded-For": f"10.0.{n // 250}.{n % 250 + 1}"}, allow_redirects=False)
+
+
+def time_pages(session, url, seconds):
+    lat, end = [], perf_counter() + seconds
+    while perf_counter() < end:
+        t = perf_counter()
+        r = session.get(url)
+        lat.append(perf_counter() - t)
+        if r.status_code != 200:
+            raise SystemExit(f"GET {url} -> HTTP {r.status_code}")
+    return lat
+
+
+def storm(base, users, stop, outcomes, lat):
+    def run(n):
+        s = requests.Session()
+        while not stop.is_set():
+            t = perf_counter()
+            r = login(s, base, n)
+            took = perf_counter() - t
+            key = "ok" if r.status_code == 302 else str(r.status_code)
+            with lock:
+                outcomes[key] = outcomes.get(key, 0) + 1
+                if key == "ok":
+                    lat.append(took)
+            s.cookies.clear()
+            if r.status_code == 429:
+                stop.wait(float(r.headers.get("Retry-After", 1)))
+    lock = threading.Lock()
+    threads = [threading.Thread(target=run, args=(n,), daemon=True) for n in users]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def run(seconds, size, workers):
+    stub, cg_base = cg_stub.serve()
+    cg_stub.use_stub(cg_base)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({"DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'storm.db')}", "MARKET_REFRESH": "0",
+                           "REQUEST_LOG": "0", "HASH_WORKERS": str(workers),
+                           "HASH_MAX_PENDING": os.getenv("HASH_MAX_PENDING", "16"), "PROXY_HOPS": "1",
+                           "SECRET_KEY": os.getenv("SECRET_KEY") or "bench"})
+        from website import create_app, db, market
+        app = create_app()
+        with app.app_context():
+            synth.populate(dict(users=size + 1, transactions=500, coins=10, holdings=5, trades=10))
+            market.refresh_markets(market.held_coin_ids())
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+
+        page = requests.Session()
+        if login(page, base, 1).status_code != 302:
+            raise SystemExit("could not log in as the synthetic user")
+        quiet = time_pages(page, f"{base}/portfolio", seconds)
+
+        stop, outcomes, login_lat = threading.Event(), {}, []
+        threads = storm(base, range(2, size + 2), stop, outcomes, login_lat)
+        loud = time_pages(page, f"{base}/portfolio", seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+
+        hash_lines = [line for line in page.get(f"{base}/metrics").text.splitlines()
+                      if line.startswith("password_hash") and "_bucket" not in line]
+        server.shutdown()
+        with app.app_context():
+            db.engine.dispose()
+    stub.shutdown()
+    return {
+        "meta": {"seconds": seconds, "storm": size, "hash_workers": workers, "cpus": os.cpu_count()},
+        "portfolio_quiet": percentiles(quiet),
+        "portfolio_storm": percentiles(loud),
+        "logins": dict(outcomes, **({"ok_latency": percentiles(login_lat)} if login_lat else {})),
+        "metrics": hash_lines,
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    cpus = os.cpu_count() or 2
+    report = run(_arg(args, "--seconds", 10.0, float), _arg(args, "--storm", 16),
+                 _arg(args, "--workers", max(1, cpus // 2)))
+    tolerance = _arg(args, "--tolerance", 3.0, float)
+    quiet, loud = report["portfolio_quiet"]["p99_ms"], report["portfolio_storm"]["p99_ms"]
+
+    if "--json" in args:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"hash workers {report['meta']['hash_workers']}, storm of {report['meta']['storm']} "
+              f"login threads, {report['meta']['cpus']} CPU(s)")
+        for phase in ("portfolio_quiet", "portfolio_storm"):
+            p = report[phase]
+            print(f"{phase:>16}: n={p['n']:<5} p50 {p['p50_ms']:>8} ms  p99 {p['p99_ms']:>8} ms")
+        print(f"{'logins':>16}: " + ", ".join(f"{k} {v}" for k, v in report["logins"].items() if k != "ok_latency"))
+        print(*report["metrics"], sep="\n")
+    if loud > quiet * tolerance:
+        print(f"portfolio p99 {loud} ms under the storm is over {tolerance}x the quiet {quiet} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
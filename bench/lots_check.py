@@ -0,0 +1,133 @@
+"""Incremental FIFO lots (lots.apply_trade) against a full replay, on random trade streams.
+
+    python bench/lots_check.py [--ops 400] [--coins 3] [--seed 1] [--verbose]
+
+Runs on a throwaway SQLite database. Each op records a BUY or SELL through
+trading.record_trade, mostly on a date before the coin's latest trade
+(back-dated, so apply_trade unwinds and folds again) and often on the same day
+as another trade (ties go by id); about one SELL in five asks for more than
+is held and must be refused, and a few trades are deleted (trading.delete_trade,
+a full lots.replay, refused when it would leave a SELL short). After every op
+the persisted lots, positions and per-trade realized PnL must match
+fifo.fifo_pnl_for_coin / fifo_realized_by_trade (lots.verify); every 50 ops
+and at the end the open lots must also equal a fresh lots.replay exactly.
+Exits 1 on any difference.
+"""
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+DAYS = 60
+START = datetime(2025, 1, 1)
+
+
+def _arg(args, name, default, cast=int):
+    return cast(args[args.index(name) + 1]) if name in args else default
+
+
+def same_as_replay(db, lots, user_id, coin_ids):
+    """Open lots as persisted vs a full replay (rolled back) -> [coin_id] that differ."""
+    stored = lots.portfolio_lots(user_id)
+    bad = []
+    with db.session.begin_nested() as nested:
+        for coin_id in coin_ids:
+            r = lots.replay(user_id, coin_id)
+            have = [(q, c) for q, c in stored.get(coin_id, (0, []))[1]]
+            want = [(q.quantize(lots.QTY), c) for q, c in r.lots]
+            if have != want or Decimal(stored.get(coin_id, (0, []))[0]).quantize(lots.CENTS) != \
+                    Decimal(r.position.realized).quantize(lots.CENTS):
+                bad.append(coin_id)
+        nested.rollback()
+    return bad
+
+
+def main():
+    args = sys.argv[1:]
+    rnd = random.Random(_arg(args, "--seed", 1))
+    verbose = "--verbose" in args
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({"DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'lots.db')}", "MARKET_REFRESH": "0",
+                           "REQUEST_LOG": "0", "HASH_WORKERS": "0", "SECRET_KEY": os.getenv("SECRET_KEY") or "bench"})
+        from website import create_app, db, lots
+        from website.models import Coin, Holding, Trade, User
+        from website.trading import delete_trade, record_trade
+        app = create_app()
+
+        counts = {"buy": 0, "sell": 0, "back-dated": 0, "refused sell": 0, "delete": 0, "refused delete": 0}
+        problems = []
+        with app.app_context():
+            db.session.add(User(username="lotscheck", email="lots@x.com", password="x"))
+            coin_ids = []
+            for n in range(_arg(args, "--coins", 3)):
+                c = Coin(cg_id=f"check-coin-{n}", coin=f"Check {n}", symbol=f"chk{n}")
+                db.session.add(c)
+                db.session.flush()
+                coin_ids.append(c.id)
+            db.session.commit()
+            user_id = User.query.filter_by(username="lotscheck").one().id
+
+            ops = _arg(args, "--ops", 400)
+            for i in range(1, ops + 1):
+                coin_id = rnd.choice(coin_ids)
+                h = Holding.query.filter_by(user_id=user_id, coin_id=coin_id).first()
+                held = Decimal(h.quantity) if h else Decimal(0)
+                trades = Trade.query.filter_by(user_id=user_id, coin_id=coin_id).all()
+                last = max((t.txn_date for t in trades), default=None)
+                when = START + timedelta(days=rnd.randrange(DAYS))
+
+                if trades and rnd.random() < 0.08:
+                    t = rnd.choice(trades)
+                    try:
+                        delete_trade(t)
+                        db.session.commit()
+                        counts["delete"] += 1
+                    except ValueError:
+                        db.session.rollback()
+                        counts["refused delete"] += 1
+                elif held > 0 and rnd.random() < 0.45:
+                    oversell = rnd.random() < 0.2
+                    qty = (held * Decimal(rnd.randint(101, 150)) / 100 if oversell
+                           else held * Decimal(rnd.randint(1, 100)) / 100).quantize(Decimal("0.00000001"))
+                    if qty <= 0:
+                        continue
+                    try:
+                        record_trade(user_id, coin_id, "SELL", qty, Decimal(1), Decimal(rnd.randint(1, 10 ** 7)).scaleb(-2), when)
+                        db.session.commit()
+                        counts["sell"] += 1
+                        counts["back-dated"] += last is not None and when < last
+                        if qty > held:
+                            problems.append(f"op {i}: sold {qty} with {held} held")
+                    except ValueError:
+                        db.session.rollback()
+                        counts["refused sell"] += 1
+                        if qty <= held:
+                            problems.append(f"op {i}: refused a sell of {qty} with {held} held")
+                else:
+                    qty = Decimal(rnd.randint(1, 10 ** 9)).scaleb(-8)
+                    record_trade(user_id, coin_id, "BUY", qty, Decimal(1), Decimal(rnd.randint(1, 10 ** 7)).scaleb(-2), when)
+                    db.session.commit()
+                    counts["buy"] += 1
+                    counts["back-dated"] += last is not None and when < last
+
+                bad = lots.verify()
+                if bad:
+                    problems += [f"op {i}: user {u} coin {c}: {why}" for u, c, why in bad]
+                if i % 50 == 0 or i == ops:
+                    problems += [f"op {i}: coin {c}: open lots differ from a replay"
+                                 for c in same_as_replay(db, lots, user_id, coin_ids)]
+                if problems and not verbose:
+                    break
+
+        for p in problems[:20]:
+            print(p)
+        print(", ".join(f"{v} {k}" for k, v in counts.items()) + f"; {len(problems)} problems")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""SQL statements per page render for the main pages.
+
+    python bench/page_queries.py [--holdings 25] [--json] [-v]
+
+Renders /, /portfolio and /portfolio/trades/<id> and follows a redirect for a
+user with one holding and with --holdings holdings (a few trades each) on a
+throwaway SQLite file, and counts the statements the engine executes per
+request. The count must not grow with the number of holdings and must stay
+within BUDGET, and once the session's identity is cached no request may read
+the user table; exits 1 otherwise (-v lists the statements).
+"""
+import json
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import event
+
+# statements per request, including BEGIN; the session's user comes from the identity cache
+BUDGET = {"home": 6, "portfolio": 6, "trades": 4, "redirect": 1}
+USER_TABLE = re.compile(r'\bFROM\s+"?user"?(\s|$)', re.I)
+# page -> (method, url, form); the redirect is a rejected currency change (flash, no write)
+REQUESTS = {"home": ("GET", "/", None), "portfolio": ("GET", "/portfolio", None),
+            "trades": ("GET", "/portfolio/trades/1", None),
+            "redirect": ("POST", "/currency", {"currency": "XXX"})}
+
+
+def _app(path):
+    os.environ.update({"DATABASE_URL": f"sqlite:///{path}", "MARKET_REFRESH": "0", "REQUEST_LOG": "0",
+                       "SECRET_KEY": os.getenv("SECRET_KEY") or "bench"})
+    from website import create_app
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+    return app
+
+
+def seed(app, holdings):
+    from website import db
+    from website.models import Coin
+    c = app.test_client()
+    c.post("/register", data=dict(username="pages", email="pages@x.com", password="password1", cpass="password1"))
+    c.post("/login", data=dict(email="pages@x.com", password="password1"))
+    with app.app_context():
+        db.session.execute(Coin.__table__.insert(), [
+            {"id": n, "cg_id": f"coin-{n}", "coin": f"Coin {n}", "symbol": f"c{n}"} for n in range(1, holdings + 1)])
+        db.session.commit()
+    day = datetime(2025, 1, 1)
+    for n in range(1, holdings + 1):
+        for i, side in enumerate(("crypto_buy", "crypto_buy", "crypto_sell")):
+            c.post("/portfolio/trade", data=dict(form_type=side, coin_id=str(n), quantity="0.5",
+                                                 price_per_coin=str(100 + i), total_spent=str(50 + i),
+                                                 total_received=str(50 + i),
+                                                 date=(day + timedelta(days=i)).strftime("%Y-%m-%d")))
+    return c
+
+
+def count(app, client, page):
+    from website import db
+    method, url, form = REQUESTS[page]
+    with app.app_context():
+        engine = db.engine
+    seen = []
+
+    def on_execute(conn, cursor, statement, *args):
+        seen.append(statement)
+
+    event.listen(engine, "before_cursor_execute", on_execute)
+    try:
+        r = client.open(url, method=method, data=form)
+    finally:
+        event.remove(engine, "before_cursor_execute", on_execute)
+    if r.status_code != (302 if page == "redirect" else 200):
+        raise SystemExit(f"{method} {url}: HTTP {r.status_code}")
+    return seen
+
+
+def measure(holdings):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _app(os.path.join(tmp, "pages.db"))
+        client = seed(app, holdings)
+        client.get("/portfolio")        # first render builds FIFO positions for old trades
+        client.get("/")                 # and the first home page seeds the stored balance
+        out = {"holdings": holdings, **{page: count(app, client, page) for page in BUDGET}}
+        from website import db
+        with app.app_context():
+            db.engine.dispose()
+        return out
+
+
+def main():
+    args = sys.argv[1:]
+    many = int(args[args.index("--holdings") + 1]) if "--holdings" in args else 25
+    runs = [measure(1), measure(many)]
+
+    failures = []
+    for page, budget in BUDGET.items():
+        counts = [len(r[page]) for r in runs]
+        if counts[1] != counts[0]:
+            failures.append(f"{page}: {counts[0]} statements with 1 holding, {counts[1]} with {many}")
+        if max(counts) > budget:
+            failures.append(f"{page}: {max(counts)} statements, budget {budget}")
+        if any(USER_TABLE.search(stmt) for r in runs for stmt in r[page]):
+            failures.append(f"{page}: reads the user table")
+
+    if "--json" in args:
+        print(json.dumps([{"holdings": r["holdings"], **{p: len(r[p]) for p in BUDGET}} for r in runs], indent=2))
+    else:
+        print(f"{'holdings':>9} " + " ".join(f"{p:>10}" for p in BUDGET))
+        for r in runs:
+            print(f"{r['holdings']:>9} " + " ".join(f"{len(r[p]):>10}" for p in BUDGET))
+    for f in failures:
+        print("FAIL", f, file=sys.stderr)
+    if failures and "-v" in args:
+        for page in BUDGET:
+            print(f"\n{page} ({many} holdings):", *runs[1][page], sep="\n  ", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Incremental spend rollups against a rebuild, with undated transactions in the mix.
+
+    python bench/rollup_check.py [--ops 400] [--seed 1] [--verbose]
+
+Runs the app on a throwaway SQLite database and makes --ops random writes
+through the JSON API and the home form: adds with and without a date, edits
+that move a transaction to another month or category or clear its date (empty
+form field, PATCH "date": null), and deletes. Each write keeps the rollups up
+to date incrementally (ledger.txn_changed); at the end they must equal a
+rebuild from the transaction table (rollups.verify), and deleting a category
+(which rebuilds) must still work. Exits 1 otherwise.
+"""
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def _arg(args, name, default, cast=int):
+    return cast(args[args.index(name) + 1]) if name in args else default
+
+
+def date(rnd):
+    return None if rnd.random() < 0.2 else f"{rnd.choice((2024, 2025))}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}"
+
+
+def main():
+    args = sys.argv[1:]
+    rnd = random.Random(_arg(args, "--seed", 1))
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({"DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'rollups.db')}", "MARKET_REFRESH": "0",
+                           "REQUEST_LOG": "0", "HASH_WORKERS": "0", "SECRET_KEY": os.getenv("SECRET_KEY") or "bench"})
+        from website import create_app, db, rollups
+        from website.models import Category
+        app = create_app()
+        c = app.test_client()
+        c.post("/register", data=dict(username="rollups", email="rollups@x.com", password="password1",
+                                      cpass="password1"))
+        for name in ("Food", "Rent", "Pay"):
+            c.post("/api/categories", json={"name": name})
+        with app.app_context():
+            cats = [cid for (cid,) in db.session.query(Category.id)]
+
+        ids, failed = [], 0
+        for _ in range(_arg(args, "--ops", 400)):
+            op = rnd.random()
+            body = {"txn": rnd.choice(("DEBIT", "CREDIT")), "amount": f"{rnd.randint(1, 99999) / 100:.2f}",
+                    "category_id": rnd.choice(cats + [None])}
+            if not ids or op < 0.4:
+                if rnd.random() < 0.5:
+                    body["date"] = date(rnd)
+                r = c.post("/api/transactions", json=body)
+                if r.status_code == 201:
+                    ids.append(r.json["id"])
+            elif op < 0.6:
+                r = c.patch(f"/api/transactions/{rnd.choice(ids)}", json={"date": date(rnd)})
+            elif op < 0.85:
+                r = c.post("/", data={"form_type": "transaction", "transaction_id": str(rnd.choice(ids)),
+                                      "date": date(rnd) or "", "txn": body["txn"], "amount": body["amount"],
+                                      "category_id": str(body["category_id"] or "")})
+            else:
+                r = c.delete(f"/api/transactions/{ids.pop(rnd.randrange(len(ids)))}")
+            if r.status_code >= 400:
+                failed += 1
+                if "--verbose" in args:
+                    print(f"{r.request.method} {r.request.path}: HTTP {r.status_code}")
+
+        with app.app_context():
+            bad = rollups.verify()
+        deleted = c.get(f"/cdelete/{cats[0]}").status_code
+        print(f"{len(ids)} transactions left, {failed} failed writes, rollups "
+              + ("match" if not bad else f"differ for users {bad}") + f", category delete HTTP {deleted}")
+        sys.exit(1 if bad or failed or deleted != 302 else 0)
+
+
+if __name__ == "__main__":
+    main()
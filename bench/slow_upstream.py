@@ -0,0 +1,155 @@
+"""Throughput of /portfolio searches against a slow CoinGecko.
+
+    python bench/slow_upstream.py [--delay-ms 300] [--clients 32] [--seconds 10] [--server werkzeug|uvicorn] [--json]
+
+Serves the app on a throwaway SQLite database (bench/synth.py data) with
+bench/cg_stub.py answering every call after --delay-ms. One synthetic user's
+portfolio is timed first without a search (DB work only), then --clients
+threads request /portfolio?q=<new term> back to back for --seconds, each term
+a cache miss that waits on the stub. The search and the DB reads of that page
+run concurrently, so its p50 should sit near max(delay, page) rather than the
+sum; throughput should grow with --clients until the CG_MAX_CONCURRENCY
+upstream slots (set here to --clients) or the CPU run out.
+
+--server uvicorn serves asgi.py instead of a threaded werkzeug server (needs
+asgiref and uvicorn installed).
+"""
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import requests
+
+import cg_stub
+import synth
+from suite import percentiles
+
+
+def _arg(args, name, default, cast=int):
+    return cast(args[args.index(name) + 1]) if name in args else default
+
+
+def login(base):
+    s = requests.Session()
+    r = s.post(f"{base}/login", data=dict(email=synth.email(1), password=synth.PASSWORD), allow_redirects=False)
+    if r.status_code != 302:
+        raise SystemExit(f"could not log in as the synthetic user (HTTP {r.status_code})")
+    return s
+
+
+def serve_werkzeug(app):
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def serve_uvicorn():
+    import uvicorn
+    import asgi
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(asgi.app, host="127.0.0.1", port=port, log_level="warning",
+                                           lifespan="on"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+    return f"http://127.0.0.1:{port}", stop
+
+
+def storm(base, cookies, clients, seconds):
+    lat, errors, lock = [], {}, threading.Lock()
+    end = perf_counter() + seconds
+
+    def run(n):
+        s, i = requests.Session(), 0
+        s.cookies.update(cookies)
+        while perf_counter() < end:
+            i += 1
+            t = perf_counter()
+            r = s.get(f"{base}/portfolio", params={"q": f"bench-{n}-{i}"})
+            took = perf_counter() - t
+            with lock:
+                if r.status_code == 200:
+                    lat.append(took)
+                else:
+                    errors[str(r.status_code)] = errors.get(str(r.status_code), 0) + 1
+
+    threads = [threading.Thread(target=run, args=(n,), daemon=True) for n in range(clients)]
+    t0 = perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return lat, errors, perf_counter() - t0
+
+
+def run(delay, clients, seconds, server_kind):
+    stub, cg_base = cg_stub.serve(delay=delay)
+    cg_stub.use_stub(cg_base)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({"DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'slow.db')}", "MARKET_REFRESH": "0",
+                           "REQUEST_LOG": "0", "HASH_WORKERS": "0", "CG_MAX_CONCURRENCY": str(clients),
+                           "ASGI_THREADS": str(max(clients * 2, 16)),
+                           "SECRET_KEY": os.getenv("SECRET_KEY") or "bench"})
+        from website import create_app, db, market
+        app = create_app()
+        with app.app_context():
+            synth.populate(dict(users=1, transactions=500, coins=20, holdings=10, trades=40))
+            market.refresh_markets(market.held_coin_ids())
+
+        base, stop = serve_uvicorn() if server_kind == "uvicorn" else serve_werkzeug(app)
+        page = login(base)
+        quiet = []
+        for _ in range(20):
+            t = perf_counter()
+            page.get(f"{base}/portfolio").raise_for_status()
+            quiet.append(perf_counter() - t)
+
+        lat, errors, took = storm(base, page.cookies, clients, seconds)
+        stop()
+        with app.app_context():
+            db.engine.dispose()
+    stub.shutdown()
+    return {
+        "meta": {"server": server_kind, "delay_ms": delay * 1000, "clients": clients, "seconds": seconds,
+                 "cpus": os.cpu_count()},
+        "portfolio_no_search": percentiles(quiet),
+        "portfolio_search": percentiles(lat) if lat else {"n": 0},
+        "throughput_rps": round(len(lat) / took, 2),
+        "errors": errors,
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    report = run(_arg(args, "--delay-ms", 300.0, float) / 1000, _arg(args, "--clients", 32),
+                 _arg(args, "--seconds", 10.0, float), _arg(args, "--server", "werkzeug", str))
+    if "--json" in args:
+        print(json.dumps(report, indent=2))
+        return
+    m = report["meta"]
+    print(f"{m['server']}, upstream delay {m['delay_ms']:.0f} ms, {m['clients']} clients, {m['cpus']} CPU(s)")
+    for name in ("portfolio_no_search", "portfolio_search"):
+        p = report[name]
+        if p["n"]:
+            print(f"{name:>20}: n={p['n']:<5} p50 {p['p50_ms']:>8} ms  p99 {p['p99_ms']:>8} ms")
+    print(f"{'throughput':>20}: {report['throughput_rps']} req/s"
+          + (f", errors {report['errors']}" if report["errors"] else ""))
+
+
+if __name__ == "__main__":
+    main()
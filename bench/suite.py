@@ -0,0 +1,193 @@
+"""Latency of every main view and of the FIFO engine on synthetic data, as JSON.
+
+    python bench/suite.py [--iterations 100] [--out results.json] [--compare baseline.json [--tolerance 1.25]]
+                          [--users 2] [--transactions 5000] [--coins 20] [--holdings 10] [--trades 40]
+
+Builds a throwaway SQLite database with bench/synth.py, serves CoinGecko from
+bench/cg_stub.py (the market snapshot is filled once before timing, the
+background refresher is off), logs in as the first synthetic user and times
+each request with the test client. fifo_pnl_for_coin is timed on its own over
+in-memory trade lists.
+
+--out writes the JSON report; --compare loads an earlier one, prints the ratio
+of each p50 and exits 1 if any is more than --tolerance times slower.
+"""
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from time import perf_counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import cg_stub
+import synth
+
+FIFO_SIZES = (100, 1000, 10000)
+
+
+def percentiles(samples):
+    s = sorted(samples)
+    at = lambda q: s[min(len(s) - 1, int(len(s) * q))]
+    return {"n": len(s), "mean_ms": round(sum(s) / len(s) * 1000, 3), "p50_ms": round(at(0.5) * 1000, 3),
+            "p90_ms": round(at(0.9) * 1000, 3), "p99_ms": round(at(0.99) * 1000, 3),
+            "max_ms": round(s[-1] * 1000, 3)}
+
+
+def cases(coin_id):
+    """(name, method, url, form) per timed request; POST forms get the iteration number."""
+    day = datetime(2025, 6, 1)
+    return [
+        ("home", "GET", "/", None),
+        ("ledger", "GET", "/ledger", None),
+        ("portfolio", "GET", "/portfolio", None),
+        ("trades", "GET", f"/portfolio/trades/{coin_id}", None),
+        ("portfolio history", "GET", "/portfolio/history?days=365&res=d", None),
+        ("stats", "GET", "/stats", None),
+        ("stats data", "GET", "/stats/data?period=m", None),
+        ("goals", "GET", "/goal", None),
+        ("export csv", "GET", "/export/transactions?format=csv", None),
+        ("add transaction", "POST", "/", lambda i: dict(
+            form_type="transaction", date=(day + timedelta(days=i % 30)).strftime("%Y-%m-%d"),
+            txn="DEBIT", amount=str(1 + i % 90), note=f"bench {i}")),
+        ("buy", "POST", "/portfolio/trade", lambda i: dict(
+            form_type="crypto_buy", coin_id=str(coin_id), quantity="0.001", price_per_coin="100",
+            total_spent="0.1", date=(day + timedelta(minutes=i)).isoformat())),
+    ]
+
+
+def time_views(client, coin_id, iterations):
+    out = {}
+    for name, method, url, form in cases(coin_id):
+        lat = []
+        for i in range(iterations + 3):         # the first few warm caches and templates
+            t = perf_counter()
+            if method == "GET":
+                r = client.get(url)
+                r.get_data()                    # drain streamed responses
+            else:
+                r = client.post(url, data=form(i))
+            if i >= 3:
+                lat.append(perf_counter() - t)
+            if r.status_code not in (200, 302) or "/login" in r.headers.get("Location", ""):
+                raise SystemExit(f"{name}: {method} {url} -> HTTP {r.status_code}")
+        out[name] = percentiles(lat)
+    return out
+
+
+def time_fifo(iterations):
+    from website.fifo import fifo_pnl_for_coin
+    out = {}
+    for size in FIFO_SIZES:
+        trades, held = [], Decimal(0)
+        for i in range(size):
+            qty = Decimal(1 + i % 7) / 10
+            if i % 3 == 2 and held >= qty:
+                side, held = "SELL", held - qty
+            else:
+                side, held = "BUY", held + qty
+            trades.append(SimpleNamespace(side=side, quantity=qty, total=qty * (100 + i % 50)))
+        runs = max(3, min(iterations, 100000 // size))
+        lat = []
+        for _ in range(runs):
+            t = perf_counter()
+            fifo_pnl_for_coin(trades, Decimal(120))
+            lat.append(perf_counter() - t)
+        stats = percentiles(lat)
+        stats["trades_per_sec"] = int(size / (stats["p50_ms"] / 1000)) if stats["p50_ms"] else None
+        out[f"fifo_pnl_for_coin/{size}"] = stats
+    return out
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(spec, iterations):
+    server, base = cg_stub.serve()
+    cg_stub.use_stub(base)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({"DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'suite.db')}", "MARKET_REFRESH": "0",
+                           "REQUEST_LOG": "0", "SECRET_KEY": os.getenv("SECRET_KEY") or "bench"})
+        from website import create_app, db, fx, market
+        app = create_app()
+        app.config["WTF_CSRF_ENABLED"] = False
+        with app.app_context():
+            data = synth.populate(spec)
+            market.refresh_markets(market.held_coin_ids())
+            market.refresh_trending()
+            fx.refresh_rates()
+            from website.models import Holding
+            coin_id = (db.session.query(Holding.coin_id).filter_by(user_id=data["users"][0])
+                       .order_by(Holding.coin_id).first()[0])
+
+        client = app.test_client()
+        r = client.post("/login", data=dict(email=synth.email(1), password=synth.PASSWORD))
+        if "/login" in r.headers.get("Location", "/login"):
+            raise SystemExit("could not log in as the synthetic user")
+
+        report = {
+            "meta": {"commit": _commit(), "when": datetime.now().isoformat(timespec="seconds"),
+                     "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                     "spec": dict(synth.SPEC, **spec), "iterations": iterations,
+                     "populate_seconds": data["seconds"]},
+            "views": time_views(client, coin_id, iterations),
+            "fifo": time_fifo(iterations),
+        }
+        with app.app_context():
+            db.engine.dispose()
+    server.shutdown()
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """Print new/old p50 per benchmark. -> names slower than tolerance allows."""
+    worse = []
+    print(f"\n{'benchmark':>28} {'old p50':>10} {'new p50':>10} {'ratio':>7}")
+    for section in ("views", "fifo"):
+        for name, new in report[section].items():
+            old = baseline.get(section, {}).get(name)
+            if not old or not old["p50_ms"]:
+                continue
+            ratio = new["p50_ms"] / old["p50_ms"]
+            flag = " <" if ratio > tolerance else ""
+            print(f"{name:>28} {old['p50_ms']:>10} {new['p50_ms']:>10} {ratio:>7.2f}{flag}")
+            if flag:
+                worse.append(name)
+    return worse
+
+
+def main():
+    args = sys.argv[1:]
+    iterations = int(args[args.index("--iterations") + 1]) if "--iterations" in args else 100
+    report = run(synth.parse_spec(args), iterations)
+
+    if "--out" in args:
+        with open(args[args.index("--out") + 1], "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if "--compare" in args:
+        with open(args[args.index("--compare") + 1]) as f:
+            baseline = json.load(f)
+        tolerance = float(args[args.index("--tolerance") + 1]) if "--tolerance" in args else 1.25
+        worse = compare(report, baseline, tolerance)
+        if worse:
+            print(f"\nslower than {tolerance}x: {', '.join(worse)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Synthetic users, ledgers and portfolios for the benchmarks.
+
+    python bench/synth.py OUT.db [--users 2] [--transactions 5000] [--coins 20] [--holdings 10] [--trades 40]
+
+Rows go in through the app's own bulk paths (importer.import_transactions,
+fills.import_fills), so balances, rollups, fingerprints, FIFO lots and holdings
+are all consistent with what the views expect. The same seed gives the same data.
+"""
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+PASSWORD = "password1"
+SPEC = {
+    "users": 2,             # users get the same shape of data
+    "categories": 12,       # per user
+    "transactions": 5000,   # per user
+    "coins": 20,            # in the Coin table
+    "holdings": 10,         # coins each user trades
+    "trades": 40,           # per holding
+    "seed": 7,
+}
+START = datetime(2023, 1, 1)
+DAYS = 900
+
+
+def email(n):
+    return f"synth{n}@x.com"
+
+
+def coin_id(n):
+    return f"synth-coin-{n}"
+
+
+def transactions(rnd, spec):
+    cats = [f"Category {c}" for c in range(spec["categories"])]
+    for i in range(spec["transactions"]):
+        credit = rnd.random() < 0.15
+        yield {"date": (START + timedelta(days=rnd.randrange(DAYS))).strftime("%Y-%m-%d"),
+               "type": "CREDIT" if credit else "DEBIT",
+               "amount": str(rnd.randint(5000, 90000) if credit else rnd.randint(20, 6000)),
+               "note": f"synthetic {i}",
+               "category": None if rnd.random() < 0.1 else rnd.choice(cats)}
+
+
+def fills(rnd, spec):
+    out = []
+    for c in rnd.sample(range(1, spec["coins"] + 1), spec["holdings"]):
+        held, day = Decimal(0), START
+        base = Decimal(rnd.randint(100, 500000))
+        for _ in range(spec["trades"]):
+            day += timedelta(days=rnd.randint(1, max(1, DAYS // spec["trades"])), minutes=rnd.randrange(1440))
+            price = (base * Decimal(rnd.uniform(0.6, 1.6))).quantize(Decimal("0.01"))
+            if held > 0 and rnd.random() < 0.35:
+                side, qty = "SELL", (held * Decimal(rnd.uniform(0.1, 0.6))).quantize(Decimal("0.0001"))
+            else:
+                side, qty = "BUY", Decimal(rnd.randint(1, 5000)) / 1000
+            if qty <= 0:
+                continue
+            held += qty if side == "BUY" else -qty
+            out.append({"date": day.isoformat(), "coin": coin_id(c), "side": side,
+                        "quantity": str(qty), "price": str(price)})
+    return out
+
+
+def populate(spec=None):
+    """Fill the current app's (empty) database. -> {"users": [ids], "coins": {cg_id: id}, "seconds": ...}"""
+    from time import perf_counter
+    from werkzeug.security import generate_password_hash
+    from website import db
+    from website.fills import import_fills
+    from website.importer import import_transactions
+    from website.models import Category, Coin, User
+
+    spec = dict(SPEC, **(spec or {}))
+    rnd = random.Random(spec["seed"])
+    t0 = perf_counter()
+
+    hashed = generate_password_hash(PASSWORD, method="pbkdf2:sha256")
+    db.session.execute(User.__table__.insert(), [
+        {"email": email(n), "username": f"synth{n}", "password": hashed} for n in range(1, spec["users"] + 1)])
+    db.session.execute(Coin.__table__.insert(), [
+        {"cg_id": coin_id(n), "coin": f"Synth Coin {n}", "symbol": f"sc{n}"} for n in range(1, spec["coins"] + 1)])
+    db.session.commit()
+    users = [u for (u,) in db.session.query(User.id).order_by(User.id)]
+    db.session.execute(Category.__table__.insert(), [
+        {"name": f"Category {c}", "user_id": u} for u in users for c in range(spec["categories"])])
+    db.session.commit()
+
+    for u in users:
+        import_transactions(u, transactions(rnd, spec))
+        res = import_fills(u, fills(rnd, spec))
+        if res["errors"]:
+            raise RuntimeError(f"synthetic fills rejected: {res['errors'][:3]}")
+
+    coins = {cg: cid for cid, cg in db.session.query(Coin.id, Coin.cg_id)}
+    return {"users": users, "coins": coins, "seconds": round(perf_counter() - t0, 2)}
+
+
+def parse_spec(args):
+    spec = {}
+    for key in SPEC:
+        if f"--{key}" in args:
+            spec[key] = int(args[args.index(f"--{key}") + 1])
+    return spec
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0].startswith("--"):
+        raise SystemExit(__doc__)
+    os.environ.update({"DATABASE_URL": f"sqlite:///{os.path.abspath(args[0])}", "MARKET_REFRESH": "0",
+                       "REQUEST_LOG": "0", "SECRET_KEY": os.getenv("SECRET_KEY") or "bench"})
+    from website import create_app
+    app = create_app()
+    with app.app_context():
+        res = populate(parse_spec(args))
+    print(f"{len(res['users'])} users, {len(res['coins'])} coins in {res['seconds']}s; "
+          f"log in as {email(1)} / {PASSWORD}")
+
+
+if __name__ == "__main__":
+    main()
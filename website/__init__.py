@@ -1,6 +1,5 @@
 from flask import Flask, url_for
 from flask_sqlalchemy import SQLAlchemy
-from os import path
 import os
 from dotenv import load_dotenv
 from flask_login import LoginManager
@@ -14,8 +13,61 @@ NAME = "database.db"
 def create_app():
     app = Flask(__name__)
     app.config['SECRET_KEY'] = os.getenv("SECRET_KEY", "").strip()
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{NAME}'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL", "").strip() or f'sqlite:///{NAME}'
+    # SQLite (default): per-connection pragmas, see dialect.configure_engine
+    app.config['SQLITE_JOURNAL_MODE'] = os.getenv("SQLITE_JOURNAL_MODE", "WAL").strip()
+    app.config['SQLITE_SYNCHRONOUS'] = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip()
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    app.config['SQLITE_MMAP_SIZE'] = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    app.config['SQLITE_IMMEDIATE_WRITES'] = os.getenv("SQLITE_IMMEDIATE_WRITES", "1").strip() not in ("0", "false", "no")
+    # PostgreSQL (DATABASE_URL=postgresql://...): connection pool per worker process
+    app.config['DB_POOL_SIZE'] = int(os.getenv("DB_POOL_SIZE", "5"))
+    app.config['DB_MAX_OVERFLOW'] = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    app.config['DB_POOL_TIMEOUT'] = int(os.getenv("DB_POOL_TIMEOUT", "10"))
+    app.config['DB_POOL_RECYCLE'] = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+    app.config['DB_AUTO_MIGRATE'] = os.getenv("DB_AUTO_MIGRATE", "1").strip() not in ("0", "false", "no")     # else: flask db upgrade
+    app.config['CACHE_BACKEND'] = os.getenv("CACHE_BACKEND", "memory").strip()     # memory | sqlite
+    app.config['CACHE_PATH'] = os.getenv("CACHE_PATH", "").strip()                 # default: instance/cache.db
+    app.config['CACHE_MAX_ENTRIES'] = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+    app.config['FRAGMENT_CACHE_ENTRIES'] = int(os.getenv("FRAGMENT_CACHE_ENTRIES", "512"))     # rendered page parts; 0 = off
+    app.config['FRAGMENT_CACHE_PATH'] = os.getenv("FRAGMENT_CACHE_PATH", "").strip()           # default: instance/fragments.db
+    app.config['MARKET_REFRESH'] = os.getenv("MARKET_REFRESH", "1").strip() not in ("0", "false", "no")
+    app.config['MARKET_REFRESH_SECONDS'] = int(os.getenv("MARKET_REFRESH_SECONDS", "60"))
+    app.config['PRICE_KEEP_MINUTES_DAYS'] = int(os.getenv("PRICE_KEEP_MINUTES_DAYS", "2"))     # then hourly
+    app.config['PRICE_KEEP_HOURS_DAYS'] = int(os.getenv("PRICE_KEEP_HOURS_DAYS", "90"))        # then daily, kept
+    app.config['FX_REFRESH_SECONDS'] = int(os.getenv("FX_REFRESH_SECONDS", "3600"))
+    # password hashing, see passwords.py
+    app.config['PASSWORD_METHOD'] = os.getenv("PASSWORD_METHOD", "pbkdf2:sha256").strip()     # werkzeug method
+    app.config['HASH_WORKERS'] = int(os.getenv("HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))   # 0 = inline
+    app.config['HASH_MAX_PENDING'] = int(os.getenv("HASH_MAX_PENDING", "16"))
+    app.config['HASH_MAX_PER_CLIENT'] = int(os.getenv("HASH_MAX_PER_CLIENT", "2"))
+    app.config['HASH_TIMEOUT'] = float(os.getenv("HASH_TIMEOUT", "10"))
+    app.config['PROXY_HOPS'] = int(os.getenv("PROXY_HOPS", "0"))      # trusted X-Forwarded-For hops
+    # instrumentation, see metrics.py
+    app.config['REQUEST_LOG'] = os.getenv("REQUEST_LOG", "1").strip() not in ("0", "false", "no")
+    app.config['METRICS_TOKEN'] = os.getenv("METRICS_TOKEN", "").strip()        # empty: /metrics is open
+    app.config['PROFILE_SLOW_MS'] = int(os.getenv("PROFILE_SLOW_MS", "0"))        # 0 = profiler off
+    app.config['PROFILE_INTERVAL_MS'] = int(os.getenv("PROFILE_INTERVAL_MS", "5"))
+    app.config['PROFILE_DIR'] = os.getenv("PROFILE_DIR", "").strip() or os.path.join(app.instance_path, "profiles")
+    from .dialect import normalize_url, engine_options, configure_engine
+    app.config['SQLALCHEMY_DATABASE_URI'] = normalize_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
     db.init_app(app)
+    if app.config['PROXY_HOPS']:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_HOPS'], x_proto=app.config['PROXY_HOPS'])
+    from . import goals, metrics, versions
+    with app.app_context():
+        configure_engine(app)
+        metrics.init_app(app)
+    versions.init_app(app)
+    goals.init_app(app)
+
+    from .cache import init_cache
+    init_cache(app)
+    from . import fragments
+    fragments.init_app(app)
 
     @app.template_filter('fmtqty')
     def fmtqty(x, places=8):
@@ -31,23 +83,39 @@ def create_app():
         s = f"{q:f}".rstrip('0').rstrip('.')
         return s or "0"
 
+    from . import fx
+
+    @app.template_filter('money')
+    def money(x, converted=False):
+        # a base-currency amount in the user's display currency; converted=True if it already is
+        return fx.money(x, converted=converted)
+
+    @app.context_processor
+    def currency_context():
+        return {"fx": fx.display(), "currencies": fx.CURRENCIES, "base_currency": fx.BASE}
+
     from .views import views
     from .auth import auth
+    from .api import api
 
     app.register_blueprint(views, url_prefix='/')
     app.register_blueprint(auth, url_prefix='/')
-
-    from .models import User, Category, Transaction, Coin, Holding
+    app.register_blueprint(api, url_prefix='/api')
 
     create_db(app)
 
+    from .commands import register_commands
+    register_commands(app)
+
     manager = LoginManager()
     manager.login_view = 'auth.login'
     manager.init_app(app)
 
+    from . import identity
+
     @manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return identity.load(int(user_id))
 
 
     return app
@@ -55,7 +123,13 @@ def create_app():
 
 
 def create_db(app):
-    if not path.exists('website/' + NAME):
-        with app.app_context():
-            db.create_all()
+    """Create a new database or bring an existing one up to the latest schema (migrations.py)."""
+    if not app.config['DB_AUTO_MIGRATE']:
+        return
+    from .migrations import upgrade
+    with app.app_context():
+        created, applied = upgrade()
+    if created:
         print('Database created')
+    for version, name in applied:
+        print(f'Schema migrated to version {version}: {name}')
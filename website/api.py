@@ -0,0 +1,400 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import wraps
+from flask import Blueprint, Response, g, jsonify, make_response, request
+from flask_login import current_user
+from . import db, fragments, fx, market, portfolio_data, rollups, versions
+from .goals import invalidate as invalidate_goals
+from .ledger import PAGE_SIZE, ledger_page, parse_filters, snapshot, txn_changed, txn_to_dict
+from .lots import ensure_positions
+from .models import Category, Holding, Trade, Transaction
+from .trading import delete_trade, record_trade, update_trade
+
+# JSON API for the dashboards: /api/transactions, /api/categories, /api/trades,
+# /api/portfolio, plus /api/changes?since=<version> for deltas. Amounts are in
+# the base currency (transactions also carry what was entered); /api/fx has
+# the rates to convert them.
+# GET responses carry a weak ETag built from the user's data version
+# (versions.py; the portfolio adds the market snapshot time). A matching
+# If-None-Match gets a 304 before any of the view's queries run. The version is
+# read the way the page fragments key on it (fragments.data_version), so no
+# worker answers 304 from its own out-of-date copy.
+# Errors are {"error": message} with a 4xx status.
+
+api = Blueprint('api', __name__)
+
+
+def error(message, status=400):
+    return jsonify(error=message), status
+
+
+@api.before_request
+def _require_login():
+    if not current_user.is_authenticated:
+        return error("Login required.", 401)
+
+
+def conditional(with_prices=False):
+    """ETag / If-None-Match for a GET view whose body only changes with the user's data."""
+    def decorate(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            g.data_version = fragments.data_version(current_user.id)
+            tag = f"u{current_user.id}.v{g.data_version}"
+            if with_prices:
+                tag += f".m{int(market.generation())}"
+            if request.if_none_match.contains_weak(tag):
+                resp = Response(status=304)
+            else:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(tag, weak=True)
+            resp.headers["Cache-Control"] = "private, no-cache"
+            return resp
+        return wrapped
+    return decorate
+
+
+# ---- request parsing ----
+def _body():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object.")
+    return data
+
+
+def _decimal(data, key, required=False):
+    val = data.get(key)
+    if val is None or val == "":
+        if required:
+            raise ValueError(f"Missing {key}.")
+        return None
+    try:
+        return Decimal(str(val))
+    except InvalidOperation:
+        raise ValueError(f"Invalid {key}.")
+
+
+def _when(data, key="date"):
+    val = data.get(key)
+    if not val:
+        return None
+    try:
+        return datetime.fromisoformat(str(val))
+    except ValueError:
+        raise ValueError("Invalid date. Use YYYY-MM-DD or an ISO datetime.")
+
+
+def _category_id(data):
+    cid = data.get("category_id")
+    if cid in (None, ""):
+        return None
+    cat = db.session.get(Category, int(cid)) if str(cid).isdigit() else None
+    if cat is None or cat.user_id != current_user.id:
+        raise ValueError("Unknown category.")
+    return cat.id
+
+
+def _owned(model, id):
+    obj = db.session.get(model, id)
+    return obj if obj is not None and obj.user_id == current_user.id else None
+
+
+def category_to_dict(c):
+    return {"id": c.id, "name": c.name}
+
+
+def trade_to_dict(t):
+    return {"id": t.id, "coin_id": t.coin_id, "side": t.side, "quantity": str(t.quantity),
+            "price_per_coin": str(t.price_per_coin), "total": str(t.total),
+            "realized_pnl": str(t.realized_pnl), "date": t.txn_date.isoformat() if t.txn_date else None}
+
+
+def holding_to_dict(h):
+    return {"id": h.id, "coin_id": h.coin_id, "quantity": str(h.quantity), "invested": str(h.invested),
+            "price_per_coin": str(h.price_per_coin)}
+
+
+# ---- version / changes ----
+@api.route('/version')
+@conditional()
+def version():
+    return jsonify(version=g.data_version)
+
+
+LOADERS = {
+    "transaction": (Transaction, txn_to_dict),
+    "category": (Category, category_to_dict),
+    "trade": (Trade, trade_to_dict),
+    "holding": (Holding, holding_to_dict),
+}
+
+
+@api.route('/changes')
+@conditional()
+def changes():
+    """?since=<version> -> what changed after it. reset=true: the log does not go back that
+    far, refetch everything. An entry with id null and op "reload": refetch that collection."""
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return error("since must be a version number.")
+    rows = versions.changes(current_user.id, since)
+    if rows is None:
+        return jsonify(version=g.data_version, reset=True, changes=[])
+
+    latest = {}                 # (entity, id) -> (version, op); the last change wins
+    for v, entity, entity_id, op in rows:
+        latest.pop((entity, entity_id), None)
+        latest[(entity, entity_id)] = (v, op)
+
+    data = {}
+    for entity, (model, to_dict) in LOADERS.items():
+        ids = [i for (e, i), (_, op) in latest.items() if e == entity and i is not None and op == "upsert"]
+        if ids:
+            objs = model.query.filter(model.id.in_(ids), model.user_id == current_user.id)
+            data.update({(entity, o.id): to_dict(o) for o in objs})
+
+    out = []
+    for (entity, entity_id), (v, op) in latest.items():
+        item = {"version": v, "entity": entity, "id": entity_id, "op": op}
+        if op == "upsert":
+            if (entity, entity_id) not in data:
+                item["op"] = "delete"       # gone again since
+            else:
+                item["data"] = data[(entity, entity_id)]
+        out.append(item)
+    return jsonify(version=rows[-1][0] if rows else g.data_version, reset=False, changes=out)
+
+
+# ---- currencies ----
+@api.route('/fx')
+def fx_rates():
+    """Stored exchange rates: units of each currency per 1 of the base, which every amount is in."""
+    return jsonify(base=fx.BASE, display=fx.display().code, rates={k: str(v) for k, v in fx.rates().items()})
+
+
+# ---- transactions ----
+@api.route('/transactions')
+@conditional()
+def transactions():
+    """?cursor=&limit=&from=&to=&category=&txn=&q= (as /ledger)"""
+    try:
+        filters = parse_filters(request.args)
+        limit = int(request.args.get('limit', PAGE_SIZE))
+        rows, next_cursor = ledger_page(current_user.id, filters, request.args.get('cursor'), limit)
+    except ValueError as e:
+        return error(str(e) or "Invalid request.")
+    return jsonify(version=g.data_version, items=[txn_to_dict(t) for t in rows], next_cursor=next_cursor)
+
+
+def _apply_txn(t, data, partial):
+    if "txn" in data or not partial:
+        txn = str(data.get("txn") or "").upper()
+        if txn not in ("DEBIT", "CREDIT"):
+            raise ValueError("txn must be DEBIT or CREDIT.")
+        t.txn = txn
+    if "amount" in data or not partial:
+        amount = _decimal(data, "amount", required=True)
+        if amount <= 0:
+            raise ValueError("amount must be positive.")
+        t.amount, t.currency, t.orig_amount = fx.entered(amount, str(data.get("currency") or "").upper())
+    elif "currency" in data:
+        raise ValueError("Send amount along with currency.")
+    if "date" in data or not partial:
+        # a new row without a date is dated now, as the column default would;
+        # set here so the rollups see it (an edit to null leaves it undated)
+        t.txn_date = _when(data) or (None if partial else datetime.utcnow())
+    if "category_id" in data:
+        t.category_id = _category_id(data)
+    if "note" in data:
+        t.note = (data.get("note") or "").strip() or None
+
+
+@api.route('/transactions', methods=['POST'])
+def transaction_create():
+    t = Transaction(user_id=current_user.id)
+    try:
+        _apply_txn(t, _body(), partial=False)
+    except ValueError as e:
+        return error(str(e))
+    db.session.add(t)
+    txn_changed(None, snapshot(t))
+    db.session.commit()
+    return jsonify(txn_to_dict(t)), 201
+
+
+@api.route('/transactions/<int:id>', methods=['PATCH'])
+def transaction_update(id):
+    t = _owned(Transaction, id)
+    if t is None:
+        return error("Not found.", 404)
+    before = snapshot(t)
+    try:
+        _apply_txn(t, _body(), partial=True)
+    except ValueError as e:
+        db.session.rollback()
+        return error(str(e))
+    txn_changed(before, snapshot(t))
+    db.session.commit()
+    return jsonify(txn_to_dict(t))
+
+
+@api.route('/transactions/<int:id>', methods=['DELETE'])
+def transaction_delete(id):
+    t = _owned(Transaction, id)
+    if t is None:
+        return error("Not found.", 404)
+    txn_changed(snapshot(t), None)
+    db.session.delete(t)
+    db.session.commit()
+    return "", 204
+
+
+# ---- categories ----
+@api.route('/categories')
+@conditional()
+def categories():
+    rows = Category.query.filter_by(user_id=current_user.id).order_by(Category.name, Category.id)
+    return jsonify(version=g.data_version, items=[category_to_dict(c) for c in rows])
+
+
+def _category_name(data, exclude_id=None):
+    name = str(data.get("name") or "").strip()
+    if not name:
+        raise ValueError("Category name cannot be empty.")
+    existing = Category.query.filter_by(user_id=current_user.id, name=name).first()
+    if existing and existing.id != exclude_id:
+        raise ValueError("Category name already exists.")
+    return name
+
+
+@api.route('/categories', methods=['POST'])
+def category_create():
+    try:
+        name = _category_name(_body())
+    except ValueError as e:
+        return error(str(e))
+    c = Category(name=name, user_id=current_user.id)
+    db.session.add(c)
+    db.session.commit()
+    return jsonify(category_to_dict(c)), 201
+
+
+@api.route('/categories/<int:id>', methods=['PATCH'])
+def category_update(id):
+    c = _owned(Category, id)
+    if c is None:
+        return error("Not found.", 404)
+    try:
+        c.name = _category_name(_body(), exclude_id=c.id)
+    except ValueError as e:
+        return error(str(e))
+    db.session.commit()
+    return jsonify(category_to_dict(c))
+
+
+@api.route('/categories/<int:id>', methods=['DELETE'])
+def category_delete(id):
+    c = _owned(Category, id)
+    if c is None:
+        return error("Not found.", 404)
+    db.session.delete(c)
+    db.session.flush()
+    rollups.rebuild(current_user.id)    # its transactions are now uncategorized
+    db.session.commit()
+    invalidate_goals(current_user.id)
+    return "", 204
+
+
+# ---- trades ----
+@api.route('/trades')
+@conditional()
+def trades():
+    """?coin_id= for one coin; newest first."""
+    coin_id = request.args.get('coin_id', type=int)
+    rows = portfolio_data.trades(current_user.id, coin_id)
+    return jsonify(version=g.data_version, items=[trade_to_dict(t) for t in rows])
+
+
+def _trade_fields(data, partial):
+    side = str(data.get("side") or "").upper() or None
+    if side is None and not partial:
+        raise ValueError("side must be BUY or SELL.")
+    qty = _decimal(data, "quantity", required=not partial)
+    total = _decimal(data, "total", required=not partial)
+    price = _decimal(data, "price_per_coin")
+    if price is None and qty and total is not None and not partial:
+        price = total / qty
+    return side, qty, price, total, _when(data)
+
+
+@api.route('/trades', methods=['POST'])
+def trade_create():
+    try:
+        data = _body()
+        coin_id = data.get("coin_id")
+        if not isinstance(coin_id, int):
+            raise ValueError("Missing coin_id.")
+        side, qty, price, total, when = _trade_fields(data, partial=False)
+        t = record_trade(current_user.id, coin_id, side, qty, price, total, when)
+    except ValueError as e:
+        db.session.rollback()
+        return error(str(e))
+    db.session.commit()
+    return jsonify(trade_to_dict(t)), 201
+
+
+@api.route('/trades/<int:id>', methods=['PATCH'])
+def trade_update(id):
+    t = _owned(Trade, id)
+    if t is None:
+        return error("Not found.", 404)
+    try:
+        side, qty, price, total, when = _trade_fields(_body(), partial=True)
+        update_trade(t, side, qty, price, total, when)
+    except ValueError as e:
+        db.session.rollback()
+        return error(str(e))
+    db.session.commit()
+    return jsonify(trade_to_dict(t))
+
+
+@api.route('/trades/<int:id>', methods=['DELETE'])
+def trade_delete(id):
+    t = _owned(Trade, id)
+    if t is None:
+        return error("Not found.", 404)
+    try:
+        delete_trade(t)
+    except ValueError as e:
+        db.session.rollback()
+        return error(str(e))
+    db.session.commit()
+    return "", 204
+
+
+# ---- portfolio ----
+@api.route('/portfolio')
+@conditional(with_prices=True)
+def portfolio():
+    """Holdings with FIFO figures at snapshot prices, and totals."""
+    hold = portfolio_data.holdings(current_user.id)
+    if ensure_positions(current_user.id, [h.coin_id for h in hold]):
+        db.session.commit()
+    rows, prices_as_of = market.market_rows([h.cg_id for h in hold if h.cg_id])
+    prices = {r["id"]: Decimal(str(r.get("current_price") or 0)) for r in rows if r.get("id")}
+    calc_map, totals = portfolio_data.valuation(current_user.id, hold, prices)
+
+    num = lambda x: str(x) if x is not None else None
+    items = []
+    for h in hold:
+        calc = calc_map.get(h.coin_id)
+        item = {"coin_id": h.coin_id, "cg_id": h.cg_id, "name": h.name, "symbol": h.symbol,
+                "quantity": str(h.quantity), "invested": str(h.invested), "price": num(prices.get(h.cg_id))}
+        if calc:
+            item.update({k: num(v) for k, v in calc.items()})
+        items.append(item)
+    return jsonify(version=g.data_version, prices_as_of=prices_as_of,
+                   totals={k: num(v) for k, v in totals.items()}, holdings=items)
@@ -1,11 +1,18 @@
 from flask import Blueprint, url_for, render_template, request, flash, redirect
 from .models import User, Category
-from werkzeug.security import generate_password_hash, check_password_hash
-from . import db
+from . import db, identity, passwords
 from flask_login import login_required, login_user, current_user, logout_user
+from sqlalchemy.exc import IntegrityError
 
 auth = Blueprint('auth', __name__)
 
+
+def busy(message, template):
+    """The form again with a 429 while password hashing is saturated (passwords.py)."""
+    flash(message, category='error')
+    return render_template(template, user=current_user), 429, {"Retry-After": "2"}
+
+
 @auth.route('/login', methods=['GET', 'POST'])
 def login():
 
@@ -13,11 +20,26 @@ def login():
         email = request.form.get('email')
         password = request.form.get('password')
 
-        user = User.query.filter_by(email=email).first()
+        user = (db.session.query(User.id, User.username, User.email, User.currency, User.password)
+                .filter_by(email=email).first())
+        # a POST holds SQLite's write lock from its first query; don't keep it while hashing
+        db.session.rollback()
         if user:
-            if check_password_hash(user.password, password):
+            keys = passwords.client_keys(email)
+            try:
+                ok = passwords.verify(user.password, password, keys)
+            except passwords.Busy as e:
+                return busy(str(e), 'login.html')
+            if ok:
+                if passwords.needs_rehash(user.password):
+                    try:
+                        hashed = passwords.hash_password(password, keys)
+                        User.query.filter_by(id=user.id).update({"password": hashed})
+                        db.session.commit()
+                    except passwords.Busy:
+                        pass                # keep the old hash; try again next login
                 flash('Logged In Successfully!', category='success')
-                login_user(user, remember=True)
+                login_user(identity.of(user), remember=True)
                 return redirect(url_for('views.home'))
             else:
                 flash('Email and Password does not match or invalid.', category='error')
@@ -53,23 +75,33 @@ def register():
             existing_user = User.query.filter(
                 (User.email == email) | (User.username == username)
             ).first()
+            db.session.rollback()       # release the write lock while hashing, as in login()
             if existing_user:
                 flash('Email or username already in use.', category='error')
             else:
+                try:
+                    hashed = passwords.hash_password(password, passwords.client_keys(email))
+                except passwords.Busy as e:
+                    return busy(str(e), 'signup.html')
                 new_user = User(
                     username=username,
                     email=email,
-                    password=generate_password_hash(password, method='pbkdf2:sha256')
+                    password=hashed
                 )
                 db.session.add(new_user)
-                db.session.commit()
+                try:
+                    db.session.commit()
+                except IntegrityError:      # taken by another signup meanwhile
+                    db.session.rollback()
+                    flash('Email or username already in use.', category='error')
+                    return render_template('signup.html', user=current_user)
 
 #default category
                 def_cat = Category(name="None", user_id=new_user.id)
                 db.session.add(def_cat)
                 db.session.commit()
 
-                login_user(new_user, remember=True)
+                login_user(identity.of(new_user), remember=True)
                 flash('Account Created Successfully!', category='success')
 
                 return redirect(url_for('views.home'))
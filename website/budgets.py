@@ -0,0 +1,86 @@
+from datetime import date
+from decimal import Decimal
+from sqlalchemy import and_, func, or_
+from . import db, rollups
+from .models import Budget, SpendRollup
+
+# Budgets are monthly limits per category (category_id NULL = all spending).
+# Spent amounts come from the monthly SpendRollup counters that every DEBIT
+# write already bumps, so evaluation costs one indexed lookup per budget no
+# matter how many transactions sit behind it.
+
+CENTS = Decimal("0.01")
+
+
+def current_month():
+    return date.today().strftime(rollups.PERIODS["m"])
+
+
+def _seed_missing(user_ids=None):
+    """Build rollups for budget owners who have none yet (first run only)."""
+    has_rows = db.session.query(SpendRollup.id).filter(SpendRollup.user_id == Budget.user_id).exists()
+    q = db.session.query(Budget.user_id).filter(~has_rows).distinct()
+    if user_ids is not None:
+        q = q.filter(Budget.user_id.in_(user_ids))
+    seeded = [u for (u,) in q]
+    for user_id in seeded:
+        rollups.rebuild(user_id)
+    if seeded:
+        db.session.commit()
+
+
+def spent_query(month, user_ids=None):
+    """(budget id, user, category, limit, spent) per budget for one month."""
+    spent = func.coalesce(func.sum(SpendRollup.debit), 0)
+    q = (db.session.query(Budget.id, Budget.user_id, Budget.category_id, Budget.amount, spent)
+         .outerjoin(SpendRollup, and_(
+             SpendRollup.user_id == Budget.user_id,
+             SpendRollup.period == "m",
+             SpendRollup.bucket == month,
+             or_(Budget.category_id.is_(None), SpendRollup.category_id == Budget.category_id)))
+         .group_by(Budget.id, Budget.user_id, Budget.category_id, Budget.amount)
+         .order_by(Budget.user_id, Budget.id))
+    if user_ids is not None:
+        q = q.filter(Budget.user_id.in_(user_ids))
+    return q
+
+
+def evaluate_all(month=None, user_ids=None, threshold=None):
+    """Spent vs. limit for every budget in one grouped query -> [dict], ordered by user.
+    threshold: only return budgets at or above this fraction of their limit (1.0 = over)."""
+    month = month or current_month()
+    _seed_missing(user_ids)
+
+    out = []
+    for budget_id, user_id, category_id, limit, used in spent_query(month, user_ids):
+        limit = Decimal(str(limit)).quantize(CENTS)
+        used = Decimal(str(used)).quantize(CENTS)
+        ratio = (used / limit) if limit > 0 else None
+        if threshold is not None and (ratio is None or ratio < Decimal(str(threshold))):
+            continue
+        out.append({
+            "budget_id": budget_id, "user_id": user_id, "category_id": category_id, "month": month,
+            "limit": limit, "spent": used, "remaining": limit - used,
+            "pct": float(ratio * 100) if ratio is not None else None,
+            "over": used > limit,
+        })
+    return out
+
+
+def evaluate(user_id, month=None):
+    return evaluate_all(month, [user_id])
+
+
+def set_budget(user_id, category_id, amount):
+    """Create/replace the budget for (user, category); amount <= 0 removes it. Caller commits."""
+    row = Budget.query.filter_by(user_id=user_id, category_id=category_id).first()
+    if amount <= 0:
+        if row is not None:
+            db.session.delete(row)
+        return None
+    if row is None:
+        row = Budget(user_id=user_id, category_id=category_id, amount=amount)
+        db.session.add(row)
+    else:
+        row.amount = amount
+    return row
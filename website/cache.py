@@ -0,0 +1,224 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from time import time, sleep
+
+# Shared cache for upstream JSON (and anything else JSON-serializable).
+#   memory: per-process LRU + TTL, bounded by entry count
+#   sqlite: one file shared by every worker process; LRU by last use, TTL per entry
+# get_or_fetch() collapses concurrent misses on a key into a single fetch:
+# threads wait on a lock, other processes (sqlite backend) wait on a lease row.
+
+
+class _Stats:
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.collapsed = 0
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def stats(self):
+        return {"backend": self.name, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "collapsed": self.collapsed, "size": self.size()}
+
+
+class MemoryCache(_Stats):
+    name = "memory"
+
+    def __init__(self, maxsize=1024):
+        super().__init__()
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, count=True):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] <= time():
+                del self._data[key]
+                item = None
+            if item is not None:
+                self._data.move_to_end(key)
+        if count:
+            self._count("hits" if item is not None else "misses")
+        return item[0] if item is not None else None
+
+    def set(self, key, val, ttl=60):
+        evicted = 0
+        with self._lock:
+            self._data[key] = (val, time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                evicted += 1
+        if evicted:
+            self._count("evictions", evicted)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def size(self):
+        return len(self._data)
+
+    # leases for this process only, like the cache itself; same expiry as SQLiteCache
+    def acquire(self, key, ttl):
+        now = time()
+        with self._lock:
+            if self._leases.get(key, 0) >= now:
+                return False
+            self._leases[key] = now + ttl
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self._leases.pop(key, None)
+
+
+class SQLiteCache(_Stats):
+    name = "sqlite"
+
+    def __init__(self, path, maxsize=4096):
+        super().__init__()
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, val TEXT NOT NULL, exp REAL NOT NULL, used REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_used ON cache (used)")
+        conn.execute("CREATE TABLE IF NOT EXISTS lease (key TEXT PRIMARY KEY, until REAL NOT NULL)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, count=True):
+        now = time()
+        conn = self._conn()
+        row = conn.execute("SELECT val FROM cache WHERE key = ? AND exp > ?", (key, now)).fetchone()
+        if row is None:
+            if count:
+                self._count("misses")
+            return None
+        conn.execute("UPDATE cache SET used = ? WHERE key = ?", (now, key))
+        if count:
+            self._count("hits")
+        return json.loads(row[0])
+
+    def set(self, key, val, ttl=60):
+        now = time()
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO cache (key, val, exp, used) VALUES (?, ?, ?, ?)",
+                     (key, json.dumps(val, default=str), now + ttl, now))
+        over = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.maxsize
+        if over > 0:
+            conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY exp > ?, used LIMIT ?)",
+                         (now, over))
+            self._count("evictions", over)
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._conn().execute("DELETE FROM cache")
+
+    def size(self):
+        return self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def acquire(self, key, ttl):
+        now = time()
+        conn = self._conn()
+        conn.execute("DELETE FROM lease WHERE key = ? AND until < ?", (key, now))
+        return conn.execute("INSERT OR IGNORE INTO lease (key, until) VALUES (?, ?)", (key, now + ttl)).rowcount == 1
+
+    def release(self, key):
+        self._conn().execute("DELETE FROM lease WHERE key = ?", (key,))
+
+
+_backend = MemoryCache()
+_stripes = [threading.Lock() for _ in range(256)]
+
+
+def init_cache(app):
+    global _backend
+    kind = app.config.get("CACHE_BACKEND", "memory")
+    maxsize = int(app.config.get("CACHE_MAX_ENTRIES", 2048))
+    if kind == "sqlite":
+        path = app.config.get("CACHE_PATH") or os.path.join(app.instance_path, "cache.db")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _backend = SQLiteCache(path, maxsize)
+    else:
+        _backend = MemoryCache(maxsize)
+    return _backend
+
+
+def cache_key(key):
+    return key if isinstance(key, str) else json.dumps(key, default=str, separators=(",", ":"))
+
+
+def cache_get(key):
+    return _backend.get(cache_key(key))
+
+
+def cache_set(key, val, ttl=60):
+    _backend.set(cache_key(key), val, ttl)
+
+
+def cache_delete(key):
+    _backend.delete(cache_key(key))
+
+
+def cache_stats():
+    return _backend.stats()
+
+
+def cache_lease(key, ttl):
+    """True for exactly one caller (per backend scope) until the lease expires."""
+    return _backend.acquire(cache_key(("lease", key)), ttl)
+
+
+def get_or_fetch(key, fetch, ttl=60, wait=10):
+    """Cached value for key, else fetch() once across threads/processes. None results are not cached."""
+    k = cache_key(key)
+    val = _backend.get(k)
+    if val is not None:
+        return val
+
+    with _stripes[hash(k) % len(_stripes)]:
+        val = _backend.get(k, count=False)   # filled while we waited on the lock
+        if val is not None:
+            _backend._count("collapsed")
+            return val
+
+        if not _backend.acquire(k, wait):
+            # another process is fetching it; give it until its lease runs out
+            deadline = time() + wait
+            while time() < deadline:
+                sleep(0.05)
+                val = _backend.get(k, count=False)
+                if val is not None:
+                    _backend._count("collapsed")
+                    return val
+
+        try:
+            val = fetch()
+        finally:
+            _backend.release(k)
+
+        if val is not None:
+            _backend.set(k, val, ttl)
+        return val
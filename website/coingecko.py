@@ -0,0 +1,185 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time, sleep, perf_counter
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from .cache import get_or_fetch
+from .metrics import observe_upstream
+
+load_dotenv()
+
+# overridable so the app can be pointed at a local stub server
+CG_PRO = os.getenv("CG_PRO_URL", "https://pro-api.coingecko.com/api/v3").rstrip("/")
+CG_PUB = os.getenv("CG_PUB_URL", "https://api.coingecko.com/api/v3").rstrip("/")
+
+# HTTP client: one keep-alive Session per process, at most CG_MAX_CONCURRENCY
+# requests in flight, and a per-host limiter. A 429 blocks that host until its
+# Retry-After has passed; callers that would wait longer than `max_wait` fail fast
+# (and fall back / serve the snapshot) instead of tying up a request thread.
+CG_MAX_CONCURRENCY = int(os.getenv("CG_MAX_CONCURRENCY", "4"))
+CG_RATE_PER_MIN = float(os.getenv("CG_RATE_PER_MIN", "30"))     # per host; 0 = unlimited
+CG_TIMEOUT = float(os.getenv("CG_TIMEOUT", "10"))
+
+
+def cg_headers():
+    headers = {"accept": "application/json"}
+    api_key = os.getenv("CG_API_KEY", "").strip()
+    if api_key:
+        headers["x-cg-pro-api-key"] = api_key
+    return headers
+
+
+class HostLimiter:
+    """Spaces requests to a host evenly at `per_min`, and honours 429 Retry-After."""
+
+    def __init__(self, per_min):
+        self.interval = 60.0 / per_min if per_min > 0 else 0.0
+        self._next = {}          # host -> earliest time the next request may start
+        self._lock = threading.Lock()
+
+    def acquire(self, host, max_wait):
+        with self._lock:
+            now = time()
+            start = max(now, self._next.get(host, 0.0))
+            if start - now > max_wait:
+                return False
+            self._next[host] = start + self.interval
+        if start > now:
+            sleep(start - now)
+        return True
+
+    def block(self, host, seconds):
+        with self._lock:
+            self._next[host] = max(self._next.get(host, 0.0), time() + seconds)
+
+
+class HttpStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = self.errors = self.throttled = self.rate_limited = 0
+        self.latency_total = self.latency_max = 0.0
+        self.in_flight = 0
+
+    def record(self, seconds, ok, status=None):
+        with self._lock:
+            self.requests += 1
+            self.errors += 0 if ok else 1
+            self.throttled += 1 if status == 429 else 0
+            self.latency_total += seconds
+            self.latency_max = max(self.latency_max, seconds)
+
+
+_session = None
+_session_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(CG_MAX_CONCURRENCY)
+_pool = ThreadPoolExecutor(max_workers=CG_MAX_CONCURRENCY, thread_name_prefix="coingecko")
+limiter = HostLimiter(CG_RATE_PER_MIN)
+stats = HttpStats()
+
+
+def session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=CG_MAX_CONCURRENCY, max_retries=0)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+
+def http_stats():
+    """Upstream request counters, latency and connections opened by the pool."""
+    opened = 0
+    if _session is not None:
+        for adapter in set(_session.adapters.values()):
+            for pool in list(adapter.poolmanager.pools._container.values()):
+                opened += getattr(pool, "num_connections", 0)
+    with stats._lock:
+        n = stats.requests
+        return {"requests": n, "errors": stats.errors, "throttled_429": stats.throttled,
+                "rate_limited": stats.rate_limited, "in_flight": stats.in_flight,
+                "latency_avg_ms": round(stats.latency_total / n * 1000, 1) if n else None,
+                "latency_max_ms": round(stats.latency_max * 1000, 1),
+                "connections_opened": opened}
+
+
+def _retry_after(r):
+    try:
+        return max(1.0, float(r.headers.get("Retry-After", 60)))
+    except ValueError:
+        return 60.0
+
+
+def _get(url, headers=None, params=None, max_wait=5.0):
+    """One pooled, rate-limited GET -> parsed JSON (dict/list) or None."""
+    host = urlsplit(url).netloc
+    if not limiter.acquire(host, max_wait):
+        with stats._lock:
+            stats.rate_limited += 1
+        return None
+
+    with _slots:
+        with stats._lock:
+            stats.in_flight += 1
+        t0 = perf_counter()
+        r, data = None, None
+        try:
+            r = session().get(url, headers=headers, params=params, timeout=CG_TIMEOUT)
+            data = r.json()
+        except Exception:
+            data = None
+        finally:
+            with stats._lock:
+                stats.in_flight -= 1
+
+    ok = r is not None and r.status_code == 200 and isinstance(data, (dict, list))
+    stats.record(perf_counter() - t0, ok, r.status_code if r is not None else None)
+    if r is not None and r.status_code == 429:
+        limiter.block(host, _retry_after(r))
+    return data if ok else None
+
+
+def fetch_json(url, headers=None, params=None, fallback_url=None, max_wait=5.0):
+    """GET -> .json(), trying the public fallback on failure. None if both fail."""
+    data = _get(url, headers, params, max_wait)
+    if data is None and fallback_url:
+        data = _get(fallback_url, None, params, max_wait)
+    return data
+
+
+def fetch_many(calls, max_wait=5.0):
+    """Run fetch_json for each (url, headers, params, fallback_url) on the bounded pool.
+    -> results in the same order (None for failures)."""
+    t0 = perf_counter()
+    futures = [_pool.submit(fetch_json, *call, max_wait=max_wait) for call in calls]
+    out = [f.result() for f in futures]
+    if calls:
+        observe_upstream(perf_counter() - t0, hit=False)
+    return out
+
+
+def cg_get_json(url, headers=None, params=None, ttl=60, fallback_url=None):
+    """Cached GET -> .json(). Never caches errors. Optional public fallback.
+    Concurrent misses for the same request share one upstream fetch."""
+    key = (url, tuple(sorted((params or {}).items())))
+    fetched = []
+
+    def fetch():
+        fetched.append(True)
+        return fetch_json(url, headers, params, fallback_url)
+
+    t0 = perf_counter()
+    data = get_or_fetch(key, fetch, ttl)
+    observe_upstream(perf_counter() - t0, hit=not fetched)
+    if data is not None:
+        return data
+
+    if url.endswith("/coins/markets"):
+        return []
+    return {"coins": []}
@@ -0,0 +1,289 @@
+import click
+from flask.cli import AppGroup
+
+ledger_cli = AppGroup('ledger', help='Ledger maintenance.')
+lots_cli = AppGroup('lots', help='Persisted FIFO lot maintenance.')
+pnl_cli = AppGroup('pnl', help='Portfolio PnL reports.')
+market_cli = AppGroup('market', help='Market data snapshot.')
+budget_cli = AppGroup('budget', help='Budget evaluation.')
+export_cli = AppGroup('export', help='Streaming data exports.')
+db_cli = AppGroup('db', help='Schema migrations and query plans.')
+
+
+@ledger_cli.command('reconcile')
+@click.option('--fix', is_flag=True, help='Rewrite drifted balances from a full recount.')
+def reconcile(fix):
+    """Check materialized balances against the transaction table."""
+    from .ledger import reconcile_balances
+
+    drift = reconcile_balances(fix=fix)
+    for user_id, stored, actual in drift:
+        click.echo(f"user {user_id}: stored={stored} actual={actual}")
+    if not drift:
+        click.echo("All balances match.")
+    elif fix:
+        click.echo(f"Fixed {len(drift)} balance(s).")
+    else:
+        raise SystemExit(1)
+
+
+@ledger_cli.command('rollups')
+@click.option('--fix', is_flag=True, help='Rebuild users whose rollups drifted.')
+def ledger_rollups(fix):
+    """Check spend rollups against a rebuild from the transaction table."""
+    from .rollups import verify
+
+    bad = verify(fix=fix)
+    for user_id in bad:
+        click.echo(f"user {user_id}: rollups differ")
+    if not bad:
+        click.echo("All rollups match.")
+    elif fix:
+        click.echo(f"Rebuilt {len(bad)} user(s).")
+    else:
+        raise SystemExit(1)
+
+
+@ledger_cli.command('import')
+@click.argument('user_id', type=int)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ofx']), help='Default: from the file extension.')
+def ledger_import(user_id, path, fmt):
+    """Import a bank statement (CSV/OFX) into a user's ledger."""
+    from .importer import import_transactions, reader_for
+
+    try:
+        read = reader_for(path, fmt)
+        with open(path, encoding='utf-8-sig', errors='replace', newline='') as fh:
+            res = import_transactions(user_id, read(fh))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for err in res['errors']:
+        click.echo(err, err=True)
+    click.echo(f"read={res['read']} inserted={res['inserted']} duplicates={res['duplicates']} "
+               f"skipped={res['skipped']} in {res['seconds']}s ({res['rows_per_sec']} rows/s)")
+
+
+@lots_cli.command('verify')
+@click.option('--fix', is_flag=True, help='Rebuild any (user, coin) that differs from a full replay.')
+def lots_verify(fix):
+    """Check persisted lots and realized PnL against a full FIFO replay."""
+    from .lots import verify
+
+    bad = verify(fix=fix)
+    for user_id, coin_id, reason in bad:
+        click.echo(f"user {user_id} coin {coin_id}: {reason}")
+    if not bad:
+        click.echo("All positions match the replay.")
+    elif fix:
+        click.echo(f"Rebuilt {len({(u, c) for u, c, _ in bad})} position(s).")
+    else:
+        raise SystemExit(1)
+
+
+@lots_cli.command('rebuild')
+def lots_rebuild():
+    """Replay every (user, coin) from scratch."""
+    from . import db
+    from .models import Trade
+    from .lots import rebuild
+
+    pairs = db.session.query(Trade.user_id, Trade.coin_id).distinct().all()
+    for user_id, coin_id in pairs:
+        rebuild(user_id, coin_id)
+    db.session.commit()
+    click.echo(f"Rebuilt {len(pairs)} position(s).")
+
+
+@lots_cli.command('import')
+@click.argument('user_id', type=int)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def lots_import(user_id, path):
+    """Import an exchange fill history (CSV) and recompute each affected position once."""
+    from .fills import import_fills, read_fills
+
+    try:
+        with open(path, encoding='utf-8-sig', errors='replace', newline='') as fh:
+            res = import_fills(user_id, read_fills(fh))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for err in res['errors']:
+        click.echo(err, err=True)
+    click.echo(f"read={res['read']} inserted={res['inserted']} skipped={res['skipped']} coins={res['coins']} "
+               f"in {res['seconds']}s ({res['fills_per_sec']} fills/s)")
+
+
+@pnl_cli.command('report')
+@click.option('--user-id', type=int, multiple=True, help='Limit to these users (repeatable).')
+@click.option('--no-prices', is_flag=True, help='Skip the market fetch; report cost basis and realized only.')
+@click.option('--json', 'as_json', is_flag=True, help='One JSON object per (user, coin).')
+def pnl_report(user_id, no_prices, as_json):
+    """Batch FIFO PnL for every (user, coin) in one pass."""
+    import json
+    from decimal import Decimal
+    from . import db
+    from .models import Coin
+    from .fifo_batch import load_columns, batch_fifo, with_prices
+
+    res = batch_fifo(load_columns(list(user_id) or None))
+
+    prices = {}
+    coin_ids = sorted({int(c) for c in res["coin_id"]})
+    if coin_ids and not no_prices:
+        from .coingecko import cg_get_json, cg_headers, CG_PRO, CG_PUB
+        cg = dict(db.session.query(Coin.cg_id, Coin.id).filter(Coin.id.in_(coin_ids)))
+        rows = cg_get_json(f"{CG_PRO}/coins/markets", headers=cg_headers(),
+                           params={"vs_currency": "inr", "ids": ",".join(sorted(cg))},
+                           fallback_url=f"{CG_PUB}/coins/markets")
+        for row in rows if isinstance(rows, list) else []:
+            if isinstance(row, dict) and row.get("id") in cg and row.get("current_price") is not None:
+                prices[cg[row["id"]]] = Decimal(str(row["current_price"]))
+    res = with_prices(res, prices)
+
+    fields = ("qty", "invested", "realized", "value", "unrealized", "pnl", "pnl_pct")
+    for i in range(len(res["qty"])):
+        row = {"user_id": int(res["user_id"][i]), "coin_id": int(res["coin_id"][i])}
+        row.update({f: (None if res[f][i] is None else str(res[f][i])) for f in fields})
+        if as_json:
+            click.echo(json.dumps(row))
+        else:
+            click.echo(" ".join(f"{k}={v}" for k, v in row.items()))
+
+
+@market_cli.command('refresh')
+def market_refresh():
+    """Refresh the market snapshot once (for cron, or with MARKET_REFRESH=0)."""
+    from .market import held_coin_ids, refresh_markets, refresh_trending
+
+    n = len(refresh_markets(held_coin_ids()))
+    click.echo(f"Stored {n} market row(s); trending {'ok' if refresh_trending() else 'failed'}.")
+
+
+@market_cli.command('prune')
+def market_prune():
+    """Apply price history retention (minute and hour ticks)."""
+    from flask import current_app
+    from .prices import prune
+
+    n = prune(current_app.config.get("PRICE_KEEP_MINUTES_DAYS", 2),
+              current_app.config.get("PRICE_KEEP_HOURS_DAYS", 90))
+    click.echo(f"Deleted {n} price tick(s).")
+
+
+@budget_cli.command('check')
+@click.option('--month', help='YYYY-MM (default: current month).')
+@click.option('--threshold', type=float, default=1.0, show_default=True,
+              help='Report budgets at or above this fraction of their limit.')
+@click.option('--json', 'as_json', is_flag=True, help='One JSON object per budget.')
+def budget_check(month, threshold, as_json):
+    """Evaluate every user's budgets in one pass and list the ones over threshold."""
+    import json
+    from .budgets import evaluate_all
+
+    hits = evaluate_all(month, threshold=threshold)
+    for b in hits:
+        if as_json:
+            click.echo(json.dumps(b, default=str))
+        else:
+            click.echo(f"user {b['user_id']} category {b['category_id'] or 'all'}: "
+                       f"spent={b['spent']} limit={b['limit']} ({b['pct']:.0f}%)")
+    if not hits and not as_json:
+        click.echo("No budgets over threshold.")
+
+
+def _export(kind, user_id, out, fmt, date_from, date_to):
+    from .export import export
+    from .ledger import parse_filters
+
+    fmt = fmt or out.name.rsplit('.', 1)[-1].lower()
+    try:
+        body = export(kind, fmt, user_id, parse_filters({'from': date_from, 'to': date_to}))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for part in body:
+        out.write(part)
+
+
+_export_options = [
+    click.argument('user_id', type=int),
+    click.argument('out', type=click.File('wb')),
+    click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl', 'parquet']),
+                 help='Default: from the file extension.'),
+    click.option('--from', 'date_from', help='YYYY-MM-DD (inclusive).'),
+    click.option('--to', 'date_to', help='YYYY-MM-DD (inclusive).'),
+]
+
+
+def _with_export_options(f):
+    for option in reversed(_export_options):
+        f = option(f)
+    return f
+
+
+@export_cli.command('transactions')
+@_with_export_options
+def export_transactions(**kw):
+    """Stream a user's transactions to OUT ('-' for stdout)."""
+    _export('transactions', **kw)
+
+
+@export_cli.command('trades')
+@_with_export_options
+def export_trades(**kw):
+    """Stream a user's trades to OUT ('-' for stdout)."""
+    _export('trades', **kw)
+
+
+@db_cli.command('upgrade')
+@click.option('--to', 'target', type=int, help='Stop at this version (default: latest).')
+def db_upgrade(target):
+    """Apply pending schema migrations."""
+    from .migrations import HEAD, upgrade
+
+    created, applied = upgrade(target or HEAD)
+    if created:
+        click.echo(f"Created a new database at version {HEAD}.")
+    for version, name in applied:
+        click.echo(f"Applied {version}: {name}")
+    if not created and not applied:
+        click.echo("Schema is up to date.")
+
+
+@db_cli.command('current')
+def db_current():
+    """Show the schema version of the database."""
+    from .migrations import HEAD, current
+
+    version = current()
+    click.echo(f"version {version} (latest {HEAD})" + ("" if version >= HEAD else " - run 'flask db upgrade'"))
+
+
+@db_cli.command('explain')
+@click.option('--verbose', '-v', is_flag=True, help='Print every plan, not just the problems.')
+def db_explain(verbose):
+    """Check the hot queries' EXPLAIN QUERY PLAN for table scans and sorts (SQLite)."""
+    from . import db
+    from .queryplans import check
+
+    if db.engine.dialect.name != "sqlite":
+        raise click.ClickException("EXPLAIN QUERY PLAN checks need SQLite.")
+    bad = 0
+    for name, plan, problems in check():
+        bad += bool(problems)
+        if problems or verbose:
+            click.echo(f"{'FAIL' if problems else 'ok  '} {name}")
+            for line in plan:
+                click.echo(f"       {line}")
+    if bad:
+        raise click.ClickException(f"{bad} quer{'y' if bad == 1 else 'ies'} without a usable index.")
+    click.echo("All query plans use indexes.")
+
+
+def register_commands(app):
+    app.cli.add_command(ledger_cli)
+    app.cli.add_command(lots_cli)
+    app.cli.add_command(pnl_cli)
+    app.cli.add_command(market_cli)
+    app.cli.add_command(budget_cli)
+    app.cli.add_command(export_cli)
+    app.cli.add_command(db_cli)
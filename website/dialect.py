@@ -0,0 +1,90 @@
+from sqlalchemy import Integer, String, cast, event, extract, func
+from . import db
+
+# The few places where SQL differs between SQLite and PostgreSQL, plus the
+# engine setup for each backend.
+
+
+def normalize_url(url):
+    # Heroku-style URLs; SQLAlchemy only accepts postgresql://
+    return "postgresql://" + url[len("postgres://"):] if url.startswith("postgres://") else url
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for config['SQLALCHEMY_DATABASE_URI']."""
+    url = config["SQLALCHEMY_DATABASE_URI"]
+    if url.startswith("postgresql"):
+        return {
+            "pool_size": config["DB_POOL_SIZE"],
+            "max_overflow": config["DB_MAX_OVERFLOW"],
+            "pool_timeout": config["DB_POOL_TIMEOUT"],
+            "pool_recycle": config["DB_POOL_RECYCLE"],
+            "pool_pre_ping": True,
+            "connect_args": {"options": f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']} -c timezone=UTC"},
+        }
+    if url.startswith("sqlite"):
+        # sqlite3's own busy handler; the PRAGMA below sets the same thing explicitly
+        return {"connect_args": {"timeout": config["SQLITE_BUSY_TIMEOUT_MS"] / 1000}}
+    return {}
+
+
+def configure_engine(app):
+    """Per-connection SQLite pragmas and write-transaction handling (no-op elsewhere)."""
+    engine = db.engine
+    if engine.dialect.name != "sqlite":
+        return
+    config = app.config
+    pragmas = [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+    ]
+    immediate = config["SQLITE_IMMEDIATE_WRITES"]
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, _record):
+        # take transaction control away from sqlite3 so "begin" below decides how to BEGIN
+        dbapi_conn.isolation_level = None
+        cur = dbapi_conn.cursor()
+        for pragma in pragmas:
+            cur.execute(pragma)
+        cur.close()
+
+    @event.listens_for(engine, "begin")
+    def _on_begin(conn):
+        # A deferred transaction that reads and then writes cannot wait for the
+        # write lock once another connection has committed (SQLITE_BUSY, no retry),
+        # so anything that may write takes the lock up front and queues on busy_timeout.
+        # Safe-method requests stay deferred and keep reading concurrently under WAL.
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if immediate and _may_write() else "BEGIN")
+
+
+def _may_write():
+    from flask import has_request_context, request
+    return not has_request_context() or request.method not in ("GET", "HEAD", "OPTIONS")
+
+
+def insert(model):
+    """Core INSERT for model's table supporting .on_conflict_do_update() on the current
+    backend (Core, so a list of parameter dicts runs as one executemany)."""
+    if db.session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as _insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as _insert
+    return _insert(model.__table__)
+
+
+def month_label(col):
+    """'YYYY-MM' of a datetime column, like strftime('%Y-%m')."""
+    if db.session.get_bind().dialect.name == "postgresql":
+        return func.to_char(col, "YYYY-MM")
+    return func.strftime("%Y-%m", col)
+
+
+def week_label(col):
+    """'YYYY-Www' with Monday-based week numbers (00 before the first Monday), like strftime('%Y-W%W')."""
+    if db.session.get_bind().dialect.name == "postgresql":
+        week = cast(func.floor((extract("doy", col) + 7 - extract("isodow", col)) / 7), Integer)
+        return func.concat(func.to_char(col, "YYYY"), "-W", func.lpad(cast(week, String), 2, "0"))
+    return func.strftime("%Y-W%W", col)
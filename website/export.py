@@ -0,0 +1,174 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from . import db
+from .ledger import ledger_query
+from .models import Category, Coin, Trade, Transaction
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:         # optional: only the parquet format needs it
+    pa = pq = None
+
+# Streaming exports. Rows come off the DB cursor in yield_per partitions as plain
+# tuples (no ORM objects) and are encoded one partition at a time, so memory is
+# bounded by the chunk size and the first bytes go out before the query finishes.
+
+CHUNK = 5000            # rows per partition for the text formats
+ROW_GROUP = 50000       # rows per parquet row group
+
+FORMATS = {             # format -> (mimetype, file extension)
+    "csv": ("text/csv", "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# kind -> ((column name, SQL expression, arrow type), ...)
+COLUMNS = {
+    "transactions": (
+        ("id", Transaction.id, "int64"),
+        ("date", Transaction.txn_date, "timestamp"),
+        ("type", Transaction.txn, "string"),
+        ("amount", Transaction.amount, "decimal:18:2"),
+        ("category", Category.name, "string"),
+        ("note", Transaction.note, "string"),
+        ("currency", Transaction.currency, "string"),           # as entered, when not the base currency
+        ("orig_amount", Transaction.orig_amount, "decimal:18:2"),
+    ),
+    "trades": (
+        ("id", Trade.id, "int64"),
+        ("date", Trade.txn_date, "timestamp"),
+        ("coin", Coin.cg_id, "string"),
+        ("symbol", Coin.symbol, "string"),
+        ("side", Trade.side, "string"),
+        ("quantity", Trade.quantity, "decimal:20:10"),
+        ("price_per_coin", Trade.price_per_coin, "decimal:18:10"),
+        ("total", Trade.total, "decimal:18:2"),
+        ("realized_pnl", Trade.realized_pnl, "decimal:18:2"),
+    ),
+}
+
+
+# ---- queries ----
+def rows_query(kind, user_id, filters):
+    """SELECT of the export columns for a user, oldest first."""
+    cols = [c for _, c, _ in COLUMNS[kind]]
+    if kind == "transactions":
+        q = (ledger_query(user_id, filters)
+             .outerjoin(Category, Category.id == Transaction.category_id)
+             .order_by(Transaction.txn_date, Transaction.id))
+    else:
+        q = (Trade.query.join(Coin, Coin.id == Trade.coin_id)
+             .filter(Trade.user_id == user_id)
+             .order_by(Trade.txn_date, Trade.id))
+        if "from" in filters:
+            q = q.filter(Trade.txn_date >= filters["from"])
+        if "to" in filters:
+            q = q.filter(Trade.txn_date < filters["to"] + timedelta(days=1))
+    return q.with_entities(*cols).statement
+
+
+def partitions(kind, user_id, filters=None, chunk=CHUNK):
+    """Rows as tuples, `chunk` at a time, straight off a streaming cursor."""
+    stmt = rows_query(kind, user_id, filters or {}).execution_options(yield_per=chunk)
+    result = db.session.execute(stmt)
+    try:
+        for rows in result.partitions():
+            yield rows
+    finally:
+        result.close()
+
+
+# ---- encoders ----
+def _text(v):
+    if isinstance(v, datetime):
+        return v.isoformat()
+    return v if v is None or isinstance(v, (int, str)) else str(v)
+
+
+def write_csv(names, parts):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(names)
+    yield buf.getvalue().encode()
+    for rows in parts:
+        buf.seek(0)
+        buf.truncate()
+        w.writerows([_text(v) for v in r] for r in rows)
+        yield buf.getvalue().encode()
+
+
+def write_jsonl(names, parts):
+    for rows in parts:
+        yield "".join(json.dumps(dict(zip(names, map(_text, r)))) + "\n" for r in rows).encode()
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands back what was written since the last drain()."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts, self.pos = [], 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.parts.append(bytes(b))
+        self.pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.pos
+
+    def drain(self):
+        out, self.parts = b"".join(self.parts), []
+        return out
+
+
+def _arrow_type(spec):
+    if spec.startswith("decimal:"):
+        _, p, s = spec.split(":")
+        return pa.decimal128(int(p), int(s))
+    return {"int64": pa.int64(), "string": pa.string(), "timestamp": pa.timestamp("us")}[spec]
+
+
+def write_parquet(columns, parts):
+    """One row group per partition; bytes are flushed after every group."""
+    schema = pa.schema([(name, _arrow_type(spec)) for name, _, spec in columns])
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    yield sink.drain()
+    try:
+        for rows in parts:
+            cols = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(c, type=f.type) for c, f in zip(cols, schema)], schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+# ---- entry point ----
+def export(kind, fmt, user_id, filters=None):
+    """-> iterator of bytes. Raises ValueError on an unknown kind/format before any work is done."""
+    if kind not in COLUMNS:
+        raise ValueError("Unknown export (use transactions or trades).")
+    if fmt not in FORMATS:
+        raise ValueError("Unknown format (use csv, jsonl or parquet).")
+    if fmt == "parquet" and pa is None:
+        raise ValueError("Parquet export needs pyarrow installed.")
+
+    columns = COLUMNS[kind]
+    names = [name for name, _, _ in columns]
+    if fmt == "parquet":
+        return write_parquet(columns, partitions(kind, user_id, filters, ROW_GROUP))
+    writer = write_csv if fmt == "csv" else write_jsonl
+    return writer(names, partitions(kind, user_id, filters))
+
+
+def filename(kind, fmt):
+    return f"{kind}-{datetime.now():%Y%m%d}.{FORMATS[fmt][1]}"
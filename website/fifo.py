@@ -0,0 +1,75 @@
+from collections import deque
+from decimal import Decimal
+
+
+def fifo_pnl_for_coin(trades, current_price: Decimal):
+    lots = deque()
+    realized = Decimal("0")
+
+    for t in trades:
+        qty = Decimal(t.quantity)
+        unit_cost = (Decimal(t.total) / qty) if qty > 0 else Decimal("0")
+
+        if t.side == "BUY":
+            lots.append([qty, unit_cost])
+        else:  
+            to_sell = qty
+            basis = Decimal("0")
+            proceeds = Decimal(t.total)
+            while to_sell > 0 and lots:
+                lot_qty, lot_cost = lots[0]
+                take = min(to_sell, lot_qty)
+                basis += take * lot_cost
+                lot_qty -= take
+                to_sell -= take
+                if lot_qty == 0:
+                    lots.popleft()
+                else:
+                    lots[0][0] = lot_qty
+            realized += proceeds - basis
+
+    return fifo_from_lots(lots, realized, current_price)
+
+
+def fifo_realized_by_trade(trades):
+    lots = deque()
+    out = {}
+
+    for t in trades:
+        qty = Decimal(t.quantity)
+        unit_cost = (Decimal(t.total) / qty) if qty > 0 else Decimal("0")
+
+        if t.side == "BUY":
+            lots.append([qty, unit_cost])
+        else:  # SELL
+            to_sell = qty
+            basis = Decimal("0")
+            proceeds = Decimal(t.total)
+            while to_sell > 0 and lots:
+                lot_qty, lot_cost = lots[0]
+                take = min(to_sell, lot_qty)
+                basis += take * lot_cost
+                lot_qty -= take
+                to_sell -= take
+                if lot_qty == 0:
+                    lots.popleft()
+                else:
+                    lots[0][0] = lot_qty
+            out[t.id] = proceeds - basis
+
+    return out
+
+
+def fifo_from_lots(lots, realized, current_price: Decimal):
+    """Same result as fifo_pnl_for_coin, from already-open [qty, unit_cost] lots."""
+    qty_rem = sum(q for q, _ in lots) if lots else Decimal("0")
+    invested = sum(q * c for q, c in lots) if lots else Decimal("0")
+    value = qty_rem * current_price
+    unrealized = sum(q * (current_price - c) for q, c in lots) if lots else Decimal("0")
+    pnl = realized + unrealized
+    pnl_pct = (pnl / invested * 100) if invested > 0 else None
+
+    return {
+        "qty": qty_rem, "invested": invested, "realized": realized,
+        "unrealized": unrealized, "value": value, "pnl": pnl, "pnl_pct": pnl_pct
+    }
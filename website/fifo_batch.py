@@ -0,0 +1,147 @@
+from decimal import Decimal
+from types import SimpleNamespace
+import numpy as np
+from . import db
+from .models import Trade
+from .fifo import fifo_pnl_for_coin
+from .lots import to_units, from_units
+
+# FIFO for every (user, coin) at once on fixed-point int64 columns:
+# quantities in 1e-10 units (Numeric(20,10)), totals in cents (Numeric(18,2)).
+# Per-group sums must fit in int64, i.e. under ~9.2e8 coins bought per (user, coin).
+#
+# Without overselling, FIFO always consumes the first `sold` units of a group's
+# buys, so group-local cumulative sums are enough: buys before the cut are fully
+# consumed, at most one buy is split, the rest stay open.
+# Only that split lot is priced in Decimal (once per group). Groups that
+# oversell at some point (the replay drops the excess) go through the scalar
+# replay instead.
+# invested and realized come out quantized to cents. At full precision they
+# are not fifo_pnl_for_coin's figures: its per-unit cost total/qty is rounded
+# to 28 digits, so a lot used up over several sells doesn't sum back to its
+# total, where here it does. Rounded to cents the two agree (qty is exact in
+# both); bench/fifo_check.py compares them on random trade histories.
+
+CENTS = Decimal("0.01")
+
+
+def load_columns(user_ids=None):
+    """Trade table -> dict of int64/bool arrays in (user, coin, txn_date, id) order."""
+    q = (db.session.query(Trade.user_id, Trade.coin_id, Trade.side, Trade.quantity, Trade.total)
+         .order_by(Trade.user_id, Trade.coin_id, Trade.txn_date.asc().nulls_first(), Trade.id.asc()))
+    if user_ids is not None:
+        q = q.filter(Trade.user_id.in_(user_ids))
+    rows = q.all()
+
+    return {
+        "user_id": np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)),
+        "coin_id": np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows)),
+        "is_buy": np.fromiter((r[2] == "BUY" for r in rows), dtype=bool, count=len(rows)),
+        "qty": np.fromiter((to_units(r[3]) for r in rows), dtype=np.int64, count=len(rows)),
+        "total": np.fromiter((int(Decimal(r[4]).quantize(CENTS).scaleb(2)) for r in rows), dtype=np.int64, count=len(rows)),
+    }
+
+
+def _cents(c):
+    return Decimal(int(c)).scaleb(-2)
+
+
+def _unit_cost(total_cents, qty_units):
+    qty = from_units(qty_units)
+    return (_cents(total_cents) / qty) if qty > 0 else Decimal("0")
+
+
+def _scalar(cols, lo, hi):
+    rows = [SimpleNamespace(side="BUY" if cols["is_buy"][i] else "SELL",
+                            quantity=from_units(cols["qty"][i]), total=_cents(cols["total"][i]))
+            for i in range(lo, hi)]
+    r = fifo_pnl_for_coin(rows, Decimal("0"))
+    return r["qty"], r["invested"], r["realized"]
+
+
+def batch_fifo(cols):
+    """-> {"user_id", "coin_id": int64 arrays, "qty", "invested", "realized": lists of Decimal}, one entry per group.
+    invested and realized are quantized to cents."""
+    user_id, coin_id, is_buy = cols["user_id"], cols["coin_id"], cols["is_buy"]
+    qty, total = cols["qty"], cols["total"]
+    n = len(qty)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return {"user_id": empty, "coin_id": empty, "qty": [], "invested": [], "realized": []}
+
+    starts = np.flatnonzero(np.r_[True, (user_id[1:] != user_id[:-1]) | (coin_id[1:] != coin_id[:-1])])
+    ends = np.r_[starts[1:], n]
+    sizes = ends - starts
+    groups = len(starts)
+
+    def local_cumsum(x):
+        # cumulative sum restarting at every group start
+        c = np.cumsum(x)
+        return c - np.r_[0, c][starts].repeat(sizes)
+
+    sell_q = np.where(is_buy, 0, qty)
+    buy_q = np.where(is_buy, qty, 0)
+    sold = np.add.reduceat(sell_q, starts)
+    bought = np.add.reduceat(buy_q, starts)
+    proceeds = np.add.reduceat(np.where(is_buy, 0, total), starts)
+
+    # running position inside each group; negative means the replay drops part of a sell
+    oversold = np.minimum.reduceat(local_cumsum(buy_q - sell_q), starts) < 0
+
+    # classify each BUY against the units its group sold: fully consumed, split, or still open
+    upto = local_cumsum(buy_q)                    # units bought up to and including the row
+    before = upto - buy_q
+    cut = sold.repeat(sizes)
+    full = is_buy & (upto <= cut)
+    split = is_buy & (before < cut) & (cut < upto)
+    open_ = is_buy & (before >= cut)
+
+    full_cost = np.add.reduceat(np.where(full, total, 0), starts)
+    after_cost = np.add.reduceat(np.where(open_, total, 0), starts)
+
+    split_row = np.full(groups, -1, dtype=np.int64)
+    rows = np.flatnonzero(split)
+    split_row[np.searchsorted(starts, rows, side="right") - 1] = rows
+    taken = np.where(split_row >= 0, sold - before[np.maximum(split_row, 0)], 0)
+
+    out_qty, out_inv, out_real = [], [], []
+    for g in range(groups):
+        if oversold[g]:
+            q, inv, real = _scalar(cols, starts[g], ends[g])
+        else:
+            q = from_units(bought[g] - sold[g])
+            inv = _cents(after_cost[g])
+            part = Decimal("0")
+            r = split_row[g]
+            if r >= 0:
+                cost = _unit_cost(total[r], qty[r])
+                part = from_units(taken[g]) * cost
+                inv += from_units(qty[r] - taken[g]) * cost
+            real = _cents(proceeds[g]) - _cents(full_cost[g]) - part
+        out_qty.append(q)
+        out_inv.append(inv.quantize(CENTS))
+        out_real.append(real.quantize(CENTS))
+
+    return {
+        "user_id": user_id[starts], "coin_id": coin_id[starts],
+        "qty": out_qty, "invested": out_inv, "realized": out_real,
+    }
+
+
+def with_prices(res, prices):
+    """Add value/unrealized/pnl/pnl_pct per group; prices is {coin_id: Decimal}, missing -> None."""
+    res = dict(res)
+    value, unreal, pnl, pnl_pct = [], [], [], []
+    for coin_id, q, inv, real in zip(res["coin_id"], res["qty"], res["invested"], res["realized"]):
+        price = prices.get(int(coin_id))
+        if price is None:
+            value.append(None); unreal.append(None); pnl.append(None); pnl_pct.append(None)
+            continue
+        v = q * price
+        u = v - inv
+        value.append(v)
+        unreal.append(u)
+        pnl.append(real + u)
+        pnl_pct.append(((real + u) / inv * 100) if inv > 0 else None)
+    res.update(value=value, unrealized=unreal, pnl=pnl, pnl_pct=pnl_pct)
+    return res
@@ -0,0 +1,186 @@
+import csv
+import re
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from time import perf_counter
+from sqlalchemy import func
+from . import db
+from .importer import DateParser, header_index
+from .lots import CENTS, QTY, replay
+from .models import Coin, Holding, Trade
+from .trading import sync_holding
+from .versions import touch
+
+# Exchange fill history (CSV) -> Trade rows, in one DB transaction.
+# Fills are sorted on time first (exports are often newest-first or grouped by
+# market), bulk-inserted with one executemany, and then each affected (user, coin)
+# is replayed once through lots.replay; the Holding row is set from the
+# resulting open lots (trading.sync_holding). Cost is one replay per coin, not
+# one fold per fill. The executemany skips the session's flush hooks, so the
+# import logs a trade 'reload' for the change feed itself (versions.touch).
+
+COLUMNS = {
+    "date": ("date", "date(utc)", "time", "timestamp", "datetime", "executed at", "trade time", "created at"),
+    "coin": ("coin", "asset", "symbol", "base", "base asset", "market", "pair"),
+    "side": ("side", "type", "direction", "trade type"),
+    "quantity": ("quantity", "qty", "amount", "executed", "filled", "size", "volume"),
+    "price": ("price", "avg price", "average price", "rate"),
+    "total": ("total", "value", "cost", "quote amount", "proceeds"),
+    "fee": ("fee", "fees", "commission"),
+}
+QUOTES = ("USDT", "USDC", "BUSD", "INR", "USD", "EUR")     # stripped from "BTCINR"-style markets
+PRICE = Decimal("0.0000000001")
+
+_PAIR = re.compile(r"[/\-_:]")
+
+
+def read_fills(stream):
+    """Text stream -> dict per fill with the canonical keys above."""
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    index = header_index(header, COLUMNS)
+    missing = [k for k in ("date", "coin", "side", "quantity") if k not in index]
+    if missing or not ({"price", "total"} & set(index)):
+        raise ValueError("Fills CSV needs date, coin, side, quantity and price (or total) columns.")
+
+    for row in reader:
+        if not any(row):
+            continue
+        yield {key: row[i] for key, i in index.items() if i < len(row)}
+
+
+# ---- parsing ----
+def _num(s):
+    s = (s or "").strip().replace(",", "")
+    if not s:
+        return None
+    try:
+        return Decimal(s.split()[0])        # "0.5 BTC" -> 0.5
+    except InvalidOperation:
+        raise ValueError(f"bad number {s!r}")
+
+
+def _when(s, parse_date):
+    """ISO datetime (offsets are converted to UTC), epoch seconds/ms, or a statement-style date."""
+    s = (s or "").strip()
+    if s.isdigit() and len(s) >= 10:
+        ts = int(s) / 1000 if len(s) >= 13 else int(s)
+        return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+    try:
+        d = datetime.fromisoformat(s)
+    except ValueError:
+        return parse_date(s)
+    return d.astimezone(timezone.utc).replace(tzinfo=None) if d.tzinfo else d
+
+
+class CoinResolver:
+    """Fill coin/market label -> Coin.id, by CoinGecko id or symbol (the user's held coins win
+    a symbol clash). Coins have to exist already; new ones need CoinGecko metadata."""
+
+    def __init__(self, user_id):
+        held = {c for (c,) in db.session.query(Holding.coin_id).filter(Holding.user_id == user_id)}
+        self.by_cg, self.by_symbol = {}, {}
+        for coin_id, cg_id, symbol in db.session.query(Coin.id, Coin.cg_id, Coin.symbol):
+            self.by_cg[cg_id.lower()] = coin_id
+            if symbol.lower() not in self.by_symbol or coin_id in held:
+                self.by_symbol[symbol.lower()] = coin_id
+        self.memo = {}
+
+    def __call__(self, label):
+        if label not in self.memo:
+            self.memo[label] = self._resolve(label)
+        return self.memo[label]
+
+    def _resolve(self, label):
+        raw = (label or "").strip()
+        candidates = [raw.lower()]
+        parts = _PAIR.split(raw)
+        if len(parts) > 1:
+            candidates.append(parts[0].lower())
+        else:
+            candidates += [raw[:-len(q)].lower() for q in QUOTES if raw.upper().endswith(q) and len(raw) > len(q)]
+        for c in candidates:
+            coin_id = self.by_cg.get(c) or self.by_symbol.get(c)
+            if coin_id:
+                return coin_id
+        raise ValueError(f"unknown coin {raw!r} (add it to the portfolio first)")
+
+
+def parse_fill(rec, coin_of, parse_date):
+    """record -> (txn_date, coin_id, side, quantity, price, total). Raises ValueError."""
+    txn_date = _when(rec.get("date"), parse_date)
+    coin_id = coin_of(rec.get("coin"))
+
+    side = (rec.get("side") or "").strip().upper()
+    if side[:1] not in ("B", "S"):
+        raise ValueError(f"bad side {side!r}")
+    side = "BUY" if side[0] == "B" else "SELL"
+
+    qty = _num(rec.get("quantity"))
+    if not qty:
+        raise ValueError("missing quantity")
+    qty = abs(qty)
+    price, total = _num(rec.get("price")), _num(rec.get("total"))
+    if total is None:
+        if price is None:
+            raise ValueError("missing price")
+        total = qty * price
+    total = abs(total)
+    fee = abs(_num(rec.get("fee")) or 0)
+    total = total + fee if side == "BUY" else max(Decimal(0), total - fee)
+    if price is None:
+        price = total / qty
+    return txn_date, coin_id, side, qty.quantize(QTY), abs(price).quantize(PRICE), total.quantize(CENTS)
+
+
+# ---- import ----
+def import_fills(user_id, records, max_errors=20):
+    """Insert a fill history and recompute each affected (user, coin) once; all or nothing.
+    -> {"read", "inserted", "skipped", "coins", "errors", "seconds", "fills_per_sec"}"""
+    t0 = perf_counter()
+    coin_of, parse_date = CoinResolver(user_id), DateParser()
+    res = {"read": 0, "inserted": 0, "skipped": 0, "coins": 0, "errors": []}
+
+    fills = []
+    for n, rec in enumerate(records, 1):
+        res["read"] += 1
+        try:
+            fills.append((n,) + parse_fill(rec, coin_of, parse_date))
+        except ValueError as e:
+            res["skipped"] += 1
+            if len(res["errors"]) < max_errors:
+                res["errors"].append(f"row {n}: {e}")
+    fills.sort(key=lambda f: (f[1], f[0]))     # by time, file order within the same timestamp
+
+    try:
+        if fills:
+            first_new_id = (db.session.query(func.max(Trade.id)).scalar() or 0) + 1
+            db.session.execute(Trade.__table__.insert(), [
+                {"user_id": user_id, "coin_id": coin_id, "side": side, "quantity": qty,
+                 "price_per_coin": price, "total": total, "realized_pnl": 0, "txn_date": txn_date}
+                for _, txn_date, coin_id, side, qty, price, total in fills])
+            touch(user_id, "trade")
+
+            last_dates = {}
+            for _, txn_date, coin_id, *_ in fills:
+                last_dates[coin_id] = txn_date
+            for coin_id in sorted(last_dates):
+                r = replay(user_id, coin_id)
+                # like the trade form, refuse a new SELL of more than was held at that time
+                short = [d for trade_id, d in r.short if trade_id >= first_new_id]
+                if short:
+                    symbol = db.session.get(Coin, coin_id).symbol.upper()
+                    raise ValueError(f"Fill on {short[0]:%Y-%m-%d %H:%M} sells more {symbol} than is held.")
+                sync_holding(user_id, coin_id, r.lots, last_dates[coin_id])
+            res["coins"] = len(last_dates)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    res["inserted"] = len(fills)
+
+    res["seconds"] = round(perf_counter() - t0, 3)
+    res["fills_per_sec"] = int(res["read"] / res["seconds"]) if res["seconds"] else None
+    return res
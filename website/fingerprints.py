@@ -0,0 +1,78 @@
+from datetime import datetime
+from functools import lru_cache
+from hashlib import blake2b
+from . import db
+from .dialect import insert
+from .models import Transaction, TxnFingerprint
+
+# Dedupe index for statement imports: per user, how many transactions exist for
+# each (day, type, amount) key, stored as a signed 64-bit hash. An imported row
+# is a duplicate when the file's k-th occurrence of a key is already covered by
+# the stored count. Kept in step by ledger.txn_changed like the other derived
+# tables, and built from one pass over the user's transactions on first use.
+
+
+def fingerprint(txn_date, txn, amount):
+    """amount: Decimal (or anything that formats with :.2f)."""
+    d = _day(txn_date) if txn_date is not None else datetime.utcnow().strftime("%Y-%m-%d")
+    h = blake2b(f"{d}|{txn}|{amount:.2f}".encode(), digest_size=8).digest()
+    return int.from_bytes(h, "big", signed=True)
+
+
+@lru_cache(maxsize=4096)
+def _day(d):
+    return d.strftime("%Y-%m-%d")
+
+
+def of(s):
+    return fingerprint(s.txn_date, s.txn, s.amount)
+
+
+def rebuild(user_id):
+    TxnFingerprint.query.filter(TxnFingerprint.user_id == user_id).delete()
+    counts = {}
+    rows = (db.session.query(Transaction.txn_date, Transaction.txn, Transaction.amount)
+            .filter(Transaction.user_id == user_id)
+            .execution_options(yield_per=5000))
+    for txn_date, txn, amount in rows:
+        fp = fingerprint(txn_date, txn, amount)
+        counts[fp] = counts.get(fp, 0) + 1
+    if counts:
+        db.session.execute(TxnFingerprint.__table__.insert(),
+                           [{"user_id": user_id, "fp": fp, "count": n} for fp, n in counts.items()])
+    return len(counts)
+
+
+def ensure(user_id):
+    if db.session.query(TxnFingerprint.fp).filter(TxnFingerprint.user_id == user_id).first() is None:
+        rebuild(user_id)
+
+
+def bump(user_id, counts):
+    """Add {fp: n} to the user's stored counts (n may be negative)."""
+    rows = [{"user_id": user_id, "fp": fp, "count": n} for fp, n in counts.items() if n]
+    if rows:
+        stmt = insert(TxnFingerprint)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=["user_id", "fp"],
+            set_={"count": TxnFingerprint.count + stmt.excluded.count},
+        ), rows)
+
+
+def apply(before, after):
+    counts = {}
+    for s, sign in ((before, -1), (after, 1)):
+        if s:
+            counts[(s.user_id, of(s))] = counts.get((s.user_id, of(s)), 0) + sign
+    for user_id in {u for u, _ in counts}:
+        bump(user_id, {fp: n for (u, fp), n in counts.items() if u == user_id})
+
+
+def stored_counts(user_id, fps):
+    """{fp: count} for the given fingerprints."""
+    fps = list(fps)
+    out = {}
+    for i in range(0, len(fps), 500):
+        out.update(db.session.query(TxnFingerprint.fp, TxnFingerprint.count)
+                   .filter(TxnFingerprint.user_id == user_id, TxnFingerprint.fp.in_(fps[i:i + 500])))
+    return out
@@ -0,0 +1,69 @@
+import os
+from flask import current_app
+from markupsafe import Markup
+from . import versions
+from .cache import MemoryCache, SQLiteCache, cache_key
+
+# Rendered HTML for the parts of a page that only change with the user's data:
+# the portfolio summary, holdings table, trade-modal coin lists and chart
+# widgets, and the ledger table. Entries are keyed on the user's data version
+# (versions.py), the market snapshot generation where prices show, and the
+# display currency and its rate, so a write, a price refresh or a new FX rate
+# just misses; nothing is ever invalidated by hand. A hit skips the queries
+# and the Jinja loops behind those parts.
+# The version in the key must be one every worker sees at once: on the memory
+# backend versions.current() is a per-process copy up to VERSION_TTL old, so
+# data_version() reads the DataVersion row instead (one primary-key lookup).
+# The store is its own LRU of FRAGMENT_CACHE_ENTRIES pages (0 = off), apart
+# from the upstream cache so big pages don't push out API responses: per
+# process on the memory backend, one SQLite file shared by every worker with
+# CACHE_BACKEND=sqlite.
+
+FRAGMENT_TTL = 3600
+
+_store = None
+
+
+def init_app(app):
+    global _store
+    maxsize = app.config["FRAGMENT_CACHE_ENTRIES"]
+    if maxsize <= 0:
+        _store = None
+    elif app.config.get("CACHE_BACKEND") == "sqlite":
+        path = app.config["FRAGMENT_CACHE_PATH"] or os.path.join(app.instance_path, "fragments.db")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _store = SQLiteCache(path, maxsize)
+    else:
+        _store = MemoryCache(maxsize)
+
+
+def data_version(user_id):
+    """user_id's data version as every worker sees it: the shared cache on the
+    sqlite backend, else the database."""
+    if current_app.config.get("CACHE_BACKEND") == "sqlite":
+        return versions.current(user_id)
+    return versions.stored(user_id)
+
+
+def key(name, *parts):
+    return cache_key(("fragment", name) + parts)
+
+
+def get(k):
+    """{part: Markup} stored under k, or None."""
+    parts = _store.get(k) if _store is not None else None
+    return None if parts is None else {name: Markup(html) for name, html in parts.items()}
+
+
+def put(k, parts):
+    """Store {part: html} under k. -> the same parts as Markup."""
+    parts = {name: str(html) for name, html in parts.items()}
+    if _store is not None:
+        _store.set(k, parts, FRAGMENT_TTL)
+    return {name: Markup(html) for name, html in parts.items()}
+
+
+def fragment_stats():
+    if _store is None:
+        return {"backend": "off", "hits": 0, "misses": 0, "evictions": 0, "collapsed": 0, "size": 0}
+    return _store.stats()
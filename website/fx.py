@@ -0,0 +1,128 @@
+from decimal import Decimal
+from time import time
+from flask import g, has_request_context
+from sqlalchemy import Numeric, and_, case, literal, type_coerce
+from . import db
+from .cache import cache_get, cache_set
+from .coingecko import cg_headers, fetch_json, CG_PRO, CG_PUB
+from .dialect import insert
+from .models import FxRate, Transaction
+
+# Currencies. Everything is stored and aggregated in BASE (the market snapshot,
+# balances, rollups, budgets, lots); a transaction entered in another currency
+# also keeps what was typed (Transaction.currency / orig_amount). Display in
+# the user's currency is one multiplication by a locally stored FX rate: in SQL
+# for ledger and trade rows, once per figure for totals. Rates come from
+# CoinGecko's /exchange_rates (one call for every currency) in the market
+# refresher, so switching display currency never calls upstream.
+
+BASE = "INR"
+SYMBOLS = {"INR": "₹", "USD": "$", "EUR": "€", "GBP": "£", "JPY": "¥", "AUD": "A$", "CAD": "C$",
+           "SGD": "S$", "CHF": "CHF ", "AED": "AED "}
+CURRENCIES = tuple(SYMBOLS)
+RATES_TTL = 7 * 24 * 3600       # serve old rates rather than none
+CENTS = Decimal("0.01")
+
+
+# ---- rates ----
+def refresh_rates(max_wait=30.0):
+    """Fetch /exchange_rates into FxRate and the cache. -> {code: rate} stored, or {} on failure."""
+    data = fetch_json(f"{CG_PRO}/exchange_rates", headers=cg_headers(),
+                      fallback_url=f"{CG_PUB}/exchange_rates", max_wait=max_wait)
+    quotes = data.get("rates") if isinstance(data, dict) else None
+    try:
+        per_btc = {code: Decimal(str(quotes[code.lower()]["value"])) for code in CURRENCIES
+                   if code.lower() in quotes}
+    except (TypeError, KeyError, ArithmeticError):
+        return {}
+    if not per_btc.get(BASE):
+        return {}
+    rates = {code: (v / per_btc[BASE]).quantize(Decimal("0.000000000001")) for code, v in per_btc.items()}
+
+    now = int(time())
+    stmt = insert(FxRate)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=["currency"], set_={"rate": stmt.excluded.rate, "fetched_at": stmt.excluded.fetched_at}),
+        [{"currency": code, "rate": rate, "fetched_at": now} for code, rate in rates.items()])
+    db.session.commit()
+    cache_set(("fx", "rates"), {code: str(r) for code, r in rates.items()}, RATES_TTL)
+    return rates
+
+
+def rates():
+    """{code: units of code per 1 BASE}; BASE is always 1."""
+    cached = cache_get(("fx", "rates"))
+    if cached is None:
+        cached = {code: str(rate) for code, rate in db.session.query(FxRate.currency, FxRate.rate)}
+        cache_set(("fx", "rates"), cached, RATES_TTL if cached else 60)
+    out = {code: Decimal(r) for code, r in cached.items()}
+    out[BASE] = Decimal(1)
+    return out
+
+
+def rate(code):
+    """Units of `code` per 1 BASE, or None if there is no rate for it yet."""
+    return rates().get(code)
+
+
+def to_base(amount, code):
+    """An amount in `code` -> BASE, to the cent. Raises ValueError without a rate."""
+    r = rate(code)
+    if not r:
+        raise ValueError(f"No exchange rate for {code} yet; try again shortly.")
+    return (Decimal(amount) / r).quantize(CENTS)
+
+
+def entered(amount, code):
+    """An amount typed in `code` -> (amount, currency, orig_amount) for a Transaction.
+    BASE amounts are stored as they are, with no currency."""
+    amount = Decimal(amount).quantize(CENTS)
+    if not code or code == BASE:
+        return amount, None, None
+    if code not in SYMBOLS:
+        raise ValueError("Unknown currency.")
+    return to_base(amount, code), code, amount
+
+
+# ---- display ----
+class Display:
+    __slots__ = ("code", "factor", "symbol")
+
+    def __init__(self, code):
+        factor = Decimal(1) if code == BASE else rate(code) if code in SYMBOLS else None
+        if factor is None:              # unknown currency or no rates yet: show BASE
+            code, factor = BASE, Decimal(1)
+        self.code, self.factor, self.symbol = code, factor, SYMBOLS[code]
+
+    def __call__(self, value):
+        """BASE value -> display currency."""
+        return None if value is None else Decimal(value) * self.factor
+
+
+def display(code=None):
+    """Display settings for `code`, default the logged-in user's currency (once per request)."""
+    if code is not None:
+        return Display(code)
+    if not has_request_context():
+        return Display(BASE)
+    if "fx_display" not in g:
+        from flask_login import current_user
+        g.fx_display = Display(getattr(current_user, "currency", None) or BASE)
+    return g.fx_display
+
+
+def amount_expr(d):
+    """SQL for Transaction amounts in display currency `d`: what was typed when it was
+    entered in that currency, else the BASE amount times the rate."""
+    converted = Transaction.amount if d.code == BASE else Transaction.amount * literal(d.factor, Numeric(28, 12))
+    expr = case((and_(Transaction.currency == d.code, Transaction.orig_amount.isnot(None)), Transaction.orig_amount),
+                else_=converted)
+    return type_coerce(expr, Numeric(18, 2))
+
+
+def money(value, d=None, converted=False):
+    """'$1,234.56' for a BASE value (or one already in display currency)."""
+    d = d or display()
+    if value is None:
+        return ""
+    return f"{d.symbol}{(Decimal(value) if converted else d(value)):,.2f}"
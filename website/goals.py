@@ -0,0 +1,143 @@
+from datetime import date
+from decimal import Decimal
+from flask import current_app
+from sqlalchemy import event, func
+from . import db, rollups
+from .cache import cache_get, cache_set, cache_delete
+from .models import Savings, SpendRollup
+
+# Savings goals. Progress is the net cash flow (CREDIT - DEBIT) of the linked
+# category, or of everything when the goal has none; the projection extends the
+# average monthly net of the last WINDOW complete months. Everything comes from
+# the monthly SpendRollup rows (one grouped query per user), and the result is
+# memoized per user until a transaction in a linked category or a goal changes.
+# The memo is kept only with CACHE_BACKEND=sqlite, where every worker shares
+# the cache: invalidate() reaches just the cache it runs in, so a per-process
+# memo in the other workers would stay stale for up to TTL.
+# Writers still inside a transaction call invalidate_on_commit(), so the memo is
+# dropped once the change is visible and not rebuilt from the rows before it.
+
+WINDOW = 6
+TTL = 24 * 3600
+
+
+def _key(user_id):
+    return ("goals", user_id)
+
+
+def parse_target(value):
+    """Savings.target_date is stored as YYYYMMDD."""
+    v = int(value)
+    return date(v // 10000, v // 100 % 100, v % 100)
+
+
+def to_target(d):
+    return d.year * 10000 + d.month * 100 + d.day
+
+
+def _month_add(d, n):
+    m = d.month - 1 + n
+    return date(d.year + m // 12, m % 12 + 1, 1)
+
+
+def _project(saved, target, monthly, today):
+    """-> (projected completion date or None, months needed or None)."""
+    if saved >= target:
+        return today, 0
+    if monthly <= 0:
+        return None, None
+    months = int(-(-(target - saved) // monthly))   # ceil
+    return _month_add(today.replace(day=1), months), months
+
+
+def compute(user_id, today=None):
+    today = today or date.today()
+    goals = Savings.query.filter_by(user_id=user_id).order_by(Savings.target_date, Savings.id).all()
+    if not goals:
+        return {"month": today.strftime("%Y-%m"), "all": False, "categories": [], "goals": []}
+
+    if rollups.ensure(user_id):
+        db.session.commit()
+    net_by = {}     # category_id (0 = uncategorized) -> {bucket: net}
+    for cat, bucket, net in (db.session.query(SpendRollup.category_id, SpendRollup.bucket,
+                                              func.sum(SpendRollup.credit) - func.sum(SpendRollup.debit))
+                             .filter(SpendRollup.user_id == user_id, SpendRollup.period == "m")
+                             .group_by(SpendRollup.category_id, SpendRollup.bucket)):
+        net_by.setdefault(cat, {})[bucket] = Decimal(str(net))
+
+    this_month = today.replace(day=1)
+    window = [_month_add(this_month, -i).strftime("%Y-%m") for i in range(1, WINDOW + 1)]
+
+    out = []
+    for g in goals:
+        series = [net_by.get(g.category_id, {})] if g.category_id else list(net_by.values())
+        saved = sum((sum(s.values(), Decimal(0)) for s in series), Decimal(0))
+        monthly = sum((s.get(b, Decimal(0)) for s in series for b in window), Decimal(0)) / WINDOW
+        target = Decimal(str(g.target_amount))
+        projected, months = _project(saved, target, monthly, today)
+        target_date = parse_target(g.target_date)
+        out.append({
+            "id": g.id, "title": g.title, "category_id": g.category_id,
+            "target_amount": float(target), "target_date": target_date.isoformat(),
+            "saved": float(saved), "monthly_net": round(float(monthly), 2),
+            "pct": round(min(float(saved / target * 100), 100.0), 1) if target > 0 else None,
+            "projected_date": projected.isoformat() if projected else None,
+            "months_to_go": months,
+            "on_track": projected is not None and projected <= target_date,
+        })
+
+    # what invalidate() needs to know about this user's goals
+    return {"month": today.strftime("%Y-%m"),
+            "all": any(g.category_id is None for g in goals),
+            "categories": sorted({g.category_id for g in goals if g.category_id}),
+            "goals": out}
+
+
+def goal_progress(user_id):
+    """compute() for this month, memoized when the cache is shared by every worker."""
+    if current_app.config.get("CACHE_BACKEND") != "sqlite":
+        return compute(user_id)["goals"]
+    month = date.today().strftime("%Y-%m")
+    hit = cache_get(_key(user_id))
+    if hit is not None and hit.get("month") == month:
+        return hit["goals"]
+    res = compute(user_id)
+    cache_set(_key(user_id), res, TTL)
+    return res["goals"]
+
+
+def invalidate(user_id, category_ids=None):
+    """Drop the memo if any of category_ids (None = all) feeds one of the user's goals."""
+    if category_ids is not None:
+        hit = cache_get(_key(user_id))
+        if hit is None:
+            return
+        if not hit.get("all") and not set(hit.get("categories", [])) & set(category_ids):
+            return
+    cache_delete(_key(user_id))
+
+
+def invalidate_on_commit(user_id, category_ids=None):
+    """invalidate() once the session's transaction commits; forgotten on rollback."""
+    stale = db.session.info.setdefault("goals_stale", {})
+    if category_ids is None or (user_id in stale and stale[user_id] is None):
+        stale[user_id] = None
+    else:
+        stale.setdefault(user_id, set()).update(category_ids)
+
+
+# ---- session events ----
+def _after_commit(session):
+    for user_id, category_ids in session.info.pop("goals_stale", {}).items():
+        invalidate(user_id, category_ids)
+
+
+def _after_rollback(session, previous_transaction):
+    session.info.pop("goals_stale", None)
+
+
+def init_app(app):
+    # db.session is shared by every app in the process; listen once
+    for name, fn in (("after_commit", _after_commit), ("after_soft_rollback", _after_rollback)):
+        if not event.contains(db.session, name, fn):
+            event.listen(db.session, name, fn)
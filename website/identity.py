@@ -0,0 +1,65 @@
+from . import db
+from .fx import BASE
+from .cache import cache_delete, cache_get, cache_set
+from .models import User
+
+# The logged-in user as Flask-Login sees it. Pages only need the id, name and
+# display currency, so the session's user is a small Identity built from one
+# cached row instead of a User loaded on every request (redirects included).
+# Anything that changes those columns calls invalidate() after committing.
+# With several worker processes on the memory cache backend, another worker
+# may show the old values for up to IDENTITY_TTL seconds.
+
+IDENTITY_TTL = 300
+FIELDS = (User.id, User.username, User.email, User.currency)
+
+
+class Identity:
+    """Read-only stand-in for User with the Flask-Login interface."""
+    __slots__ = ("id", "username", "email", "currency")
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, username, email, currency):
+        self.id, self.username, self.email, self.currency = id, username, email, currency
+
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, (Identity, User)) and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"<Identity {self.id}>"
+
+
+def _key(user_id):
+    return ("identity", user_id)
+
+
+def of(user):
+    """Identity for a User just loaded or created (login, register)."""
+    ident = Identity(user.id, user.username, user.email, user.currency or BASE)
+    cache_set(_key(user.id), (ident.username, ident.email, ident.currency), IDENTITY_TTL)
+    return ident
+
+
+def load(user_id):
+    """Identity for user_id from the cache, else one SELECT of its columns. None if no such user."""
+    row = cache_get(_key(user_id))
+    if row is None:
+        row = db.session.query(*FIELDS[1:]).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        row = tuple(row)
+        cache_set(_key(user_id), row, IDENTITY_TTL)
+    return Identity(user_id, *row)
+
+
+def invalidate(user_id):
+    cache_delete(_key(user_id))
@@ -0,0 +1,248 @@
+import csv
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from time import perf_counter
+from . import db, fingerprints, goals, rollups, versions
+from .ledger import TxnSnap, CENTS, bump_balance, get_balance, signed
+from .models import Category, Transaction
+
+# Bank statement import (CSV / OFX), streamed end to end:
+#   read_csv / read_ofx  ->  records (dicts), one at a time
+#   import_transactions  ->  parse, dedupe, insert in executemany batches
+# Memory is bounded by the batch size plus one small counter per distinct
+# (day, type, amount) key. Everything is one DB transaction; the derived tables
+# (balance, rollups, fingerprints) get one aggregated update instead of one per row.
+
+BATCH = 10000
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d", "%d.%m.%Y", "%d %b %Y", "%d-%b-%Y", "%m/%d/%Y")
+
+# CSV header aliases (lowercased)
+COLUMNS = {
+    "date": ("date", "txn_date", "transaction date", "value date", "posted", "posting date", "booking date"),
+    "amount": ("amount", "amt", "transaction amount"),
+    "debit": ("debit", "withdrawal", "withdrawals", "debit amount", "withdrawal amt.", "paid out", "dr"),
+    "credit": ("credit", "deposit", "deposits", "credit amount", "deposit amt.", "paid in", "cr"),
+    "type": ("type", "txn", "transaction type", "dr/cr", "cr/dr"),
+    "note": ("note", "description", "narration", "memo", "details", "particulars", "payee", "name"),
+    "category": ("category",),
+}
+
+
+# ---- readers ----
+def header_index(header, columns):
+    """CSV header row -> {canonical key: column index} for the aliases that are present."""
+    index = {}
+    lowered = [h.strip().lower() for h in header]
+    for key, aliases in columns.items():
+        for alias in aliases:
+            if alias in lowered:
+                index[key] = lowered.index(alias)
+                break
+    return index
+
+
+def read_csv(stream):
+    """Text stream -> dict per row with the canonical keys above (missing ones absent)."""
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    index = header_index(header, COLUMNS)
+    if "date" not in index or not ({"amount", "debit", "credit"} & set(index)):
+        raise ValueError("CSV needs a date column and an amount (or debit/credit) column.")
+
+    for row in reader:
+        if not any(row):
+            continue
+        yield {key: row[i] for key, i in index.items() if i < len(row)}
+
+
+_OFX_TXN = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.S | re.I)
+_OFX_TAG = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+
+def read_ofx(stream, chunk=1 << 16):
+    """OFX (SGML or XML) text stream -> dict per <STMTTRN>, read in fixed-size chunks."""
+    buf = ""
+    while True:
+        data = stream.read(chunk)
+        buf += data
+        last = 0
+        for m in _OFX_TXN.finditer(buf):
+            fields = {k.upper(): v.strip() for k, v in _OFX_TAG.findall(m.group(1))}
+            amount = fields.get("TRNAMT", "")
+            yield {
+                "date": fields.get("DTPOSTED", "")[:8],
+                "amount": amount,
+                "note": fields.get("NAME") or fields.get("MEMO") or None,
+            }
+            last = m.end()
+        buf = buf[last:]
+        if "<STMTTRN" not in buf.upper():
+            buf = buf[-16:]       # nothing open; keep just enough for a tag split across chunks
+        if not data:
+            return
+
+
+# ---- parsing ----
+def _amount(s):
+    s = (s or "").strip().replace(",", "").replace("₹", "").replace("$", "").replace(" ", "")
+    if not s:
+        return None
+    neg = s.startswith("(") and s.endswith(")")
+    try:
+        v = Decimal(s.strip("()"))
+    except InvalidOperation:
+        raise ValueError(f"bad amount {s!r}")
+    return -v if neg else v
+
+
+class DateParser:
+    """Tries the last format that worked first; statements use one format throughout.
+    Results are memoized: a statement has far fewer distinct dates than rows."""
+
+    def __init__(self, formats=DATE_FORMATS, memo=4096):
+        self.formats = list(formats)
+        self.memo, self._seen = memo, {}
+
+    def __call__(self, s):
+        d = self._seen.get(s)
+        if d is None:
+            d = self._parse(s)
+            if len(self._seen) >= self.memo:
+                self._seen.clear()
+            self._seen[s] = d
+        return d
+
+    def _parse(self, s):
+        s = (s or "").strip()
+        if len(s) == 8 and s.isdigit():
+            return datetime.strptime(s, "%Y%m%d")      # OFX DTPOSTED
+        for i, fmt in enumerate(self.formats):
+            try:
+                d = datetime.strptime(s, fmt)
+            except ValueError:
+                continue
+            if i:
+                self.formats.insert(0, self.formats.pop(i))
+            return d
+        raise ValueError(f"bad date {s!r}")
+
+
+def parse_record(rec, parse_date):
+    """record -> (txn_date, txn, amount, note, category name or None). Raises ValueError."""
+    txn_date = parse_date(rec.get("date"))
+    debit, credit = _amount(rec.get("debit")), _amount(rec.get("credit"))
+    if debit:
+        txn, amount = "DEBIT", abs(debit)
+    elif credit:
+        txn, amount = "CREDIT", abs(credit)
+    else:
+        amount = _amount(rec.get("amount"))
+        if amount is None:
+            raise ValueError("missing amount")
+        kind = (rec.get("type") or "").strip().upper()
+        if kind:
+            txn = "CREDIT" if kind.startswith("C") else "DEBIT"
+        else:
+            txn = "DEBIT" if amount < 0 else "CREDIT"
+        amount = abs(amount)
+    if amount == 0:
+        raise ValueError("zero amount")
+    note = (rec.get("note") or "").strip() or None
+    category = (rec.get("category") or "").strip() or None
+    return txn_date, txn, amount.quantize(CENTS), note, category
+
+
+# ---- import ----
+def import_transactions(user_id, records, batch_size=BATCH, max_errors=20):
+    """Stream records into the user's ledger in one DB transaction.
+    -> {"read", "inserted", "duplicates", "skipped", "errors", "seconds", "rows_per_sec"}"""
+    t0 = perf_counter()
+
+    # seed the derived tables from the ledger as it is before the import
+    get_balance(user_id)
+    rollups.ensure(user_id)
+    fingerprints.ensure(user_id)
+    db.session.commit()
+
+    categories = {name.lower(): cid for cid, name in
+                  db.session.query(Category.id, Category.name).filter(Category.user_id == user_id)}
+    seen = {}               # fingerprint -> occurrences in this file so far
+    deltas, balance = {}, Decimal(0)
+    res = {"read": 0, "inserted": 0, "duplicates": 0, "skipped": 0, "errors": []}
+    parse_date = DateParser()
+
+    def category_id(name):
+        if name is None:
+            return None
+        cid = categories.get(name.lower())
+        if cid is None:
+            cat = Category(name=name, user_id=user_id)
+            db.session.add(cat)
+            db.session.flush()
+            cid = categories[name.lower()] = cat.id
+        return cid
+
+    def flush(batch):
+        nonlocal balance
+        stored = fingerprints.stored_counts(user_id, {fp for fp, _ in batch})
+        rows, added = [], {}
+        for fp, (txn_date, txn, amount, note, cat) in batch:
+            k = seen[fp] = seen.get(fp, 0) + 1
+            if k <= stored.get(fp, 0):
+                res["duplicates"] += 1
+                continue
+            added[fp] = added.get(fp, 0) + 1
+            snap = TxnSnap(user_id, txn, amount, cat, txn_date)
+            rollups.add_delta(deltas, snap)
+            balance += signed(snap)
+            rows.append({"user_id": user_id, "txn_date": txn_date, "amount": amount,
+                         "txn": txn, "note": note, "category_id": cat})
+        if rows:
+            db.session.execute(Transaction.__table__.insert(), rows)
+        fingerprints.bump(user_id, added)
+        res["inserted"] += len(rows)
+
+    try:
+        batch = []
+        for n, rec in enumerate(records, 1):
+            res["read"] += 1
+            try:
+                txn_date, txn, amount, note, cat = parse_record(rec, parse_date)
+            except ValueError as e:
+                res["skipped"] += 1
+                if len(res["errors"]) < max_errors:
+                    res["errors"].append(f"row {n}: {e}")
+                continue
+            batch.append((fingerprints.fingerprint(txn_date, txn, amount),
+                          (txn_date, txn, amount, note, category_id(cat))))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        flush(batch)
+
+        if balance:
+            bump_balance(user_id, balance)
+        rollups.apply_deltas(deltas)
+        if res["inserted"]:
+            versions.touch(user_id, "transaction")
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    goals.invalidate(user_id)
+
+    res["seconds"] = round(perf_counter() - t0, 3)
+    res["rows_per_sec"] = int(res["read"] / res["seconds"]) if res["seconds"] else None
+    return res
+
+
+def reader_for(filename, fmt=None):
+    fmt = (fmt or filename.rsplit(".", 1)[-1]).lower()
+    if fmt in ("ofx", "qfx"):
+        return read_ofx
+    if fmt == "csv":
+        return read_csv
+    raise ValueError("Unsupported file type (use .csv or .ofx).")
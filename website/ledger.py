@@ -0,0 +1,233 @@
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import and_, or_, case, func, update
+from sqlalchemy.orm import with_expression
+from . import db, fingerprints, fx, goals, rollups
+from .models import Transaction, UserBalance
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+# ---- keyset cursors on (txn_date, id), newest first ----
+def encode_cursor(t):
+    raw = f"{t.txn_date.isoformat() if t.txn_date else ''}|{t.id}"
+    return urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """cursor -> (txn_date or None, id). Raises ValueError on garbage."""
+    raw = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    d, sep, i = raw.partition("|")
+    if not sep:
+        raise ValueError("bad cursor")
+    return (datetime.fromisoformat(d) if d else None), int(i)
+
+
+def parse_filters(args):
+    """Query args -> filter dict. Raises ValueError with a user-facing message."""
+    f = {}
+
+    for key in ("from", "to"):
+        val = (args.get(key) or "").strip()
+        if val:
+            try:
+                f[key] = datetime.strptime(val, "%Y-%m-%d")
+            except ValueError:
+                raise ValueError("Invalid date format. Use YYYY-MM-DD.")
+
+    cat = (args.get("category") or "").strip()
+    if cat:
+        try:
+            f["category"] = int(cat)
+        except ValueError:
+            raise ValueError("Invalid category.")
+
+    txn = (args.get("txn") or "").strip().upper()
+    if txn:
+        if txn not in ("CREDIT", "DEBIT"):
+            raise ValueError("Type must be CREDIT or DEBIT.")
+        f["txn"] = txn
+
+    q = (args.get("q") or "").strip()
+    if q:
+        f["q"] = q
+
+    return f
+
+
+def ledger_query(user_id, filters=None):
+    filters = filters or {}
+    query = Transaction.query.filter(Transaction.user_id == user_id)
+
+    if "category" in filters:
+        query = query.filter(Transaction.category_id == filters["category"])
+    if "txn" in filters:
+        query = query.filter(Transaction.txn == filters["txn"])
+    if "from" in filters:
+        query = query.filter(Transaction.txn_date >= filters["from"])
+    if "to" in filters:  # inclusive of the whole day
+        query = query.filter(Transaction.txn_date < filters["to"] + timedelta(days=1))
+    if "q" in filters:
+        query = query.filter(Transaction.note.icontains(filters["q"], autoescape=True))
+
+    return query
+
+
+def ledger_page(user_id, filters=None, cursor=None, limit=PAGE_SIZE, display=None):
+    """One page of the ledger, newest first -> (rows, next_cursor or None).
+    With a display (fx.display()), rows also carry display_amount in that currency."""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = ledger_query(user_id, filters)
+    if display is not None:
+        query = query.options(with_expression(Transaction.display_amount, fx.amount_expr(display)))
+
+    if cursor:
+        c_date, c_id = decode_cursor(cursor)
+        # NULL dates sort after every dated row (NULLS LAST below; PostgreSQL defaults to first)
+        if c_date is None:
+            query = query.filter(Transaction.txn_date.is_(None), Transaction.id < c_id)
+        else:
+            query = query.filter(or_(
+                Transaction.txn_date < c_date,
+                and_(Transaction.txn_date == c_date, Transaction.id < c_id),
+                Transaction.txn_date.is_(None),
+            ))
+
+    rows = (query
+        .order_by(Transaction.txn_date.desc().nulls_last(), Transaction.id.desc())
+        .limit(limit + 1)
+        .all())
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def txn_to_dict(t):
+    d = {
+        "id": t.id,
+        "date": t.txn_date.isoformat() if t.txn_date else None,
+        "amount": str(t.amount),
+        "currency": t.currency,
+        "orig_amount": str(t.orig_amount) if t.orig_amount is not None else None,
+        "txn": t.txn,
+        "category_id": t.category_id,
+        "note": t.note,
+    }
+    if t.display_amount is not None:
+        d["display_amount"] = str(t.display_amount)
+    return d
+
+
+# ---- materialized balance ----
+TxnSnap = namedtuple("TxnSnap", "user_id txn amount category_id txn_date")
+CENTS = Decimal("0.01")
+
+
+def snapshot(t):
+    """The fields of a Transaction that derived tables depend on."""
+    return TxnSnap(t.user_id, t.txn, Decimal(str(t.amount)).quantize(CENTS), t.category_id, t.txn_date)
+
+
+def signed(s):
+    return s.amount if s.txn == "CREDIT" else -s.amount
+
+
+def balance_sum_expr():
+    return func.coalesce(func.sum(case(
+        (Transaction.txn == "CREDIT", Transaction.amount),
+        else_=-Transaction.amount
+    )), 0)
+
+
+def txn_changed(before, after):
+    """Apply one add (None, snap) / edit (snap, snap) / delete (snap, None) to the
+    derived tables. Call before the change is flushed; the caller commits."""
+    snaps = [s for s in (before, after) if s]
+    users = {s.user_id for s in snaps}
+
+    # missing derived rows are seeded from the table as it is *before* this
+    # change, so all seeding happens before anything below can flush it
+    with db.session.no_autoflush:
+        for user_id in users:
+            rollups.ensure(user_id)
+            fingerprints.ensure(user_id)
+            ensure_balance(user_id)
+
+    rollups.apply(before, after)
+    fingerprints.apply(before, after)
+    for user_id in users:
+        goals.invalidate_on_commit(user_id, {s.category_id for s in snaps if s.category_id})
+
+    deltas = {}
+    if before:
+        deltas[before.user_id] = deltas.get(before.user_id, 0) - signed(before)
+    if after:
+        deltas[after.user_id] = deltas.get(after.user_id, 0) + signed(after)
+
+    for user_id, delta in deltas.items():
+        if delta:
+            bump_balance(user_id, delta)
+
+
+def ensure_balance(user_id):
+    if db.session.get(UserBalance, user_id) is None:
+        rebuild_balance(user_id)
+
+
+def bump_balance(user_id, delta):
+    """Add delta to a seeded balance row (see ensure_balance)."""
+    db.session.execute(
+        update(UserBalance)
+        .where(UserBalance.user_id == user_id)
+        .values(balance=UserBalance.balance + delta)
+    )
+
+
+def rebuild_balance(user_id):
+    total = (db.session.query(balance_sum_expr())
+        .filter(Transaction.user_id == user_id)
+        .scalar())
+    row = db.session.get(UserBalance, user_id)
+    if row is None:
+        row = UserBalance(user_id=user_id)
+        db.session.add(row)
+    row.balance = Decimal(str(total)).quantize(CENTS)
+    db.session.flush()
+    return row.balance
+
+
+def get_balance(user_id):
+    """O(1) lookup; seeds the row (and commits) the first time a user is seen."""
+    bal = (db.session.query(UserBalance.balance)
+        .filter(UserBalance.user_id == user_id)
+        .scalar())
+    if bal is None:
+        bal = rebuild_balance(user_id)
+        db.session.commit()
+    return bal
+
+
+def reconcile_balances(fix=False):
+    """Compare stored balances with a full recount -> [(user_id, stored, actual)] that drifted.
+    Users without a balance row yet are skipped; get_balance seeds it on first use."""
+    actual = dict(db.session.query(Transaction.user_id, balance_sum_expr())
+        .group_by(Transaction.user_id)
+        .all())
+    stored = dict(db.session.query(UserBalance.user_id, UserBalance.balance).all())
+
+    drift = []
+    for user_id in sorted(stored):
+        a = Decimal(str(actual.get(user_id, 0))).quantize(CENTS)
+        st = stored[user_id]
+        if Decimal(str(st)).quantize(CENTS) != a:
+            drift.append((user_id, st, a))
+
+    if fix and drift:
+        for user_id, _, a in drift:
+            db.session.get(UserBalance, user_id).balance = a
+        db.session.commit()
+
+    return drift
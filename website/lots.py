@@ -0,0 +1,304 @@
+from collections import deque, namedtuple
+from decimal import Decimal
+from itertools import groupby
+from sqlalchemy import and_, bindparam, or_, inspect
+from . import db
+from .models import Trade, Lot, LotFill, Position
+from .fifo import fifo_pnl_for_coin, fifo_realized_by_trade
+from .versions import touch
+
+# Persisted FIFO lots. Each (user, coin) has a Position (realized PnL + the last
+# trade folded in), a Lot per BUY with quantity left, and a LotFill per slice a
+# SELL took. Appending a trade folds it into the open lots; a back-dated trade
+# unwinds only the trades at/after its timestamp and folds them again.
+# Arithmetic mirrors fifo.fifo_pnl_for_coin step for step; quantities are
+# persisted as integer 1e-10 units because SQLite stores Numeric as a float.
+
+CENTS = Decimal("0.01")
+QTY = Decimal("0.0000000001")
+
+
+def to_units(qty):
+    return int(Decimal(qty).scaleb(10).to_integral_value())
+
+
+def from_units(units):
+    return Decimal(int(units)).scaleb(-10).quantize(QTY)
+
+
+def trade_key(txn_date, trade_id):
+    # replay order is (txn_date, id) with NULL dates first, as the queries ask (NULLS FIRST)
+    return (0, 0, trade_id) if txn_date is None else (1, txn_date, trade_id)
+
+
+def _unit_cost(total, quantity):
+    qty = Decimal(quantity)
+    return (Decimal(total) / qty) if qty > 0 else Decimal("0")
+
+
+def _trades(user_id, coin_id):
+    return (Trade.query
+        .filter_by(user_id=user_id, coin_id=coin_id)
+        .order_by(Trade.txn_date.asc().nulls_first(), Trade.id.asc()))
+
+
+def _at_or_after(txn_date, trade_id):
+    if txn_date is None:
+        return or_(Trade.txn_date.isnot(None), Trade.id >= trade_id)
+    return or_(Trade.txn_date > txn_date, and_(Trade.txn_date == txn_date, Trade.id >= trade_id))
+
+
+def _drop(obj):
+    if inspect(obj).persistent:
+        db.session.delete(obj)
+    else:
+        db.session.expunge(obj)
+
+
+def _open_lots(user_id, coin_id):
+    """deque of [Lot, remaining qty, unit cost] in FIFO order."""
+    rows = (db.session.query(Lot, Trade.total, Trade.quantity)
+        .join(Trade, Trade.id == Lot.trade_id)
+        .filter(Lot.user_id == user_id, Lot.coin_id == coin_id)
+        .order_by(Lot.txn_date.asc().nulls_first(), Lot.trade_id.asc())
+        .all())
+    return deque([lot, from_units(lot.qty_units), _unit_cost(total, qty)] for lot, total, qty in rows)
+
+
+def _fold(pos, trades):
+    """Apply trades (replay order, all after pos.last_*) to the persisted lots."""
+    lots = _open_lots(pos.user_id, pos.coin_id)
+    realized = Decimal(pos.realized or 0)
+
+    for t in trades:
+        qty = Decimal(t.quantity)
+        if t.side == "BUY":
+            lot = Lot(trade_id=t.id, qty_units=to_units(qty), txn_date=t.txn_date, user_id=t.user_id, coin_id=t.coin_id)
+            db.session.add(lot)
+            lots.append([lot, qty, _unit_cost(t.total, qty)])
+        else:
+            to_sell = qty
+            basis = Decimal("0")
+            proceeds = Decimal(t.total)
+            while to_sell > 0 and lots:
+                lot, lot_qty, lot_cost = lots[0]
+                take = min(to_sell, lot_qty)
+                basis += take * lot_cost
+                lot_qty -= take
+                to_sell -= take
+                db.session.add(LotFill(sell_id=t.id, buy_id=lot.trade_id, qty_units=to_units(take),
+                                       user_id=t.user_id, coin_id=t.coin_id))
+                if lot_qty == 0:
+                    lots.popleft()
+                    _drop(lot)
+                else:
+                    lots[0][1] = lot_qty
+                    lot.qty_units = to_units(lot_qty)
+            realized += proceeds - basis
+            t.realized_pnl = proceeds - basis
+        pos.last_date, pos.last_trade_id = t.txn_date, t.id
+
+    pos.realized = realized
+
+
+def _unwind_from(pos, t, trades):
+    """Undo every already-folded trade in `trades` (all at/after t) so they can be folded again."""
+    undone = [x for x in trades if x.id != t.id]
+    undone_ids = {x.id for x in undone}
+    sell_ids = [x.id for x in undone if x.side == "SELL"]
+
+    fills = (LotFill.query.filter(LotFill.sell_id.in_(sell_ids)).order_by(LotFill.id.asc()).all()
+             if sell_ids else [])
+    buy_ids = {f.buy_id for f in fills}
+    buys = {b.id: b for b in Trade.query.filter(Trade.id.in_(buy_ids))} if buy_ids else {}
+
+    fills_by_sell = {}
+    for f in fills:
+        fills_by_sell.setdefault(f.sell_id, []).append(f)
+
+    realized = Decimal(pos.realized or 0)
+    restore = {}
+    for x in undone:
+        if x.side != "SELL":
+            continue
+        basis = Decimal("0")
+        for f in fills_by_sell.get(x.id, []):
+            take = from_units(f.qty_units)
+            b = buys[f.buy_id]
+            basis += take * _unit_cost(b.total, b.quantity)
+            if f.buy_id not in undone_ids:
+                restore[f.buy_id] = restore.get(f.buy_id, Decimal("0")) + take
+        realized -= Decimal(x.total) - basis
+
+    if sell_ids:
+        LotFill.query.filter(LotFill.sell_id.in_(sell_ids)).delete()
+    if undone_ids:
+        Lot.query.filter(Lot.trade_id.in_(undone_ids)).delete()
+
+    existing = {lot.trade_id: lot for lot in Lot.query.filter(Lot.trade_id.in_(restore))} if restore else {}
+    for buy_id, qty in restore.items():
+        lot = existing.get(buy_id)
+        if lot is None:
+            b = buys[buy_id]
+            db.session.add(Lot(trade_id=b.id, qty_units=to_units(qty), txn_date=b.txn_date, user_id=b.user_id, coin_id=b.coin_id))
+        else:
+            lot.qty_units += to_units(qty)
+
+    pos.realized = realized
+    db.session.flush()
+
+
+Replay = namedtuple("Replay", "position lots short")
+
+
+def replay(user_id, coin_id):
+    """Full replay of one (user, coin) from plain trade rows; lots, fills and realized
+    PnL are written with executemany. -> Replay(position, open [(qty, unit cost)],
+    short [(sell trade id, txn_date)] for SELLs that found fewer coins than they sold)."""
+    LotFill.query.filter_by(user_id=user_id, coin_id=coin_id).delete()
+    Lot.query.filter_by(user_id=user_id, coin_id=coin_id).delete()
+
+    pos = Position.query.filter_by(user_id=user_id, coin_id=coin_id).first()
+    if pos is None:
+        pos = Position(user_id=user_id, coin_id=coin_id)
+        db.session.add(pos)
+    pos.realized = Decimal("0")
+    pos.last_date = pos.last_trade_id = None
+
+    rows = (db.session.query(Trade.id, Trade.side, Trade.quantity, Trade.total, Trade.txn_date)
+        .filter(Trade.user_id == user_id, Trade.coin_id == coin_id)
+        .order_by(Trade.txn_date.asc().nulls_first(), Trade.id.asc())
+        .all())
+
+    lots = deque()      # [buy trade id, remaining qty, unit cost, txn_date]
+    fills, pnl, short = [], [], []
+    realized = Decimal("0")
+    for trade_id, side, quantity, total, txn_date in rows:
+        qty = Decimal(quantity)
+        if side == "BUY":
+            lots.append([trade_id, qty, _unit_cost(total, qty), txn_date])
+        else:
+            to_sell = qty
+            basis = Decimal("0")
+            proceeds = Decimal(total)
+            while to_sell > 0 and lots:
+                lot = lots[0]
+                take = min(to_sell, lot[1])
+                basis += take * lot[2]
+                lot[1] -= take
+                to_sell -= take
+                fills.append({"sell_id": trade_id, "buy_id": lot[0], "qty_units": to_units(take),
+                              "user_id": user_id, "coin_id": coin_id})
+                if lot[1] == 0:
+                    lots.popleft()
+            if to_sell > 0:
+                short.append((trade_id, txn_date))
+            realized += proceeds - basis
+            pnl.append({"_id": trade_id, "_pnl": (proceeds - basis).quantize(CENTS)})
+        pos.last_date, pos.last_trade_id = txn_date, trade_id
+
+    if lots:
+        db.session.execute(Lot.__table__.insert(), [
+            {"trade_id": trade_id, "qty_units": to_units(qty), "txn_date": txn_date,
+             "user_id": user_id, "coin_id": coin_id}
+            for trade_id, qty, _, txn_date in lots])
+    if fills:
+        db.session.execute(LotFill.__table__.insert(), fills)
+    if pnl:
+        t = Trade.__table__
+        db.session.execute(t.update().where(t.c.id == bindparam("_id")).values(realized_pnl=bindparam("_pnl")), pnl)
+        touch(user_id, "trade")
+        # Core UPDATE bypasses the identity map; reload realized_pnl on any Trade already loaded
+        for obj in list(db.session.identity_map.values()):
+            if isinstance(obj, Trade) and obj.user_id == user_id and obj.coin_id == coin_id:
+                db.session.expire(obj, ["realized_pnl"])
+
+    pos.realized = realized
+    db.session.flush()
+    return Replay(pos, [(qty, cost) for _, qty, cost, _ in lots], short)
+
+
+def rebuild(user_id, coin_id):
+    """Full replay of one (user, coin) into persisted lots."""
+    return replay(user_id, coin_id).position
+
+
+def apply_trade(t):
+    """Fold a freshly flushed Trade into its (user, coin) FIFO state. Caller commits."""
+    pos = Position.query.filter_by(user_id=t.user_id, coin_id=t.coin_id).first()
+    if pos is None:
+        rebuild(t.user_id, t.coin_id)     # first trade we see for it; the replay includes t
+    elif pos.last_trade_id is None or trade_key(t.txn_date, t.id) > trade_key(pos.last_date, pos.last_trade_id):
+        _fold(pos, [t])
+    else:
+        # back-dated: replay only from t's timestamp forward
+        later = _trades(t.user_id, t.coin_id).filter(_at_or_after(t.txn_date, t.id)).all()
+        _unwind_from(pos, t, later)
+        _fold(pos, later)
+
+
+def ensure_positions(user_id, coin_ids):
+    """Build state for coins traded before lots were persisted. Returns True if anything was built."""
+    have = {c for (c,) in db.session.query(Position.coin_id).filter(Position.user_id == user_id)}
+    missing = [c for c in set(coin_ids) if c not in have]
+    for coin_id in missing:
+        rebuild(user_id, coin_id)
+    return bool(missing)
+
+
+def portfolio_lots(user_id):
+    """{coin_id: (realized, [[qty, unit_cost], ...])}, read from open lots only."""
+    out = {coin_id: (Decimal(realized), [])
+           for coin_id, realized in db.session.query(Position.coin_id, Position.realized)
+                                              .filter(Position.user_id == user_id)}
+
+    rows = (db.session.query(Lot.coin_id, Lot.qty_units, Trade.total, Trade.quantity)
+        .join(Trade, Trade.id == Lot.trade_id)
+        .filter(Lot.user_id == user_id)
+        .order_by(Lot.coin_id, Lot.txn_date.asc().nulls_first(), Lot.trade_id.asc()))
+    for coin_id, units, total, buy_qty in rows:
+        out.setdefault(coin_id, (Decimal("0"), []))[1].append([from_units(units), _unit_cost(total, buy_qty)])
+
+    return out
+
+
+def verify(fix=False):
+    """Compare persisted state with a full replay of every (user, coin).
+    Values are compared at storage precision (cents, 10dp qty); coins without a Position yet
+    are skipped. Returns [(user_id, coin_id, reason)]."""
+    state = {}
+    for (user_id,) in db.session.query(Position.user_id).distinct():
+        for coin_id, (realized, lots) in portfolio_lots(user_id).items():
+            state[(user_id, coin_id)] = (realized, lots)
+
+    all_trades = (Trade.query
+        .order_by(Trade.user_id, Trade.coin_id, Trade.txn_date.asc().nulls_first(), Trade.id.asc())
+        .all())
+
+    bad = []
+    for (user_id, coin_id), group in groupby(all_trades, key=lambda t: (t.user_id, t.coin_id)):
+        group = list(group)
+        if (user_id, coin_id) not in state:
+            continue        # not built yet; ensure_positions does that on first use
+
+        want = fifo_pnl_for_coin(group, Decimal("0"))
+        realized, lots = state[(user_id, coin_id)]
+        have = {"qty": sum(q for q, _ in lots) if lots else Decimal("0"),
+                "invested": sum(q * c for q, c in lots) if lots else Decimal("0"),
+                "realized": realized}
+        for field, places in (("qty", QTY), ("invested", CENTS), ("realized", CENTS)):
+            if Decimal(want[field]).quantize(places) != Decimal(have[field]).quantize(places):
+                bad.append((user_id, coin_id, f"{field}: replay={want[field]} stored={have[field]}"))
+
+        by_id = {t.id: t for t in group}
+        for trade_id, r in fifo_realized_by_trade(group).items():
+            t = by_id[trade_id]
+            if Decimal(t.realized_pnl).quantize(CENTS) != r.quantize(CENTS):
+                bad.append((user_id, coin_id, f"trade {trade_id} realized: replay={r} stored={t.realized_pnl}"))
+
+    if fix and bad:
+        for user_id, coin_id in {(u, c) for u, c, _ in bad}:
+            rebuild(user_id, coin_id)
+        db.session.commit()
+
+    return bad
@@ -0,0 +1,167 @@
+import logging
+import threading
+from time import time
+from flask import current_app
+from . import db, fx, prices
+from .models import Coin, Holding
+from .cache import cache_get, cache_set, cache_lease
+from .coingecko import fetch_json, fetch_many, cg_headers, CG_PRO, CG_PUB
+
+# Market data snapshot kept fresh by a background thread.
+# Requests only read the snapshot (one cache entry per coin, plus trending);
+# when something is missing or stale they wake the refresher and render what
+# is there. With the sqlite cache backend every worker shares the snapshot and
+# a lease lets only one of them do the periodic refresh.
+
+log = logging.getLogger(__name__)
+
+BATCH = 250                         # ids per /coins/markets call (CoinGecko's per_page max)
+SNAPSHOT_TTL = 7 * 24 * 3600        # serve stale rather than nothing
+
+
+def _coin_key(cg_id):
+    return ("market", "coin", cg_id)
+
+
+def held_coin_ids():
+    """Every cg_id any user holds."""
+    return sorted(cg for (cg,) in db.session.query(Coin.cg_id)
+                  .join(Holding, Holding.coin_id == Coin.id)
+                  .distinct())
+
+
+def refresh_markets(ids, vs_currency="inr", max_wait=30.0):
+    """Fetch /coins/markets for ids into the snapshot, batches in parallel. -> {cg_id: row} stored."""
+    now = time()
+    chunks = [ids[i:i + BATCH] for i in range(0, len(ids), BATCH)]
+    results = fetch_many([(f"{CG_PRO}/coins/markets", cg_headers(),
+                           {"vs_currency": vs_currency, "ids": ",".join(chunk),
+                            "price_change_percentage": "24h", "per_page": BATCH},
+                           f"{CG_PUB}/coins/markets") for chunk in chunks], max_wait=max_wait)
+    stored = {}
+    for rows in results:
+        for row in rows if isinstance(rows, list) else []:
+            if isinstance(row, dict) and row.get("id"):
+                row["fetched_at"] = now
+                cache_set(_coin_key(row["id"]), row, SNAPSHOT_TTL)
+                stored[row["id"]] = row
+    if stored:
+        prices.record(stored.values(), now)
+        db.session.commit()
+        cache_set(("market", "generation"), now, SNAPSHOT_TTL)
+    return stored
+
+
+def refresh_trending(max_wait=30.0):
+    data = fetch_json(f"{CG_PRO}/search/trending", headers=cg_headers(),
+                      fallback_url=f"{CG_PUB}/search/trending", max_wait=max_wait)
+    if isinstance(data, dict):
+        coins = [c.get("item", {}) for c in data.get("coins", []) if isinstance(c, dict)]
+        cache_set(("market", "trending"), {"ts": time(), "coins": coins}, SNAPSHOT_TTL)
+        return True
+    return False
+
+
+class MarketRefresher(threading.Thread):
+    def __init__(self, app, interval=60):
+        super().__init__(name="market-refresher", daemon=True)
+        self.app = app
+        self.interval = interval
+        self.wake = threading.Event()
+        self._wanted = set()
+        self._lock = threading.Lock()
+
+    def want(self, ids=()):
+        with self._lock:
+            self._wanted.update(ids)
+        self.wake.set()
+
+    def run(self):
+        while True:
+            self.wake.clear()
+            try:
+                self.refresh_once()
+            except Exception:
+                log.exception("market refresh failed")
+            self.wake.wait(self.interval)
+
+    def refresh_once(self):
+        with self._lock:
+            wanted, self._wanted = sorted(self._wanted), set()
+        with self.app.app_context():
+            if wanted:
+                refresh_markets(wanted)
+            # the periodic full refresh runs in one worker per interval
+            if cache_lease("market-refresh", self.interval * 0.9):
+                refresh_markets(held_coin_ids())
+                refresh_trending()
+            # FX moves slowly; retried every interval until the first rates land
+            if cache_lease("fx-refresh", self.app.config.get("FX_REFRESH_SECONDS", 3600)) or len(fx.rates()) < 2:
+                fx.refresh_rates()
+            if cache_lease("price-prune", 3600):
+                prices.prune(self.app.config.get("PRICE_KEEP_MINUTES_DAYS", 2),
+                             self.app.config.get("PRICE_KEEP_HOURS_DAYS", 90))
+
+
+_refresher = None
+_start_lock = threading.Lock()
+
+
+def refresher():
+    """The process's refresher, started on first use (after any fork). None if disabled."""
+    global _refresher
+    app = current_app._get_current_object()
+    if not app.config.get("MARKET_REFRESH", True):
+        return None
+    if _refresher is None:
+        with _start_lock:
+            if _refresher is None:
+                _refresher = MarketRefresher(app, app.config.get("MARKET_REFRESH_SECONDS", 60))
+                _refresher.start()
+    return _refresher
+
+
+def request_refresh(ids=()):
+    r = refresher()
+    if r is not None:
+        r.want(ids)
+
+
+def market_rows(ids):
+    """Snapshot rows for ids -> (rows, oldest fetched_at or None). Never calls upstream.
+    Coins missing from the snapshot (e.g. after a restart) fall back to the last
+    recorded price tick, price only."""
+    rows, missing = [], []
+    oldest = None
+    for cg_id in ids:
+        row = cache_get(_coin_key(cg_id))
+        if row is None:
+            missing.append(cg_id)
+            continue
+        rows.append(dict(row))          # callers normalize rows in place
+        ts = row.get("fetched_at") or 0
+        oldest = ts if oldest is None else min(oldest, ts)
+
+    for cg_id, (ts, price) in prices.latest_prices(missing).items():
+        rows.append({"id": cg_id, "current_price": float(price), "fetched_at": ts})
+        oldest = ts if oldest is None else min(oldest, ts)
+
+    stale_after = current_app.config.get("MARKET_REFRESH_SECONDS", 60) * 2
+    if missing or (oldest is not None and time() - oldest > stale_after):
+        request_refresh(missing)
+    else:
+        refresher()     # make sure the periodic refresh is running in this worker
+    return rows, oldest
+
+
+def generation():
+    """When the snapshot last took new prices (0 if never); part of the API's portfolio ETag."""
+    return cache_get(("market", "generation")) or 0
+
+
+def trending_coins():
+    data = cache_get(("market", "trending"))
+    if data is None:
+        request_refresh()
+        return []
+    return data.get("coins", [])
@@ -0,0 +1,354 @@
+import json
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from time import perf_counter, sleep, time
+from flask import Response, current_app, g, has_app_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from . import db
+
+# Per-request instrumentation, wired up by create_app():
+#   - wall time per view, SQL statements (count + time, from engine events),
+#     time in cg_get_json split into cache hits and upstream fetches, template time
+#   - /metrics: Prometheus text format for this worker process, including the
+#     CoinGecko client and cache counters
+#   - one JSON log line per request on the "website.requests" logger
+#   - PROFILE_SLOW_MS > 0: a sampling profiler; requests slower than that dump
+#     folded stacks (flamegraph.pl / speedscope input) to PROFILE_DIR
+# Counters live in process memory: scrape every worker, or sum in Prometheus.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+log = logging.getLogger("website.requests")
+
+
+class RequestMetrics:
+    __slots__ = ("t0", "sql", "sql_seconds", "upstream", "upstream_seconds",
+                 "cache_hits", "cache_seconds", "template_seconds", "_template_t0", "done")
+
+    def __init__(self):
+        self.t0 = perf_counter()
+        self.sql = 0
+        self.sql_seconds = self.upstream_seconds = self.cache_seconds = self.template_seconds = 0.0
+        self.upstream = self.cache_hits = 0
+        self._template_t0 = None
+        self.done = False
+
+
+def current():
+    """This request's RequestMetrics, or None outside a request (background threads, CLI)."""
+    return g.get("metrics") if has_app_context() else None
+
+
+# ---- registry ----
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}      # (name, labels) -> value
+        self.histograms = {}    # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.help = {}
+
+    def inc(self, name, labels, value=1.0):
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            h = self.histograms.get((name, labels))
+            if h is None:
+                h = self.histograms[(name, labels)] = [0] * (len(BUCKETS) + 1) + [0.0]
+            for i, le in enumerate(BUCKETS):
+                if value <= le:
+                    h[i] += 1
+            h[len(BUCKETS)] += 1
+            h[-1] += value
+
+    def render(self, gauges=()):
+        out = []
+
+        def head(name, kind):
+            out.append(f"# HELP {name} {self.help.get(name, name)}")
+            out.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((k, list(v)) for k, v in self.histograms.items())
+        last = None
+        for (name, labels), value in counters:
+            if name != last:
+                head(name, "counter")
+                last = name
+            out.append(f"{name}{_labels(labels)} {_num(value)}")
+        for (name, labels), h in histograms:
+            if name != last:
+                head(name, "histogram")
+                last = name
+            for le, n in zip(BUCKETS, h):
+                out.append(f"{name}_bucket{_labels(labels + (('le', _num(le)),))} {n}")
+            out.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {h[len(BUCKETS)]}")
+            out.append(f"{name}_count{_labels(labels)} {h[len(BUCKETS)]}")
+            out.append(f"{name}_sum{_labels(labels)} {_num(h[-1])}")
+        for name, kind, labels, value in gauges:
+            if name != last:
+                head(name, kind)
+                last = name
+            out.append(f"{name}{_labels(labels)} {_num(value)}")
+        return "\n".join(out) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+
+def _num(x):
+    return repr(float(x)) if isinstance(x, float) and not float(x).is_integer() else str(int(x))
+
+
+registry = Registry()
+registry.help.update({
+    "http_requests_total": "Requests by endpoint, method and status.",
+    "http_request_duration_seconds": "Wall time per request, by endpoint.",
+    "db_statements_total": "SQL statements executed, by endpoint.",
+    "db_statement_seconds_total": "Time spent executing SQL statements, by endpoint.",
+    "upstream_calls_total": "cg_get_json/fetch_many calls, by result (hit = served from cache).",
+    "upstream_seconds_total": "Time spent in cg_get_json/fetch_many calls, by result.",
+    "template_seconds_total": "Time spent rendering templates, by endpoint.",
+    "slow_requests_profiled_total": "Requests over PROFILE_SLOW_MS whose stacks were dumped.",
+})
+
+
+# ---- hooks ----
+def observe_upstream(seconds, hit):
+    """Called by the CoinGecko client around each cached call (hit) or fetch (miss)."""
+    m = current()
+    result = "hit" if hit else "miss"
+    registry.inc("upstream_calls_total", (("result", result),))
+    registry.inc("upstream_seconds_total", (("result", result),), seconds)
+    if m is not None:
+        if hit:
+            m.cache_hits += 1
+            m.cache_seconds += seconds
+        else:
+            m.upstream += 1
+            m.upstream_seconds += seconds
+
+
+def _endpoint():
+    return request.endpoint or "unmatched"
+
+
+def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_t0", []).append(perf_counter())
+
+
+def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get("metrics_t0")
+    if not stack:
+        return
+    seconds = perf_counter() - stack.pop()
+    m = current()
+    if m is not None:
+        m.sql += 1
+        m.sql_seconds += seconds
+
+
+def _error(exception_context):
+    # a failed statement never reaches after_cursor_execute
+    stack = exception_context.connection.info.get("metrics_t0") if exception_context.connection is not None else None
+    if stack:
+        stack.pop()
+
+
+def _template_start(sender, template, context, **extra):
+    m = current()
+    if m is not None:
+        m._template_t0 = perf_counter()
+
+
+def _template_done(sender, template, context, **extra):
+    m = current()
+    if m is not None and m._template_t0 is not None:
+        m.template_seconds += perf_counter() - m._template_t0
+        m._template_t0 = None
+
+
+def _start():
+    g.metrics = RequestMetrics()
+    if profiler is not None:
+        profiler.enter()
+
+
+def _finish(status):
+    m = g.get("metrics")
+    if m is None or m.done:
+        return
+    m.done = True
+    seconds = perf_counter() - m.t0
+    endpoint = _endpoint()
+    if endpoint == "metrics":
+        return
+    stacks = profiler.leave() if profiler is not None else None
+
+    ep = (("endpoint", endpoint),)
+    registry.inc("http_requests_total", ep + (("method", request.method), ("status", str(status))))
+    registry.observe("http_request_duration_seconds", ep, seconds)
+    registry.inc("db_statements_total", ep, m.sql)
+    registry.inc("db_statement_seconds_total", ep, m.sql_seconds)
+    registry.inc("template_seconds_total", ep, m.template_seconds)
+
+    profile = None
+    if stacks and seconds * 1000 >= current_app.config["PROFILE_SLOW_MS"]:
+        profile = profiler.dump(endpoint, stacks)
+        registry.inc("slow_requests_profiled_total", ep)
+
+    if current_app.config["REQUEST_LOG"]:
+        from flask_login import current_user
+        log.info(json.dumps({
+            "ts": round(time(), 3), "method": request.method, "path": request.path, "endpoint": endpoint,
+            "status": status, "ms": round(seconds * 1000, 1),
+            "sql": m.sql, "sql_ms": round(m.sql_seconds * 1000, 1),
+            "upstream": m.upstream, "upstream_ms": round(m.upstream_seconds * 1000, 1),
+            "cache_hits": m.cache_hits, "cache_ms": round(m.cache_seconds * 1000, 1),
+            "template_ms": round(m.template_seconds * 1000, 1),
+            "user": current_user.get_id() if g.get("_login_user") is not None else None,
+            "profile": profile,
+        }, separators=(",", ":")))
+
+
+# ---- sampling profiler ----
+class Profiler:
+    """Samples the stacks of threads currently serving a request every `interval` seconds.
+    Only runs while PROFILE_SLOW_MS is set; costs one sys._current_frames() per tick."""
+
+    def __init__(self, interval, out_dir):
+        self.interval = interval
+        self.out_dir = out_dir
+        self._active = {}           # thread ident -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def enter(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+
+    def leave(self):
+        with self._lock:
+            return self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[_fold(frame)] += 1
+
+    def dump(self, endpoint, stacks):
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"{int(time() * 1000)}-{endpoint.replace('.', '-')}-{os.getpid()}.folded")
+        with open(path, "w") as f:
+            for stack, n in stacks.most_common():
+                f.write(f"{stack} {n}\n")
+        return path
+
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+profiler = None
+
+
+# ---- wiring ----
+def _gauges():
+    from .cache import cache_stats
+    from .coingecko import http_stats
+    from .fragments import fragment_stats
+    from .passwords import hash_stats
+    out = []
+    http = http_stats()
+    for key, name in (("requests", "coingecko_requests_total"), ("errors", "coingecko_errors_total"),
+                      ("throttled_429", "coingecko_throttled_total"), ("rate_limited", "coingecko_rate_limited_total")):
+        out.append((name, "counter", (), http[key]))
+    out.append(("coingecko_in_flight", "gauge", (), http["in_flight"]))
+    out.append(("coingecko_connections_opened", "gauge", (), http["connections_opened"]))
+    cache = cache_stats()
+    backend = (("backend", cache["backend"]),)
+    for key in ("hits", "misses", "evictions", "collapsed"):
+        out.append((f"cache_{key}_total", "counter", backend, cache[key]))
+    out.append(("cache_entries", "gauge", backend, cache["size"]))
+    fragments = fragment_stats()
+    backend = (("backend", fragments["backend"]),)
+    for key in ("hits", "misses", "evictions"):
+        out.append((f"fragment_cache_{key}_total", "counter", backend, fragments[key]))
+    out.append(("fragment_cache_entries", "gauge", backend, fragments["size"]))
+    hashing = hash_stats()
+    out.append(("password_hash_in_flight", "gauge", (), hashing["in_flight"]))
+    out.append(("password_hash_queue_depth", "gauge", (), hashing["queued"]))
+    return out
+
+
+def metrics_view():
+    token = current_app.config["METRICS_TOKEN"]
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    return Response(registry.render(_gauges()), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    """Hook the request, SQL and template instrumentation into app (call inside an app context)."""
+    global profiler
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", _before_cursor)
+    event.listen(engine, "after_cursor_execute", _after_cursor)
+    event.listen(engine, "handle_error", _error)
+    before_render_template.connect(_template_start, app)
+    template_rendered.connect(_template_done, app)
+
+    if app.config["PROFILE_SLOW_MS"] > 0 and profiler is None:
+        profiler = Profiler(app.config["PROFILE_INTERVAL_MS"] / 1000, app.config["PROFILE_DIR"])
+
+    if app.config["REQUEST_LOG"] and not log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+        log.propagate = False
+
+    @app.before_request
+    def _metrics_start():
+        _start()
+
+    @app.after_request
+    def _metrics_finish(response):
+        _finish(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _metrics_teardown(exc):
+        # after_request is skipped when the view raised
+        if exc is not None:
+            _finish(500)
+        elif profiler is not None:
+            profiler.leave()
+
+    app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -0,0 +1,114 @@
+from sqlalchemy import inspect, select, text
+from . import db
+from .models import Budget, Category, DataChange, DataVersion, FxRate, SchemaVersion, Savings, Trade, Transaction, User
+
+# Versioned schema migrations. SchemaVersion holds one row per applied step;
+# upgrade() runs the pending steps in order, each in its own transaction, at
+# startup (create_db) and from `flask db upgrade`. A new database is built
+# straight from the models and stamped with every version.
+# Steps only add things (tables, columns with defaults, indexes), so workers
+# still running the previous release keep working while a deploy rolls out.
+
+
+# ---- helpers for steps ----
+def add_index(conn, model, name):
+    """Create one of the model's declared indexes if the database lacks it."""
+    idx = next(i for i in model.__table__.indexes if i.name == name)
+    idx.create(conn, checkfirst=True)
+
+
+def add_column(conn, model, name):
+    """ALTER TABLE ... ADD COLUMN for a column declared on the model, if missing.
+    The column needs to be nullable or have a server_default."""
+    table = model.__table__
+    if name in {c["name"] for c in inspect(conn).get_columns(table.name)}:
+        return
+    spec = conn.dialect.ddl_compiler(conn.dialect, None).get_column_specification(table.c[name])
+    conn.execute(text(f"ALTER TABLE {conn.dialect.identifier_preparer.format_table(table)} ADD COLUMN {spec}"))
+
+
+def drop_index(conn, table_name, name):
+    if name in {i["name"] for i in inspect(conn).get_indexes(table_name)}:
+        conn.execute(text(f"DROP INDEX {conn.dialect.identifier_preparer.quote(name)}"))
+
+
+# ---- steps ----
+def _missing_tables(conn):
+    # before migrations, create_all() added new tables but never touched existing ones
+    db.metadata.create_all(conn)
+
+
+def _hot_indexes(conn):
+    for model, name in ((Transaction, "ix_transaction_user_date"),
+                        (Transaction, "ix_transaction_user_cat_date"),
+                        (Transaction, "ix_transaction_user_txn_date"),
+                        (Category, "ix_category_user_name"),
+                        (Trade, "ix_trade_user_coin_date"),
+                        (Trade, "ix_trade_user_date"),
+                        (Budget, "ix_budget_user_category"),
+                        (Savings, "ix_savings_user_date")):
+        add_index(conn, model, name)
+    drop_index(conn, "trade", "ix_trade_user_id")      # prefix of both trade indexes above
+
+
+def _data_versions(conn):
+    for model in (DataVersion, DataChange):
+        model.__table__.create(conn, checkfirst=True)
+
+
+def _currencies(conn):
+    add_column(conn, User, "currency")
+    add_column(conn, Transaction, "currency")
+    add_column(conn, Transaction, "orig_amount")
+    FxRate.__table__.create(conn, checkfirst=True)
+
+
+MIGRATIONS = [
+    (1, "tables added since the first release", _missing_tables),
+    (2, "composite indexes for the hot query patterns", _hot_indexes),
+    (3, "per-user data versions and change log for the JSON API", _data_versions),
+    (4, "display currency, entered currency and FX rates", _currencies),
+]
+HEAD = MIGRATIONS[-1][0]
+
+
+# ---- runner ----
+def _lock(conn):
+    # SQLite: the transaction already holds the write lock (BEGIN IMMEDIATE outside requests)
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(7301)"))
+
+
+def applied_versions(conn):
+    if not inspect(conn).has_table(SchemaVersion.__tablename__):
+        return set()
+    return {v for (v,) in conn.execute(select(SchemaVersion.version))}
+
+
+def current():
+    with db.engine.connect() as conn:
+        return max(applied_versions(conn), default=0)
+
+
+def upgrade(target=HEAD):
+    """Apply pending steps up to `target`. -> (created a new database, [(version, name)] applied)."""
+    with db.engine.begin() as conn:
+        _lock(conn)
+        if not inspect(conn).get_table_names():
+            db.metadata.create_all(conn)
+            conn.execute(SchemaVersion.__table__.insert(), [{"version": v, "name": n} for v, n, _ in MIGRATIONS])
+            return True, []
+
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version > target:
+            break
+        with db.engine.begin() as conn:
+            _lock(conn)
+            if version in applied_versions(conn):      # done already, possibly by another worker
+                continue
+            step(conn)
+            SchemaVersion.__table__.create(conn, checkfirst=True)
+            conn.execute(SchemaVersion.__table__.insert(), {"version": version, "name": name})
+        applied.append((version, name))
+    return False, applied
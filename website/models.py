@@ -9,14 +9,19 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(150), unique=True, nullable=False)
     password = db.Column(db.String(150), nullable=False)
     date_created = db.Column(db.DateTime(timezone=True), server_default=func.now())
-    transactions = db.relationship('Transaction', backref='owner', lazy=True)
-    categories = db.relationship('Category', backref='owner', lazy=True)
+    currency = db.Column(db.String(3), nullable=False, server_default='INR')     # display currency (fx.py)
+    # never loaded implicitly: query by user_id instead (rows are removed by ON DELETE CASCADE)
+    transactions = db.relationship('Transaction', backref='owner', lazy='raise', passive_deletes=True)
+    categories = db.relationship('Category', backref='owner', lazy='raise', passive_deletes=True)
 
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     transactions = db.relationship('Transaction', backref='category', lazy=True)
+    __table_args__ = (
+        db.Index('ix_category_user_name', 'user_id', 'name'),
+    )
 
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -26,12 +31,50 @@ class Transaction(db.Model):
     note = db.Column(db.String, nullable=True)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    # amount is always in the base currency; when entered in another one, what was typed
+    currency = db.Column(db.String(3), nullable=True)
+    orig_amount = db.Column(db.Numeric(18, 2), nullable=True)
+    display_amount = db.query_expression()          # set per query with fx.amount_expr
 
     __table_args__ = (
         CheckConstraint("txn IN ('CREDIT', 'DEBIT')", name="check_txn_type"),
+        # ledger keyset pagination: newest-first on (txn_date, id), optionally narrowed by category/type
+        db.Index('ix_transaction_user_date', 'user_id', 'txn_date', 'id'),
+        db.Index('ix_transaction_user_cat_date', 'user_id', 'category_id', 'txn_date', 'id'),
+        db.Index('ix_transaction_user_txn_date', 'user_id', 'txn', 'txn_date', 'id'),
     )
 
 
+class UserBalance(db.Model):
+    # running CREDIT - DEBIT total, updated alongside every Transaction write (ledger.txn_changed)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    balance = db.Column(db.Numeric(18, 2), nullable=False, default=0)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class SpendRollup(db.Model):
+    # CREDIT/DEBIT totals per (user, period, bucket, category), kept by ledger.txn_changed (see rollups.py)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    period = db.Column(db.String(1), nullable=False)                 # 'm' month | 'w' week
+    bucket = db.Column(db.String(8), nullable=False)                 # '2025-07' | '2025-W27'
+    category_id = db.Column(db.Integer, nullable=False, default=0)   # 0 = uncategorized
+    credit = db.Column(db.Numeric(18, 2), nullable=False, default=0)
+    debit = db.Column(db.Numeric(18, 2), nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'period', 'bucket', 'category_id', name='uq_rollup_user_period_bucket_cat'),
+    )
+
+
+class TxnFingerprint(db.Model):
+    # how many of a user's transactions share a (day, type, amount) key; import dedupe (see fingerprints.py)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    fp = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
 class Coin(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     cg_id = db.Column(db.String(100), unique=True, nullable=False, index=True)
@@ -64,14 +107,74 @@ class Trade(db.Model):
     realized_pnl = db.Column(db.Numeric(18,2), nullable=False, default=0)   # <—
     txn_date = db.Column(db.DateTime(timezone=True), server_default=func.now())
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), index=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     coin_id = db.Column(db.Integer, db.ForeignKey('coin.id', ondelete='RESTRICT'), index=True, nullable=False)
+    __table_args__ = (
+        # per-coin trade history / FIFO replay order; all of a user's trades by date (history, export)
+        db.Index('ix_trade_user_coin_date', 'user_id', 'coin_id', 'txn_date', 'id'),
+        db.Index('ix_trade_user_date', 'user_id', 'txn_date', 'id'),
+    )
+
+class Position(db.Model):
+    # persisted FIFO state per (user, coin); see lots.py
+    id = db.Column(db.Integer, primary_key=True)
+    realized = db.Column(db.Numeric(28, 10), nullable=False, default=0)
+    last_date = db.Column(db.DateTime(timezone=True), nullable=True)     # last trade folded in
+    last_trade_id = db.Column(db.Integer, nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    coin_id = db.Column(db.Integer, db.ForeignKey('coin.id', ondelete='RESTRICT'), nullable=False)
+    __table_args__ = (
+        UniqueConstraint('user_id', 'coin_id', name='uq_position_user_coin'),
+    )
+
+class Lot(db.Model):
+    # open FIFO lot: what is left of one BUY trade
+    id = db.Column(db.Integer, primary_key=True)
+    qty_units = db.Column(db.BigInteger, nullable=False)                  # remaining, in 1e-10 coin (exact on SQLite)
+    txn_date = db.Column(db.DateTime(timezone=True), nullable=True)       # copy of the BUY's date, for ordering
+    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id', ondelete='CASCADE'), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    coin_id = db.Column(db.Integer, db.ForeignKey('coin.id', ondelete='RESTRICT'), nullable=False)
+    __table_args__ = (
+        db.Index('ix_lot_user_coin_date', 'user_id', 'coin_id', 'txn_date', 'trade_id'),
+    )
+
+class LotFill(db.Model):
+    # quantity a SELL took from a BUY lot, kept so a back-dated trade can be unwound
+    id = db.Column(db.Integer, primary_key=True)
+    qty_units = db.Column(db.BigInteger, nullable=False)                  # 1e-10 coin
+    sell_id = db.Column(db.Integer, db.ForeignKey('trade.id', ondelete='CASCADE'), nullable=False, index=True)
+    buy_id = db.Column(db.Integer, db.ForeignKey('trade.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    coin_id = db.Column(db.Integer, db.ForeignKey('coin.id', ondelete='RESTRICT'), nullable=False)
+    __table_args__ = (
+        db.Index('ix_lotfill_user_coin', 'user_id', 'coin_id'),
+    )
+
+
+class PriceTick(db.Model):
+    # closing price per time bucket: resolution 'm' minute, 'h' hour, 'd' day (see prices.py)
+    cg_id = db.Column(db.String(100), primary_key=True)
+    resolution = db.Column(db.String(1), primary_key=True)
+    bucket_ts = db.Column(db.Integer, primary_key=True)       # epoch seconds, start of bucket (UTC)
+    price = db.Column(db.Numeric(28, 10), nullable=False)     # INR
+
+
+class FxRate(db.Model):
+    # units of `currency` per 1 INR, refreshed with the market snapshot (see fx.py)
+    currency = db.Column(db.String(3), primary_key=True)
+    rate = db.Column(db.Numeric(28, 12), nullable=False)
+    fetched_at = db.Column(db.Integer, nullable=False)        # epoch seconds
+
 
 class Budget(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.Numeric(18, 2), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
+    __table_args__ = (
+        db.Index('ix_budget_user_category', 'user_id', 'category_id'),
+    )
 
 class Savings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -79,4 +182,32 @@ class Savings(db.Model):
     title = db.Column(db.String(150), nullable=False)
     target_date = db.Column(db.Integer, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
-    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
\ No newline at end of file
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
+    __table_args__ = (
+        db.Index('ix_savings_user_date', 'user_id', 'target_date', 'id'),
+    )
+
+
+class SchemaVersion(db.Model):
+    # one row per applied migration (see migrations.py)
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+
+class DataVersion(db.Model):
+    # per-user counter bumped on every change to the API's entities (see versions.py)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True, autoincrement=False)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+class DataChange(db.Model):
+    # what changed at each version; entity_id NULL with op 'reload' means "refetch them all"
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False)
+    entity = db.Column(db.String(12), nullable=False)         # transaction | category | trade | holding
+    entity_id = db.Column(db.Integer, nullable=True)
+    op = db.Column(db.String(6), nullable=False)              # upsert | delete | reload
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    __table_args__ = (
+        db.Index('ix_datachange_user_version', 'user_id', 'version'),
+    )
@@ -0,0 +1,160 @@
+import multiprocessing
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from time import perf_counter
+from flask import current_app, request
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+from .metrics import registry
+
+# Password hashing for login and register, off the request thread.
+# Each hash runs in a small process pool (HASH_WORKERS; 0 = inline), so a burst
+# of logins queues for those processes instead of taking every CPU the page
+# requests need. Admission is bounded: at most HASH_MAX_PENDING hashes queued
+# or running per worker process, and HASH_MAX_PER_CLIENT at once per client IP
+# and per email. Past either limit, or after HASH_TIMEOUT seconds, the caller
+# gets Busy and answers 429. Behind a reverse proxy set PROXY_HOPS so the
+# client address is the caller's, not the proxy's.
+# PASSWORD_METHOD is the werkzeug method for new hashes ("pbkdf2:sha256:<n>",
+# "scrypt:<n>:<r>:<p>"). A login whose stored hash used other parameters is
+# re-hashed with the current ones.
+# The pool is started on first use in each process (after any fork). Its
+# processes are forked: spawn/forkserver children would re-import __main__
+# (main.py builds the app at import). They only ever run the hash function.
+
+registry.help.update({
+    "password_hash_seconds": "Time to hash or verify a password, including the wait for a pool process, by op.",
+    "password_hash_rejected_total": "Hash requests turned away, by reason (pending, client, timeout, broken).",
+})
+
+
+class Busy(Exception):
+    """Too many password hashes in progress; try again shortly."""
+
+
+class _Admission:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.by_client = Counter()
+
+    def enter(self, keys, max_pending, max_per_client):
+        with self._lock:
+            if self.in_flight >= max_pending:
+                reason = "pending"
+            elif any(self.by_client[k] >= max_per_client for k in keys):
+                reason = "client"
+            else:
+                self.in_flight += 1
+                self.by_client.update(keys)
+                return
+        registry.inc("password_hash_rejected_total", (("reason", reason),))
+        raise Busy("Too many sign-ins in progress; please try again in a moment.")
+
+    def leave(self, keys):
+        with self._lock:
+            self.in_flight -= 1
+            self.by_client.subtract(keys)
+            for k in keys:
+                if self.by_client[k] <= 0:
+                    del self.by_client[k]
+
+
+_admission = _Admission()
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool, _pool_pid
+    workers = current_app.config["HASH_WORKERS"]
+    if workers <= 0:
+        return None
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods()
+                                                  else None)
+                _pool, _pool_pid = ProcessPoolExecutor(max_workers=workers, mp_context=ctx), os.getpid()
+    return _pool
+
+
+def _discard(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(op, keys, fn, *args):
+    cfg = current_app.config
+    _admission.enter(keys, cfg["HASH_MAX_PENDING"], cfg["HASH_MAX_PER_CLIENT"])
+    t = perf_counter()
+    try:
+        pool = _executor()
+        if pool is None:
+            return fn(*args)
+        try:
+            return pool.submit(fn, *args).result(timeout=cfg["HASH_TIMEOUT"])
+        except FutureTimeout:
+            registry.inc("password_hash_rejected_total", (("reason", "timeout"),))
+            raise Busy("The server is busy; please try again in a moment.") from None
+        except BrokenProcessPool:           # a pool process died (OOM kill, ...); start afresh next time
+            _discard(pool)
+            registry.inc("password_hash_rejected_total", (("reason", "broken"),))
+            raise Busy("The server is busy; please try again in a moment.") from None
+    finally:
+        _admission.leave(keys)
+        registry.observe("password_hash_seconds", (("op", op),), perf_counter() - t)
+
+
+# ---- parameters ----
+def normalize(method):
+    """Spell out werkzeug's defaults: 'pbkdf2:sha256' -> 'pbkdf2:sha256:1000000'."""
+    name, *args = method.split(":")
+    if name == "pbkdf2" and len(args) <= 2:
+        return f"pbkdf2:{args[0] if args else 'sha256'}:{int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS}"
+    if name == "scrypt" and len(args) in (0, 3):
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    raise ValueError(f"Unsupported PASSWORD_METHOD {method!r}.")
+
+
+def method():
+    return normalize(current_app.config["PASSWORD_METHOD"])
+
+
+def needs_rehash(pwhash):
+    """True if pwhash was made with other parameters than PASSWORD_METHOD."""
+    return pwhash.split("$", 1)[0] != method()
+
+
+# ---- public ----
+def client_keys(email=None):
+    """Concurrency keys for this request: its client address, and the email if given."""
+    keys = [("ip", request.remote_addr or "")]
+    if email:
+        keys.append(("email", email.strip().lower()))
+    return keys
+
+
+def hash_password(password, keys=()):
+    """New hash for password with PASSWORD_METHOD. Raises Busy."""
+    return _run("hash", keys, generate_password_hash, password, method())
+
+
+def verify(pwhash, password, keys=()):
+    """check_password_hash in the pool. Raises Busy."""
+    return _run("verify", keys, check_password_hash, pwhash, password)
+
+
+def hash_stats():
+    """In-flight hashes for this worker process, and how many wait for a pool process."""
+    with _admission._lock:
+        n = _admission.in_flight
+    workers = max(current_app.config["HASH_WORKERS"], 0)
+    return {"in_flight": n, "queued": max(0, n - workers) if workers else 0, "workers": workers}
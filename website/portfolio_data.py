@@ -0,0 +1,72 @@
+from collections import namedtuple
+from decimal import Decimal
+from sqlalchemy import Numeric, literal, type_coerce
+from . import db
+from .fifo import fifo_from_lots
+from .lots import portfolio_lots
+from .models import Coin, Holding, Trade
+
+# Read side of the portfolio pages. The queries are one SELECT each returning plain
+# row tuples, so templates can loop over them as often as they like without
+# touching lazy relationships (Holding.coin was one SELECT per holding, per use).
+
+HoldingRow = namedtuple("HoldingRow", "coin_id quantity invested price_per_coin txn_date cg_id name symbol")
+TradeRow = namedtuple("TradeRow", "id side quantity price_per_coin total realized_pnl txn_date coin_id")
+
+
+def holdings_query(user_id):
+    return (db.session.query(Holding.coin_id, Holding.quantity, Holding.invested, Holding.price_per_coin,
+                             Holding.txn_date, Coin.cg_id, Coin.coin, Coin.symbol)
+        .join(Coin, Coin.id == Holding.coin_id)
+        .filter(Holding.user_id == user_id)
+        .order_by(Holding.id))
+
+
+def trades_query(user_id, coin_id=None, display=None):
+    """With a display (fx.display()) the money columns come back in its currency."""
+    price, total, pnl = Trade.price_per_coin, Trade.total, Trade.realized_pnl
+    if display is not None and display.factor != 1:
+        f = literal(display.factor, Numeric(28, 12))
+        price, total, pnl = (type_coerce(c * f, c.type) for c in (price, total, pnl))
+    q = (db.session.query(Trade.id, Trade.side, Trade.quantity, price, total, pnl, Trade.txn_date, Trade.coin_id)
+        .filter(Trade.user_id == user_id))
+    if coin_id is not None:
+        q = q.filter(Trade.coin_id == coin_id)
+    return q.order_by(Trade.txn_date.desc(), Trade.id.desc())
+
+
+def holdings(user_id):
+    """-> [HoldingRow] for the user's holdings with their coin, oldest holding first."""
+    return [HoldingRow(*r) for r in holdings_query(user_id)]
+
+
+def trades(user_id, coin_id=None, display=None):
+    """-> [TradeRow] for one coin (or all of them), newest first."""
+    return [TradeRow(*r) for r in trades_query(user_id, coin_id, display)]
+
+
+MONEY = ("value", "invested", "realized", "unrealized", "pnl")
+
+
+def valuation(user_id, holdings, prices, display=None):
+    """FIFO figures per held coin priced in `prices` ({cg_id: Decimal}; coins without a
+    price are left out) and portfolio totals. -> ({coin_id: calc}, totals)
+    Money figures are in the base currency, or in display's (fx.display()) if given."""
+    lots_by_coin = portfolio_lots(user_id)
+    factor = display.factor if display is not None else None
+    calc_map = {}
+    for h in holdings:
+        price = prices.get(h.cg_id)
+        if price is None:
+            continue
+        realized, lots = lots_by_coin.get(h.coin_id, (Decimal("0"), []))
+        calc = fifo_from_lots(lots, realized, Decimal(price))
+        if factor is not None and factor != 1:
+            calc.update({k: calc[k] * factor for k in MONEY})
+        calc_map[h.coin_id] = calc
+
+    totals = {k: sum((c[k] for c in calc_map.values()), Decimal(0))
+              for k in ("value", "invested", "realized", "unrealized")}
+    totals["pnl"] = totals["realized"] + totals["unrealized"]
+    totals["pnl_pct"] = (totals["pnl"] / totals["invested"] * 100) if totals["invested"] else None
+    return calc_map, totals
@@ -0,0 +1,124 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from time import time
+from sqlalchemy import Float, and_, func, select, type_coerce
+from . import db
+from .dialect import insert
+from .models import PriceTick, Trade, Coin
+
+# Price history. Every market fetch writes the price into the current minute,
+# hour and day bucket of each coin (last write wins, so each bucket holds its
+# closing price). prune() drops fine-grained rows past their retention, leaving
+# hours for recent months and days forever.
+
+RESOLUTIONS = {"m": 60, "h": 3600, "d": 86400}
+
+
+def record(rows, now=None):
+    """Write /coins/markets rows into every resolution's current bucket. Caller commits."""
+    now = int(now or time())
+    values = []
+    for row in rows:
+        price = row.get("current_price") if isinstance(row, dict) else None
+        if not row.get("id") or price is None:
+            continue
+        for res, step in RESOLUTIONS.items():
+            values.append({"cg_id": row["id"], "resolution": res,
+                           "bucket_ts": now - now % step, "price": Decimal(str(price))})
+    if values:
+        stmt = insert(PriceTick)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=["cg_id", "resolution", "bucket_ts"],
+            set_={"price": stmt.excluded.price},
+        ), values)
+    return len(values)
+
+
+def prune(keep_minutes_days=2, keep_hours_days=90, now=None):
+    """Retention: drop minute rows older than N days and hour rows older than M days."""
+    now = int(now or time())
+    n = PriceTick.query.filter(PriceTick.resolution == "m",
+                               PriceTick.bucket_ts < now - keep_minutes_days * 86400).delete()
+    n += PriceTick.query.filter(PriceTick.resolution == "h",
+                                PriceTick.bucket_ts < now - keep_hours_days * 86400).delete()
+    db.session.commit()
+    return n
+
+
+def latest_prices(cg_ids, resolution="m", before=None):
+    """{cg_id: (bucket_ts, price)} for the newest tick of each coin (strictly before `before` if given)."""
+    if not cg_ids:
+        return {}
+    q = (db.session.query(PriceTick.cg_id, func.max(PriceTick.bucket_ts).label("ts"))
+         .filter(PriceTick.cg_id.in_(cg_ids), PriceTick.resolution == resolution))
+    if before is not None:
+        q = q.filter(PriceTick.bucket_ts < before)
+    last = q.group_by(PriceTick.cg_id).subquery()
+    rows = (db.session.query(PriceTick.cg_id, PriceTick.bucket_ts, PriceTick.price)
+            .join(last, and_(PriceTick.cg_id == last.c.cg_id, PriceTick.bucket_ts == last.c.ts))
+            .filter(PriceTick.resolution == resolution))
+    return {cg: (ts, price) for cg, ts, price in rows}
+
+
+def price_range(cg_ids, start, end, resolution="d"):
+    """Ticks in [start, end] ordered by time -> [(bucket_ts, cg_id, float price)]."""
+    # Core rows with float prices, skipping ORM row loading and Decimal conversion
+    return db.session.connection().execute(
+        select(PriceTick.bucket_ts, PriceTick.cg_id, type_coerce(PriceTick.price, Float))
+        .where(PriceTick.cg_id.in_(cg_ids), PriceTick.resolution == resolution,
+               PriceTick.bucket_ts >= start, PriceTick.bucket_ts <= end)
+        .order_by(PriceTick.bucket_ts)
+    ).all()
+
+
+def _epoch(dt):
+    if dt is None:
+        return 0
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def portfolio_history(user_id, start, end, resolution="d"):
+    """Portfolio value per bucket between two epoch timestamps -> [(bucket_ts, value)].
+    Holdings are rebuilt from Trade (BUY adds, SELL removes); prices carry forward
+    from the last known tick."""
+    step = RESOLUTIONS[resolution]
+    start -= start % step
+
+    trades = (db.session.query(Coin.cg_id, Trade.side, Trade.quantity, Trade.txn_date)
+              .join(Coin, Coin.id == Trade.coin_id)
+              .filter(Trade.user_id == user_id)
+              .order_by(Trade.txn_date.asc(), Trade.id.asc())
+              .all())
+    cg_ids = sorted({t[0] for t in trades})
+    if not cg_ids:
+        return []
+
+    price = {cg: float(p) for cg, (ts, p) in latest_prices(cg_ids, resolution, before=start).items()}
+    ticks = price_range(cg_ids, start, end, resolution)
+
+    # running total, adjusted only for coins whose quantity or price changed
+    qty = dict.fromkeys(cg_ids, 0.0)
+    total = 0.0
+    out = []
+    ti = ki = 0
+    for b in range(start, end + 1, step):
+        b_end = b + step
+        while ti < len(trades) and _epoch(trades[ti][3]) < b_end:
+            cg, side, q, _ = trades[ti]
+            new = max(0.0, qty[cg] + (float(q) if side == "BUY" else -float(q)))
+            total += (new - qty[cg]) * price.get(cg, 0.0)
+            qty[cg] = new
+            ti += 1
+        while ki < len(ticks) and ticks[ki][0] < b_end:
+            _, cg, p = ticks[ki]
+            total += qty[cg] * (p - price.get(cg, 0.0))
+            price[cg] = p
+            ki += 1
+        out.append((b, total))
+    return out
+
+
+def to_iso(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
@@ -0,0 +1,87 @@
+from datetime import datetime
+from sqlalchemy import and_, func
+from . import db
+from .budgets import spent_query
+from .export import rows_query
+from .ledger import ledger_query
+from .portfolio_data import holdings_query, trades_query
+from .models import (Budget, Category, DataChange, DataVersion, Holding, Lot, LotFill, Position, PriceTick, Savings,
+                     SpendRollup, Trade, Transaction, TxnFingerprint, UserBalance)
+
+# The views' hot queries, built the way the views build them, and the
+# EXPLAIN QUERY PLAN check behind `flask db explain`: on SQLite none of them
+# may scan a whole table or sort rows for ORDER BY. A new query on a hot path
+# belongs in statements() so a missing index shows up before it ships.
+
+PROBLEMS = ("SCAN ", "USE TEMP B-TREE FOR ORDER BY")
+ALLOWED = {
+    "budgets": ("USE TEMP B-TREE FOR ORDER BY",),      # sorts one user's handful of budgets
+}
+
+
+def statements(user_id=1, coin_id=1):
+    """-> [(name, SQLAlchemy statement)]"""
+    day = datetime(2025, 1, 1)
+    page = (Transaction.txn_date.desc().nulls_last(), Transaction.id.desc())
+    return [
+        ("ledger page", ledger_query(user_id).order_by(*page).limit(51)),
+        ("ledger page after cursor", ledger_query(user_id).filter(Transaction.txn_date < day).order_by(*page).limit(51)),
+        ("ledger by category", ledger_query(user_id, {"category": 1}).order_by(*page).limit(51)),
+        ("ledger by type and date", ledger_query(user_id, {"txn": "DEBIT", "from": day}).order_by(*page).limit(51)),
+        ("categories", Category.query.filter_by(user_id=user_id)),
+        ("category by name", Category.query.filter_by(user_id=user_id, name="Food")),
+        ("balance", UserBalance.query.filter_by(user_id=user_id)),
+        ("budgets", spent_query("2025-01", [user_id])),
+        ("budget for category", Budget.query.filter_by(user_id=user_id, category_id=1)),
+        ("stats series", db.session.query(SpendRollup.bucket, SpendRollup.credit)
+            .filter(SpendRollup.user_id == user_id, SpendRollup.period == "m", SpendRollup.bucket >= "2024-01")
+            .order_by(SpendRollup.bucket, SpendRollup.category_id)),
+        ("goals", Savings.query.filter_by(user_id=user_id).order_by(Savings.target_date, Savings.id)),
+        ("holdings", holdings_query(user_id)),
+        ("holding", Holding.query.filter_by(user_id=user_id, coin_id=coin_id)),
+        ("coin trades", trades_query(user_id, coin_id)),
+        ("all trades", trades_query(user_id)),
+        ("fifo replay", db.session.query(Trade.id, Trade.side, Trade.quantity)
+            .filter(Trade.user_id == user_id, Trade.coin_id == coin_id)
+            .order_by(Trade.txn_date.asc().nulls_first(), Trade.id.asc())),
+        ("position", Position.query.filter_by(user_id=user_id, coin_id=coin_id)),
+        ("open lots", db.session.query(Lot, Trade.total).join(Trade, Trade.id == Lot.trade_id)
+            .filter(Lot.user_id == user_id, Lot.coin_id == coin_id)
+            .order_by(Lot.txn_date.asc().nulls_first(), Lot.trade_id.asc())),
+        ("lot fills of sells", LotFill.query.filter(LotFill.sell_id.in_([1, 2]))),
+        ("import dedupe", db.session.query(TxnFingerprint.fp, TxnFingerprint.count)
+            .filter(TxnFingerprint.user_id == user_id, TxnFingerprint.fp.in_([1, 2]))),
+        ("latest price", db.session.query(PriceTick.cg_id, func.max(PriceTick.bucket_ts))
+            .filter(PriceTick.cg_id.in_(["bitcoin"]), PriceTick.resolution == "m").group_by(PriceTick.cg_id)),
+        ("price range", db.session.query(PriceTick.bucket_ts, PriceTick.price)
+            .filter(and_(PriceTick.cg_id.in_(["bitcoin"]), PriceTick.resolution == "d",
+                         PriceTick.bucket_ts >= 0, PriceTick.bucket_ts <= 1 << 31))
+            .order_by(PriceTick.bucket_ts)),
+        ("portfolio history", db.session.query(Trade.coin_id, Trade.side, Trade.quantity, Trade.txn_date)
+            .filter(Trade.user_id == user_id).order_by(Trade.txn_date.asc(), Trade.id.asc())),
+        ("data version", db.session.query(DataVersion.version).filter(DataVersion.user_id == user_id)),
+        ("changes since", db.session.query(DataChange.version, DataChange.entity, DataChange.entity_id, DataChange.op)
+            .filter(DataChange.user_id == user_id, DataChange.version > 5).order_by(DataChange.version, DataChange.id)),
+        ("transaction export", rows_query("transactions", user_id, {})),
+        ("trade export", rows_query("trades", user_id, {})),
+    ]
+
+
+def explain(stmt):
+    """EXPLAIN QUERY PLAN rows (detail strings) for a statement, on the session's SQLite connection."""
+    stmt = getattr(stmt, "statement", stmt)
+    conn = db.session.connection()
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    params = compiled.construct_params()
+    args = tuple(params[k] for k in compiled.positiontup)
+    return [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), args)]
+
+
+def check(user_id=1, coin_id=1):
+    """-> [(name, plan lines, problem lines)] for every statement."""
+    out = []
+    for name, stmt in statements(user_id, coin_id):
+        plan = explain(stmt)
+        allowed = ALLOWED.get(name, ())
+        out.append((name, plan, [p for p in plan if p.startswith(PROBLEMS) and not p.startswith(allowed)]))
+    return out
@@ -0,0 +1,145 @@
+from functools import lru_cache
+from decimal import Decimal
+from sqlalchemy import case, func
+from . import db
+from .dialect import insert, month_label, week_label
+from .models import Transaction, SpendRollup
+
+# Spend/income per (user, period, bucket, category), maintained incrementally:
+# every Transaction add/edit/delete goes through ledger.txn_changed, which
+# calls apply() with the before/after snapshots. A user's rows are built from
+# one GROUP BY the first time they are touched (ensure), so old data needs no backfill.
+# Transactions without a date belong to no bucket: both the rebuild and the
+# incremental path leave them out.
+
+PERIODS = {"m": "%Y-%m", "w": "%Y-W%W"}     # Python strftime; dialect.month_label/week_label in SQL
+CENTS = Decimal("0.01")
+
+
+def bucket(period, d):
+    """Bucket label of a date, None for an undated transaction."""
+    return _bucket(period, d) if d is not None else None
+
+
+@lru_cache(maxsize=4096)
+def _bucket(period, d):
+    return d.strftime(PERIODS[period])
+
+
+def bucket_expr(period):
+    return (month_label if period == "m" else week_label)(Transaction.txn_date)
+
+
+def _has_rows(user_id):
+    return db.session.query(SpendRollup.id).filter(SpendRollup.user_id == user_id).first() is not None
+
+
+def rebuild(user_id):
+    """Recompute a user's rollups from the transaction table (one GROUP BY per period)."""
+    SpendRollup.query.filter(SpendRollup.user_id == user_id).delete()
+    credit = func.coalesce(func.sum(case((Transaction.txn == "CREDIT", Transaction.amount), else_=0)), 0)
+    debit = func.coalesce(func.sum(case((Transaction.txn == "DEBIT", Transaction.amount), else_=0)), 0)
+    cat = func.coalesce(Transaction.category_id, 0)
+    rows = []
+    for period in PERIODS:
+        b = bucket_expr(period)
+        rows += [{"user_id": user_id, "period": period, "bucket": bk, "category_id": c,
+                  "credit": Decimal(str(cr)).quantize(CENTS), "debit": Decimal(str(de)).quantize(CENTS), "count": n}
+                 for bk, c, cr, de, n in (db.session.query(b, cat, credit, debit, func.count(Transaction.id))
+                                          .filter(Transaction.user_id == user_id,
+                                                  Transaction.txn_date.isnot(None))
+                                          .group_by(b, cat))]
+    if rows:
+        db.session.execute(SpendRollup.__table__.insert(), rows)
+    return len(rows)
+
+
+def ensure(user_id):
+    """Build the user's rollups if they have none yet. -> True if it did (caller commits)."""
+    if _has_rows(user_id):
+        return False
+    return rebuild(user_id) > 0
+
+
+def add_delta(deltas, s, sign=1):
+    """Accumulate one TxnSnap (sign -1 to remove it) into a {key: (credit, debit, count)} dict."""
+    if s.txn_date is None:
+        return
+    for period in PERIODS:
+        key = (s.user_id, period, bucket(period, s.txn_date), s.category_id or 0)
+        cr, de, n = deltas.get(key, (0, 0, 0))
+        if s.txn == "CREDIT":
+            cr += sign * s.amount
+        else:
+            de += sign * s.amount
+        deltas[key] = (cr, de, n + sign)
+
+
+def apply(before, after):
+    """Move one transaction's contribution from `before` to `after` (TxnSnaps, either may be None)."""
+    deltas = {}
+    if before:
+        add_delta(deltas, before, -1)
+    if after:
+        add_delta(deltas, after, +1)
+    apply_deltas(deltas)
+
+
+def apply_deltas(deltas):
+    """Upsert {key: (credit, debit, count)} deltas; the users' rows must already be seeded (ensure)."""
+    rows = [{"user_id": user_id, "period": period, "bucket": bk, "category_id": cat,
+             "credit": cr, "debit": de, "count": n}
+            for (user_id, period, bk, cat), (cr, de, n) in deltas.items() if cr or de or n]
+    if rows:
+        stmt = insert(SpendRollup)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=["user_id", "period", "bucket", "category_id"],
+            set_={"credit": SpendRollup.credit + stmt.excluded.credit,
+                  "debit": SpendRollup.debit + stmt.excluded.debit,
+                  "count": SpendRollup.count + stmt.excluded.count},
+        ), rows)
+
+
+def series(user_id, period="m", start=None, end=None, by_category=True):
+    """Rollup rows for a user, oldest bucket first -> [{bucket, category_id, credit, debit, count}].
+    start/end are bucket labels (inclusive)."""
+    if ensure(user_id):
+        db.session.commit()
+    if by_category:
+        cols = (SpendRollup.bucket, SpendRollup.category_id, SpendRollup.credit, SpendRollup.debit, SpendRollup.count)
+    else:
+        cols = (SpendRollup.bucket, func.sum(SpendRollup.credit), func.sum(SpendRollup.debit), func.sum(SpendRollup.count))
+    q = db.session.query(*cols).filter(SpendRollup.user_id == user_id, SpendRollup.period == period,
+                                       SpendRollup.count != 0)
+    if start:
+        q = q.filter(SpendRollup.bucket >= start)
+    if end:
+        q = q.filter(SpendRollup.bucket <= end)
+    if by_category:
+        q = q.order_by(SpendRollup.bucket, SpendRollup.category_id)
+        return [{"bucket": b, "category_id": c or None, "credit": float(cr), "debit": float(de), "count": n}
+                for b, c, cr, de, n in q]
+    q = q.group_by(SpendRollup.bucket).order_by(SpendRollup.bucket)
+    return [{"bucket": b, "category_id": None, "credit": float(cr), "debit": float(de), "count": n}
+            for b, cr, de, n in q]
+
+
+def verify(fix=False):
+    """Users whose rollups differ from a rebuild -> [user_id]."""
+    bad = []
+    user_ids = [u for (u,) in db.session.query(SpendRollup.user_id).distinct()]
+    for user_id in user_ids:
+        stored = {(r.period, r.bucket, r.category_id): (Decimal(str(r.credit)).quantize(CENTS),
+                                                        Decimal(str(r.debit)).quantize(CENTS), r.count)
+                  for r in SpendRollup.query.filter_by(user_id=user_id) if r.count}
+        rebuild(user_id)
+        fresh = {(r.period, r.bucket, r.category_id): (Decimal(str(r.credit)).quantize(CENTS),
+                                                       Decimal(str(r.debit)).quantize(CENTS), r.count)
+                 for r in SpendRollup.query.filter_by(user_id=user_id)}
+        if stored != fresh:
+            bad.append(user_id)
+    if fix:
+        db.session.commit()
+    else:
+        db.session.rollback()
+    return bad
@@ -0,0 +1,107 @@
+from decimal import Decimal
+from . import db
+from .lots import CENTS, apply_trade, replay
+from .models import Coin, Holding, Trade
+
+# Recording, editing and deleting trades, shared by the portfolio form and the
+# JSON API. New trades fold into the FIFO lots incrementally (lots.apply_trade);
+# an edit or delete replays the coin (lots.replay) and resets the Holding from
+# the open lots it leaves. Raise ValueError with a user-facing message; the
+# caller commits.
+
+SIDES = ("BUY", "SELL")
+
+
+def _holding(user_id, coin_id):
+    h = Holding.query.filter_by(user_id=user_id, coin_id=coin_id).first()
+    if h is None:
+        h = Holding(user_id=user_id, coin_id=coin_id, quantity=0, invested=0, price_per_coin=0)
+        db.session.add(h)
+    return h
+
+
+def record_trade(user_id, coin_id, side, qty, price, total, when=None):
+    """Add a BUY or SELL and update the holding. -> Trade"""
+    if side not in SIDES:
+        raise ValueError("Unknown trade type.")
+    if qty <= 0 or total < 0:
+        raise ValueError("Quantity and amount must be non‑negative.")
+    if db.session.get(Coin, coin_id) is None:
+        raise ValueError("Unknown coin.")
+
+    if side == "SELL":
+        h = Holding.query.filter_by(user_id=user_id, coin_id=coin_id).first()
+        if not h or h.quantity < qty:
+            raise ValueError("Not enough holdings to sell.")
+        # avg cost BEFORE mutating the holding
+        avg_cost = (h.invested / h.quantity) if h.quantity > 0 else Decimal(0)
+
+    t = Trade(user_id=user_id, coin_id=coin_id, side=side, quantity=qty,
+              price_per_coin=price, total=total, txn_date=when)
+    db.session.add(t)
+    db.session.flush()
+    apply_trade(t)          # on a SELL, sets t.realized_pnl from the FIFO lots
+
+    if side == "BUY":
+        h = _holding(user_id, coin_id)
+        h.quantity += qty
+        h.invested += total
+    else:
+        h.quantity -= qty
+        h.invested = max(Decimal(0), h.invested - (avg_cost * qty))
+        if h.quantity == 0:
+            h.invested = Decimal(0)
+    h.price_per_coin = (h.invested / h.quantity) if h.quantity > 0 else Decimal(0)
+    if when:
+        h.txn_date = when
+    return t
+
+
+def sync_holding(user_id, coin_id, open_lots, last_date=None):
+    """Holding quantity/invested from the open FIFO lots left by a replay."""
+    h = _holding(user_id, coin_id)
+    qty = sum((q for q, _ in open_lots), Decimal(0))
+    invested = sum((q * c for q, c in open_lots), Decimal(0)).quantize(CENTS)
+    h.quantity, h.invested = qty, invested
+    h.price_per_coin = (invested / qty) if qty > 0 else Decimal(0)
+    dates = [d for d in (h.txn_date, last_date) if d is not None]
+    h.txn_date = max(dates) if dates else None
+
+
+def _replay(t):
+    r = replay(t.user_id, t.coin_id)
+    if r.short:
+        symbol = db.session.get(Coin, t.coin_id).symbol.upper()
+        d = r.short[0][1]
+        when = f"on {d:%Y-%m-%d}" if d else "(undated)"
+        raise ValueError(f"That would leave a sell {when} with more {symbol} than was held.")
+    sync_holding(t.user_id, t.coin_id, r.lots)
+
+
+def update_trade(t, side=None, qty=None, price=None, total=None, when=None):
+    """Change fields of an existing trade and recompute its coin."""
+    if side is not None:
+        if side not in SIDES:
+            raise ValueError("Unknown trade type.")
+        t.side = side
+    if qty is not None:
+        if qty <= 0:
+            raise ValueError("Quantity and amount must be non‑negative.")
+        t.quantity = qty
+    if total is not None:
+        if total < 0:
+            raise ValueError("Quantity and amount must be non‑negative.")
+        t.total = total
+    if price is not None:
+        t.price_per_coin = price
+    if when is not None:
+        t.txn_date = when
+    db.session.flush()
+    _replay(t)
+
+
+def delete_trade(t):
+    """Remove a trade and recompute its coin."""
+    db.session.delete(t)
+    db.session.flush()
+    _replay(t)
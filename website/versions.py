@@ -0,0 +1,109 @@
+from collections import defaultdict
+from itertools import chain
+from sqlalchemy import event, select
+from . import db
+from .cache import cache_get, cache_set
+from .dialect import insert
+from .models import Category, DataChange, DataVersion, Holding, Trade, Transaction
+
+# Per-user data version behind the JSON API's ETags and delta feed (api.py).
+# Any flush that inserts, updates or deletes one of a user's transactions,
+# categories, trades or holdings bumps DataVersion for that user and logs the
+# changed ids in DataChange, in the same DB transaction. Bulk paths that write
+# through Core (statement and fill imports, FIFO replays) call touch() instead,
+# which logs a 'reload' for the whole collection.
+# The committed version is also kept in the cache so a conditional GET can be
+# answered without a query. On the memory backend each worker's copy may be up
+# to VERSION_TTL seconds old, so the API's ETags and the page fragments read
+# the DataVersion row there instead (fragments.data_version).
+
+ENTITIES = {Transaction: "transaction", Category: "category", Trade: "trade", Holding: "holding"}
+VERSION_TTL = 300
+KEEP = 1000                 # change log kept per user, in versions
+
+
+def _key(user_id):
+    return ("dataver", user_id)
+
+
+def current(user_id):
+    """Latest committed version for user_id (0 before any change)."""
+    v = cache_get(_key(user_id))
+    if v is None:
+        v = stored(user_id)
+        cache_set(_key(user_id), v, VERSION_TTL)
+    return v
+
+
+def stored(user_id):
+    """Version from the database, bypassing the cache."""
+    return db.session.query(DataVersion.version).filter(DataVersion.user_id == user_id).scalar() or 0
+
+
+def changes(user_id, since):
+    """-> [(version, entity, entity_id, op)] after `since`, oldest first, or None when
+    the log no longer reaches back that far (the client should refetch everything)."""
+    if since >= stored(user_id):
+        return []
+    oldest = (db.session.query(DataChange.version).filter(DataChange.user_id == user_id)
+              .order_by(DataChange.version).limit(1).scalar())
+    if oldest is None or oldest > since + 1:
+        return None
+    return (db.session.query(DataChange.version, DataChange.entity, DataChange.entity_id, DataChange.op)
+            .filter(DataChange.user_id == user_id, DataChange.version > since)
+            .order_by(DataChange.version, DataChange.id)).all()
+
+
+def touch(user_id, entity):
+    """Record that a Core statement changed some of user_id's `entity` rows. Caller commits."""
+    _record(db.session(), {user_id: [(entity, None, "reload")]})
+
+
+def _record(session, by_user):
+    conn = session.connection()
+    pending = session.info.setdefault("data_versions", {})
+    for user_id, items in by_user.items():
+        conn.execute(insert(DataVersion).values(user_id=user_id, version=1).on_conflict_do_update(
+            index_elements=["user_id"], set_={"version": DataVersion.__table__.c.version + 1}))
+        version = conn.execute(select(DataVersion.version).where(DataVersion.user_id == user_id)).scalar()
+        conn.execute(DataChange.__table__.insert(), [
+            {"user_id": user_id, "version": version, "entity": entity, "entity_id": entity_id, "op": op}
+            for entity, entity_id, op in dict.fromkeys(items)])
+        if version % 100 == 0:
+            conn.execute(DataChange.__table__.delete().where(
+                DataChange.user_id == user_id, DataChange.version <= version - KEEP))
+        pending[user_id] = version
+
+
+# ---- session events ----
+def _after_flush(session, flush_context):
+    by_user = defaultdict(list)
+    dirty = (o for o in session.dirty if session.is_modified(o, include_collections=False))
+    for obj, op in chain(((o, "upsert") for o in session.new), ((o, "upsert") for o in dirty),
+                         ((o, "delete") for o in session.deleted)):
+        entity = ENTITIES.get(type(obj))
+        if entity is None or obj.user_id is None:
+            continue
+        by_user[obj.user_id].append((entity, obj.id, op))
+        if entity == "category" and op == "delete":
+            # its transactions were uncategorized in the same flush
+            by_user[obj.user_id].append(("transaction", None, "reload"))
+    if by_user:
+        _record(session, by_user)
+
+
+def _after_commit(session):
+    for user_id, version in session.info.pop("data_versions", {}).items():
+        cache_set(_key(user_id), version, VERSION_TTL)
+
+
+def _after_rollback(session, previous_transaction):
+    session.info.pop("data_versions", None)
+
+
+def init_app(app):
+    # db.session is shared by every app in the process; listen once
+    for name, fn in (("after_flush", _after_flush), ("after_commit", _after_commit),
+                     ("after_soft_rollback", _after_rollback)):
+        if not event.contains(db.session, name, fn):
+            event.listen(db.session, name, fn)
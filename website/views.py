@@ -1,128 +1,24 @@
-from flask import Blueprint, render_template, url_for, request, flash, redirect, current_app
+import asyncio
+import io
+from flask import Blueprint, render_template, get_template_attribute, url_for, request, flash, redirect, current_app, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
-from .models import User, Transaction, Category, Coin, Holding, Trade
-from datetime import datetime, date
+from .models import User, Transaction, Category, Coin, Holding, Savings
+from datetime import datetime, date, timedelta
 from . import db
 from dotenv import load_dotenv
-import os, requests
 from sqlalchemy import func, case
 from decimal import Decimal
-from time import time
-from collections import deque
-
-_CACHE = {}
-def cache_get(key):
-    item = _CACHE.get(key)
-    if item and item["exp"] > time():
-        return item["val"]
-    return None
-
-def cache_set(key, val, ttl=60):
-    _CACHE[key] = {"val": val, "exp": time() + ttl}
-
-CG_PRO = "https://pro-api.coingecko.com/api/v3"
-CG_PUB = "https://api.coingecko.com/api/v3"
-
-def cg_get_json(url, headers=None, params=None, ttl=60, fallback_url=None):
-    """Cached GET -> .json(). Never caches errors. Optional public fallback."""
-    key = (url, tuple(sorted((params or {}).items())))
-    hit = cache_get(key)
-    if hit is not None:
-        return hit
-
-    try:
-        r = requests.get(url, headers=headers, params=params, timeout=10)
-        data = r.json()
-    except Exception:
-        data = None
-
-    ok = (r.status_code == 200) and isinstance(data, (dict, list))
-
-    if not ok and fallback_url:
-        try:
-            r2 = requests.get(fallback_url, params=params, timeout=10)
-            data2 = r2.json()
-            ok = (r2.status_code == 200) and isinstance(data2, (dict, list))
-            if ok: data = data2
-        except Exception:
-            ok = False
-
-    if ok:
-        cache_set(key, data, ttl)
-        return data
-
-    if url.endswith("/coins/markets"):
-        return []
-    return {"coins": []}
-
-
-def fifo_pnl_for_coin(trades, current_price: Decimal):
-    lots = deque()
-    realized = Decimal("0")
-
-    for t in trades:
-        qty = Decimal(t.quantity)
-        unit_cost = (Decimal(t.total) / qty) if qty > 0 else Decimal("0")
-
-        if t.side == "BUY":
-            lots.append([qty, unit_cost])
-        else:  
-            to_sell = qty
-            basis = Decimal("0")
-            proceeds = Decimal(t.total)
-            while to_sell > 0 and lots:
-                lot_qty, lot_cost = lots[0]
-                take = min(to_sell, lot_qty)
-                basis += take * lot_cost
-                lot_qty -= take
-                to_sell -= take
-                if lot_qty == 0:
-                    lots.popleft()
-                else:
-                    lots[0][0] = lot_qty
-            realized += proceeds - basis
-
-    qty_rem = sum(q for q, _ in lots) if lots else Decimal("0")
-    invested = sum(q * c for q, c in lots) if lots else Decimal("0")
-    value = qty_rem * current_price
-    unrealized = sum(q * (current_price - c) for q, c in lots) if lots else Decimal("0")
-    pnl = realized + unrealized
-    pnl_pct = (pnl / invested * 100) if invested > 0 else None
-
-    return {
-        "qty": qty_rem, "invested": invested, "realized": realized,
-        "unrealized": unrealized, "value": value, "pnl": pnl, "pnl_pct": pnl_pct
-    }
-
-
-def fifo_realized_by_trade(trades):
-    lots = deque()
-    out = {}
-
-    for t in trades:
-        qty = Decimal(t.quantity)
-        unit_cost = (Decimal(t.total) / qty) if qty > 0 else Decimal("0")
-
-        if t.side == "BUY":
-            lots.append([qty, unit_cost])
-        else:  # SELL
-            to_sell = qty
-            basis = Decimal("0")
-            proceeds = Decimal(t.total)
-            while to_sell > 0 and lots:
-                lot_qty, lot_cost = lots[0]
-                take = min(to_sell, lot_qty)
-                basis += take * lot_cost
-                lot_qty -= take
-                to_sell -= take
-                if lot_qty == 0:
-                    lots.popleft()
-                else:
-                    lots[0][0] = lot_qty
-            out[t.id] = proceeds - basis
-
-    return out
-
+from .coingecko import cg_get_json, cg_headers, fetch_many, http_stats, CG_PRO, CG_PUB
+from . import fragments, fx, identity, market, portfolio_data, prices, rollups
+from .cache import cache_stats
+from .lots import ensure_positions
+from .trading import record_trade
+from .budgets import evaluate, set_budget
+from .importer import import_transactions, reader_for
+from .fills import import_fills as import_fill_history, read_fills
+from .export import export, filename as export_filename, FORMATS as EXPORT_FORMATS
+from .goals import goal_progress, to_target, invalidate as invalidate_goals
+from .ledger import ledger_page, parse_filters, txn_to_dict, PAGE_SIZE, snapshot, txn_changed, get_balance
 
 load_dotenv()
 views = Blueprint('views', __name__)
@@ -130,13 +26,6 @@ views = Blueprint('views', __name__)
 @views.route('/', methods=['GET', 'POST'])
 @login_required
 def home():
-    transactions = Transaction.query.filter_by(user_id=current_user.id).order_by(Transaction.txn_date.desc()).all()
-
-    balance = sum(
-        t.amount if t.txn == "CREDIT" else -t.amount
-        for t in transactions
-    )
-
     if request.method == 'POST':
         form_type = request.form.get('form_type')
 
@@ -152,7 +41,9 @@ def home():
                     flash("Not authorized to edit this transaction!", category='error')
                     return redirect(url_for('views.home'))
 
+                before = snapshot(txn_obj)
                 txn_obj.category_id = int(category_id)
+                txn_changed(before, snapshot(txn_obj))
                 db.session.commit()
                 flash("Category updated!", category="success")
                 return redirect(url_for('views.home'))
@@ -164,10 +55,13 @@ def home():
             note = request.form.get('note')
 
             try:
-                amount = float(amount)
-            except (ValueError, TypeError):
+                amount, currency, orig_amount = fx.entered(amount, request.form.get('currency'))
+            except (ArithmeticError, TypeError):
                 flash("Invalid Amount!", category='error')
                 return redirect(url_for('views.home'))
+            except ValueError as e:
+                flash(str(e), category='error')
+                return redirect(url_for('views.home'))
 
             try:
                 txn_date = datetime.strptime(txn_date, "%Y-%m-%d") if txn_date else None
@@ -183,22 +77,28 @@ def home():
                     flash("Not authorized to edit this transaction!", category='error')
                     return redirect(url_for('views.home'))
 
+                before = snapshot(txn_obj)
                 txn_obj.txn_date = txn_date
                 txn_obj.txn = txn_type
                 txn_obj.amount = amount
+                txn_obj.currency, txn_obj.orig_amount = currency, orig_amount
                 txn_obj.category_id = category_id
                 txn_obj.note = note
+                txn_changed(before, snapshot(txn_obj))
                 flash("Transaction updated!", category="success")
             else:  # Adding
                 new_txn = Transaction(
-                    txn_date=txn_date,
+                    txn_date=txn_date or datetime.utcnow(),     # the column default, visible to txn_changed
                     amount=amount,
+                    currency=currency,
+                    orig_amount=orig_amount,
                     txn=txn_type,
                     category_id=category_id,
                     note=note,
                     user_id=current_user.id
                 )
                 db.session.add(new_txn)
+                txn_changed(None, snapshot(new_txn))
                 flash("Transaction added!", category="success")
 
             db.session.commit()
@@ -238,16 +138,124 @@ def home():
             db.session.commit()
             return redirect(url_for('views.home'))
 
+        # ---- Set / Remove Budget ----
+        elif form_type == "budget":
+            category_id = request.form.get('budget_category_id')
+            try:
+                amount = Decimal(request.form.get('budget_amount', '0')).quantize(Decimal("0.01"))
+            except ArithmeticError:
+                flash("Invalid budget amount!", category='error')
+                return redirect(url_for('views.home'))
+
+            category_id = int(category_id) if category_id else None
+            if category_id is not None:
+                cat = Category.query.get_or_404(category_id)
+                if cat.user_id != current_user.id:
+                    flash("Not authorized to budget this category!", category='error')
+                    return redirect(url_for('views.home'))
+
+            set_budget(current_user.id, category_id, amount)
+            db.session.commit()
+            flash("Budget saved!" if amount > 0 else "Budget removed!", category="success")
+            return redirect(url_for('views.home'))
+
+    try:
+        filters = parse_filters(request.args)
+    except ValueError as e:
+        flash(str(e), category='error')
+        filters = {}
+
+    # the ledger table is cached as HTML per data version (see fragments.py)
+    display = fx.display()
+    cursor = request.args.get('cursor')
+    filter_args = {k: request.args.get(k, '') for k in ('from', 'to', 'category', 'txn', 'q')}
     categories = Category.query.filter_by(user_id=current_user.id).all()
+    category_names = {c.id: c.name for c in categories}
+    key = fragments.key("ledger", current_user.id, fragments.data_version(current_user.id), display.code,
+                        str(display.factor), sorted(filters.items()), cursor)
+    parts = fragments.get(key)
+    if parts is None:
+        try:
+            transactions, next_cursor = ledger_page(current_user.id, filters, cursor, display=display)
+            valid = True
+        except ValueError:
+            flash("Invalid page cursor.", category='error')
+            transactions, next_cursor = ledger_page(current_user.id, filters, display=display)
+            valid = False
+        html = get_template_attribute('ledger_parts.html', 'ledger')(
+            transactions, categories, category_names, filter_args, cursor, next_cursor, fx.BASE)
+        parts = fragments.put(key, {"ledger": html}) if valid else {"ledger": html}
+
+    balance = get_balance(current_user.id)
+    budget_status = evaluate(current_user.id)
+
     return render_template(
         'home.html',
-        transaction=transactions,
+        ledger_table=parts["ledger"],
+        filters=filter_args,
         current_date=date.today().isoformat(),
         categories=categories,
+        category_names=category_names,
         balance=balance,
+        budgets=budget_status,
         user=current_user
     )
 
+
+@views.route('/import', methods=['POST'])
+@login_required
+def import_statement():
+    """Bank statement upload (.csv / .ofx); large uploads are spooled to disk by Werkzeug."""
+    f = request.files.get('file')
+    if not f or not f.filename:
+        flash("Choose a file to import.", category='error')
+        return redirect(url_for('views.home'))
+    try:
+        read = reader_for(f.filename, request.form.get('format'))
+        stream = io.TextIOWrapper(f.stream, encoding='utf-8-sig', errors='replace', newline='')
+        res = import_transactions(current_user.id, read(stream))
+    except ValueError as e:
+        flash(str(e), category='error')
+        return redirect(url_for('views.home'))
+
+    flash(f"Imported {res['inserted']} transaction(s); {res['duplicates']} duplicate(s) and "
+          f"{res['skipped']} unreadable row(s) skipped.", category='success')
+    for err in res['errors'][:3]:
+        flash(err, category='error')
+    return redirect(url_for('views.home'))
+
+
+@views.route('/export/<kind>')
+@login_required
+def export_rows(kind):
+    """Streamed download: /export/transactions|trades?format=csv|jsonl|parquet&from=&to= (plus ledger filters)."""
+    fmt = (request.args.get('format') or 'csv').lower()
+    try:
+        filters = parse_filters(request.args)
+        body = export(kind, fmt, current_user.id, filters)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    return Response(stream_with_context(body), mimetype=EXPORT_FORMATS[fmt][0], headers={
+        "Content-Disposition": f'attachment; filename="{export_filename(kind, fmt)}"',
+        "X-Accel-Buffering": "no",
+    })
+
+
+@views.route('/ledger')
+@login_required
+def ledger():
+    """JSON ledger page: ?cursor=&limit=&from=&to=&category=&txn=&q="""
+    try:
+        filters = parse_filters(request.args)
+        limit = int(request.args.get('limit', PAGE_SIZE))
+        rows, next_cursor = ledger_page(current_user.id, filters, request.args.get('cursor'), limit,
+                                        display=fx.display())
+    except ValueError as e:
+        return jsonify(error=str(e) or "Invalid request."), 400
+
+    return jsonify(items=[txn_to_dict(t) for t in rows], next_cursor=next_cursor, display_currency=fx.display().code)
+
 @views.route('/cdelete/<int:id>')
 @login_required
 def categoriesdel(id):
@@ -256,7 +264,10 @@ def categoriesdel(id):
         flash("You are not allowed to delete this category!", category='error')
         return redirect(url_for('views.home'))
     db.session.delete(cat)
+    db.session.flush()
+    rollups.rebuild(current_user.id)    # its transactions are now uncategorized
     db.session.commit()
+    invalidate_goals(current_user.id)
     flash("Category deleted successfully!", category='success')
     return redirect(url_for('views.home'))
 
@@ -267,60 +278,27 @@ def delete(id):
     if del_txn.user_id != current_user.id:
         flash("You are not allowed to delete this transaction!", category='error')
         return redirect(url_for('views.home'))
+    txn_changed(snapshot(del_txn), None)
     db.session.delete(del_txn)
     db.session.commit()
     flash("Transaction deleted successfully!", category='success')
     return redirect(url_for('views.home'))
 
 
-@views.route('/portfolio', methods=['GET', 'POST'])
-@login_required
-def portfolio():
-    headers = {"accept": "application/json"}
-    api_key = os.getenv("CG_API_KEY", "").strip()
-    if api_key:
-        headers["x-cg-pro-api-key"] = api_key
+def _modal_coins(q):
+    """Coins for the add-coin modal: CoinGecko search for q, else the trending snapshot."""
+    if not q:
+        return market.trending_coins()
+    resp = cg_get_json(f"{CG_PRO}/search", headers=cg_headers(), params={"query": q}, ttl=120,
+                       fallback_url=f"{CG_PUB}/search")
+    return resp.get("coins", [])
 
-    # POST: add selected coins
-    if request.method == 'POST':
-        cg_ids = request.form.getlist('cg_ids')
-        for cg_id in cg_ids:
-            coin = Coin.query.filter_by(cg_id=cg_id).first()
-            if not coin:
-                j = cg_get_json(f"{CG_PRO}/coins/{cg_id}",
-                                headers=headers,
-                                params={"localization": "false"},
-                                ttl=3600,
-                                fallback_url=f"{CG_PUB}/coins/{cg_id}")
-                coin = Coin(cg_id=cg_id, coin=j.get("name"), symbol=j.get("symbol"))
-                db.session.add(coin); db.session.flush()
-
-            if not Holding.query.filter_by(user_id=current_user.id, coin_id=coin.id).first():
-                db.session.add(Holding(quantity=0, invested=0, user_id=current_user.id, coin_id=coin.id))
-        db.session.commit()
-        flash("Crypto added to your portfolio!", "success")
-        return redirect(url_for('views.portfolio'))
 
-    # Modal list (search or trending)
-    q = request.args.get('q', '').strip()
-    if q:
-        resp = cg_get_json(f"{CG_PRO}/search", headers=headers, params={"query": q}, ttl=120, fallback_url=f"{CG_PUB}/search")
-        list_coins = resp.get("coins", [])
-    else:
-        resp = cg_get_json(f"{CG_PRO}/search/trending", headers=headers, ttl=120, fallback_url=f"{CG_PUB}/search/trending")
-        list_coins = [c.get("item", {}) for c in resp.get("coins", []) if isinstance(c, dict)]
-
-    # Market data for holdings
-    hold = Holding.query.filter_by(user_id=current_user.id).all()
-    ids = [h.coin.cg_id for h in hold if h.coin and h.coin.cg_id]
-    market_rows = []
-    if ids:
-        jr = cg_get_json(f"{CG_PRO}/coins/markets",
-                        headers=headers,
-                        params={"vs_currency": "inr", "ids": ",".join(ids), "price_change_percentage": "24h"},
-                        ttl=60,
-                        fallback_url=f"{CG_PUB}/coins/markets")
-        market_rows = jr if isinstance(jr, list) else []
+def _holdings_parts(user_id, display):
+    """Rendered portfolio_parts.html macros for user_id's holdings; DB and cache reads only."""
+    hold = portfolio_data.holdings(user_id)
+    ids = [h.cg_id for h in hold if h.cg_id]
+    market_rows, prices_as_of = market.market_rows(ids)
 
     # Normalize + index
     coins_map = {}
@@ -344,58 +322,91 @@ def portfolio():
         row["market_cap_rank_display"] = row["market_cap_rank"] if row["market_cap_rank"] is not None else "–"
         coins_map[cid] = row
 
-    # ---- balance (current market value) ----
-    balance = Decimal(0)
-    for h in hold:
-        r = coins_map.get(h.coin.cg_id)
-        if r:
-            balance += h.quantity * r["current_price"]
-
-    # all trades for this user, grouped by coin
-    user_trades = (
-        db.session.query(Trade)
-        .filter(Trade.user_id == current_user.id)
-        .order_by(Trade.txn_date.asc(), Trade.id.asc())
-        .all()
-    )
-    trades_by_coin = {}
-    for t in user_trades:
-        trades_by_coin.setdefault(t.coin_id, []).append(t)
+    # persisted FIFO lots (see lots.py); built once for coins traded before they existed
+    if ensure_positions(user_id, [h.coin_id for h in hold]):
+        db.session.commit()
+    calc_map, totals = portfolio_data.valuation(
+        user_id, hold, {cid: row["current_price"] for cid, row in coins_map.items()}, display)
 
-    calc_map = {}
+    # holdings with a market row, joined once for the table and both trade selects
+    rows = [(h, coins_map[h.cg_id], calc_map.get(h.coin_id)) for h in hold if h.cg_id in coins_map]
+    macro = lambda name: get_template_attribute("portfolio_parts.html", name)
+    return {
+        "summary": macro("summary")(totals, datetime.fromtimestamp(prices_as_of) if prices_as_of else None),
+        "buy_options": macro("buy_options")(rows),
+        "sell_options": macro("sell_options")(rows),
+        "holdings": macro("holdings")(rows),
+        "charts": macro("charts")(market_rows, display.code),
+    }
 
-    for h in hold:
-        row = coins_map.get(h.coin.cg_id)
-        if not row:
-            continue
-        cur_price = Decimal(row["current_price"])
-        tlist = trades_by_coin.get(h.coin_id, [])
-        calc = fifo_pnl_for_coin(tlist, cur_price)
-        calc_map[h.coin_id] = calc
 
-    # Portfolio totals based on FIFO
-    current_balance = sum(c["value"] for c in calc_map.values())
-    total_invested  = sum(c["invested"] for c in calc_map.values())
-    realized_total  = sum(c["realized"] for c in calc_map.values())
-    unrealized_total = sum(c["unrealized"] for c in calc_map.values())
-    total_pnl       = realized_total + unrealized_total
-    total_pnl_pct   = (total_pnl / total_invested * 100) if total_invested else None
+async def _portfolio_page(user_id, q, display):
+    # Each side runs on its own thread with the request's context (asyncio.to_thread
+    # copies contextvars); only _holdings_parts uses the DB session.
+    return await asyncio.gather(asyncio.to_thread(_modal_coins, q),
+                                asyncio.to_thread(_holdings_parts, user_id, display))
 
 
+@views.route('/portfolio', methods=['GET', 'POST'])
+@login_required
+def portfolio():
+    headers = cg_headers()
+
+    # POST: add selected coins
+    if request.method == 'POST':
+        cg_ids = list(dict.fromkeys(request.form.getlist('cg_ids')))
+        known = {c.cg_id: c for c in Coin.query.filter(Coin.cg_id.in_(cg_ids))}
+        new_ids = [cg_id for cg_id in cg_ids if cg_id not in known]
+
+        # metadata for new coins: one batched /coins/markets call (which also seeds
+        # the price snapshot), then /coins/{id} in parallel for anything it missed
+        meta = market.refresh_markets(new_ids, max_wait=5.0) if new_ids else {}
+        rest = [cg_id for cg_id in new_ids if cg_id not in meta]
+        for cg_id, j in zip(rest, fetch_many([(f"{CG_PRO}/coins/{cg_id}", headers,
+                                               {"localization": "false"}, f"{CG_PUB}/coins/{cg_id}")
+                                              for cg_id in rest])):
+            meta[cg_id] = j or {}
+
+        for cg_id in new_ids:
+            j = meta[cg_id]
+            known[cg_id] = Coin(cg_id=cg_id, coin=j.get("name") or cg_id, symbol=j.get("symbol") or cg_id)
+            db.session.add(known[cg_id])
+        db.session.flush()
+
+        held = {coin_id for (coin_id,) in db.session.query(Holding.coin_id)
+                .filter(Holding.user_id == current_user.id, Holding.coin_id.in_([c.id for c in known.values()]))}
+        for cg_id in cg_ids:
+            coin = known[cg_id]
+            if coin.id not in held:
+                db.session.add(Holding(quantity=0, invested=0, user_id=current_user.id, coin_id=coin.id))
+        db.session.commit()
+        market.request_refresh([cg_id for cg_id in cg_ids if cg_id not in meta])
+        flash("Crypto added to your portfolio!", "success")
+        return redirect(url_for('views.portfolio'))
+
+    # Modal list (search or trending) and the holdings parts. The parts are cached
+    # as HTML per data version and price snapshot (see fragments.py); on a miss a
+    # search, an upstream round trip, runs alongside the DB work instead of before it.
+    q = request.args.get('q', '').strip()
+    display = fx.display()
+    key = fragments.key("portfolio", current_user.id, fragments.data_version(current_user.id), market.generation(),
+                        display.code, str(display.factor))
+    parts = fragments.get(key)
+    if parts is not None:
+        market.refresher()      # market_rows() isn't called on a hit; keep the refresh running
+        list_coins = _modal_coins(q)
+    else:
+        if q:
+            list_coins, parts = asyncio.run(_portfolio_page(current_user.id, q, display))
+        else:
+            list_coins, parts = market.trending_coins(), _holdings_parts(current_user.id, display)
+        parts = fragments.put(key, parts)
+
     return render_template(
         "portfolio.html",
         coins=list_coins,
-        coins_map=coins_map,
-        crypto=hold,
+        parts=parts,
         user=current_user,
-        balance=current_balance,
-        total_invested=total_invested,
-        unrealized_total=unrealized_total,
-        realized_total=realized_total,
-        total_pnl=total_pnl,
-        total_pnl_pct=total_pnl_pct,
-        calc_map=calc_map,
-        market_rows=market_rows,
     )
 
 
@@ -417,72 +428,43 @@ def trade():
             flash("Invalid date & time.", "error")
             return redirect(url_for('views.portfolio'))
 
-    if form_type == "crypto_buy":
-        total = Decimal(str(request.form.get('total_spent', '0')))
-        if qty <= 0 or total < 0:
-            flash("Quantity and amount must be non‑negative.", "error")
-            return redirect(url_for('views.portfolio'))
-
-        trade = Trade(
-            user_id=current_user.id, 
-            coin_id=coin_id,
-            side='BUY', 
-            quantity=qty, 
-            price_per_coin=ppc,
-            total=total, 
-            txn_date=tx_dt
-        )
-        db.session.add(trade)
-
-        h = Holding.query.filter_by(user_id=current_user.id, coin_id=coin_id).first()
-        if not h:
-            h = Holding(user_id=current_user.id, coin_id=coin_id, quantity=0, invested=0, price_per_coin=0)
-            db.session.add(h)
-
-        h.quantity += qty
-        h.invested += total
-        h.price_per_coin = (h.invested / h.quantity) if h.quantity > 0 else Decimal(0)
-        if tx_dt: h.txn_date = tx_dt
-
-        db.session.commit()
-        flash("Buy recorded!", "success")
-
-    elif form_type == "crypto_sell":
-        total_received = Decimal(str(request.form.get('total_received', '0')))
-        if qty <= 0 or total_received < 0:
-            flash("Quantity and amount must be non‑negative.", "error")
-            return redirect(url_for('views.portfolio'))
-
-        h = Holding.query.filter_by(user_id=current_user.id, coin_id=coin_id).first()
-        if not h or h.quantity < qty:
-            flash("Not enough holdings to sell.", "error")
-            return redirect(url_for('views.portfolio'))
-
-        # avg cost BEFORE mutating the holding
-        avg_cost = (h.invested / h.quantity) if h.quantity > 0 else Decimal(0)
-        realized = total_received - (avg_cost * qty)          # ← realized PnL for this sell
-
-        trade = Trade(
-            user_id=current_user.id, coin_id=coin_id, side='SELL',
-            quantity=qty, price_per_coin=ppc, total=total_received,
-            realized_pnl=realized, txn_date=tx_dt               # ← store it
-        )
-        db.session.add(trade)
-
-        h.quantity -= qty
-        h.invested = max(Decimal(0), h.invested - (avg_cost * qty))
-        h.price_per_coin = (h.invested / h.quantity) if h.quantity > 0 else Decimal(0)
-        if tx_dt: h.txn_date = tx_dt
-        if h.quantity == 0:
-            h.invested = Decimal(0); h.price_per_coin = Decimal(0)
+    sides = {"crypto_buy": ("BUY", "total_spent"), "crypto_sell": ("SELL", "total_received")}
+    if form_type not in sides:
+        flash("Unknown trade type.", "error")
+        return redirect(url_for('views.portfolio'))
+    side, total_field = sides[form_type]
+    total = Decimal(str(request.form.get(total_field, '0')))
 
-        db.session.commit()
-        flash("Sell recorded!", "success")
+    try:
+        record_trade(current_user.id, coin_id, side, qty, ppc, total, tx_dt)
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), "error")
+        return redirect(url_for('views.portfolio'))
+    db.session.commit()
+    flash("Buy recorded!" if side == "BUY" else "Sell recorded!", "success")
 
+    return redirect(url_for('views.portfolio'))
 
-    else:
-        flash("Unknown trade type.", "error")
+@views.route('/portfolio/import', methods=['POST'])
+@login_required
+def import_fills():
+    """Exchange fill history (.csv) -> trades, with one FIFO recompute per coin."""
+    f = request.files.get('file')
+    if not f or not f.filename:
+        flash("Choose a file to import.", category='error')
+        return redirect(url_for('views.portfolio'))
+    try:
+        stream = io.TextIOWrapper(f.stream, encoding='utf-8-sig', errors='replace', newline='')
+        res = import_fill_history(current_user.id, read_fills(stream))
+    except ValueError as e:
+        flash(str(e), category='error')
+        return redirect(url_for('views.portfolio'))
 
+    flash(f"Imported {res['inserted']} fill(s) across {res['coins']} coin(s); "
+          f"{res['skipped']} unreadable row(s) skipped.", category='success')
+    for err in res['errors'][:3]:
+        flash(err, category='error')
     return redirect(url_for('views.portfolio'))
 
 @views.route('/portfolio/remove_coin/<coin_id>', methods=['POST'])
@@ -502,17 +484,13 @@ def remove_coin(coin_id):
 def trades(coin_id):
     coin = Coin.query.get_or_404(coin_id)
 
-    trades_asc = (Trade.query
-        .filter_by(user_id=current_user.id, coin_id=coin_id)
-        .order_by(Trade.txn_date.asc(), Trade.id.asc())
-        .all())
+    # realized_pnl on each SELL is kept by the lot engine; no replay needed
+    if ensure_positions(current_user.id, [coin_id]):
+        db.session.commit()
 
-    fifo_realized_map = fifo_realized_by_trade(trades_asc)
+    trades_desc = portfolio_data.trades(current_user.id, coin_id, fx.display())
 
-    trades_desc = (Trade.query
-        .filter_by(user_id=current_user.id, coin_id=coin_id)
-        .order_by(Trade.txn_date.desc(), Trade.id.desc())
-        .all())
+    fifo_realized_map = {t.id: t.realized_pnl for t in trades_desc if t.side == 'SELL'}
 
     return render_template(
         "trades.html",
@@ -523,15 +501,149 @@ def trades(coin_id):
     )
 
 
+@views.route('/currency', methods=['POST'])
+@login_required
+def set_currency():
+    """Display currency for every page; amounts are converted from the stored rates."""
+    code = (request.form.get('currency') or '').upper()
+    if code not in fx.CURRENCIES:
+        flash("Unknown currency.", category='error')
+    elif fx.rate(code) is None:
+        flash(f"No exchange rate for {code} yet; try again shortly.", category='error')
+        market.request_refresh()
+    else:
+        User.query.filter_by(id=current_user.id).update({"currency": code})
+        db.session.commit()
+        identity.invalidate(current_user.id)
+    back = request.referrer or ''
+    return redirect(back if back.startswith(request.host_url) else url_for('views.home'))
+
+
+@views.route('/status/upstream')
+@login_required
+def upstream_status():
+    """JSON CoinGecko client and cache counters for this worker."""
+    return jsonify(http=http_stats(), cache=cache_stats())
+
+
+@views.route('/portfolio/history')
+@login_required
+def portfolio_history():
+    """JSON portfolio value over time: ?days=365&res=d (m|h|d), INR, from recorded price ticks.
+    Minute and hour buckets only go back as far as those ticks are kept."""
+    res = request.args.get('res', 'd')
+    try:
+        days = int(request.args.get('days', 365))
+    except ValueError:
+        days = 0
+    if res not in prices.RESOLUTIONS:
+        return jsonify(error="Invalid days or res."), 400
+    max_days = {"m": current_app.config["PRICE_KEEP_MINUTES_DAYS"],
+                "h": current_app.config["PRICE_KEEP_HOURS_DAYS"]}.get(res, 3660)
+    if not 0 < days <= max_days:
+        return jsonify(error=f"days must be 1-{max_days} for res={res}."), 400
+
+    end = int(datetime.now().timestamp())
+    points = prices.portfolio_history(current_user.id, end - days * 86400, end, res)
+    return jsonify(resolution=res, points=[{"ts": ts, "value": round(v, 2)} for ts, v in points])
+
+
 
 @views.route('/stats')
 @login_required
-def stats(id):
-    pass
+def stats():
+    return render_template("stats.html", user=current_user)
 
 
-@views.route('/goal')
+@views.route('/stats/data')
 @login_required
-def goals(id):
-    pass
+def stats_data():
+    """JSON spend/income per bucket and per category: ?period=m|w&from=YYYY-MM&to=YYYY-MM"""
+    period = request.args.get('period', 'm')
+    if period not in rollups.PERIODS:
+        return jsonify(error="Invalid period."), 400
+    try:
+        start = request.args.get('from')
+        start = rollups.bucket(period, datetime.strptime(start, "%Y-%m")) if start else None
+        end = request.args.get('to')
+        if end:
+            end = datetime.strptime(end, "%Y-%m")
+            end = (end.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+            end = rollups.bucket(period, end)
+    except ValueError:
+        return jsonify(error="Use YYYY-MM for from/to."), 400
+
+    rows = rollups.series(current_user.id, period, start, end)
+
+    totals, by_cat = {}, {}
+    for r in rows:
+        for acc, key in ((totals, r["bucket"]), (by_cat, r["category_id"])):
+            t = acc.setdefault(key, {"credit": 0.0, "debit": 0.0, "count": 0})
+            t["credit"] += r["credit"]; t["debit"] += r["debit"]; t["count"] += r["count"]
+
+    names = dict(db.session.query(Category.id, Category.name).filter_by(user_id=current_user.id))
+    def out(t, **extra):
+        return dict(extra, credit=round(t["credit"], 2), debit=round(t["debit"], 2), count=t["count"])
+
+    return jsonify(
+        period=period,
+        rows=rows,
+        totals=[out(t, bucket=b) for b, t in sorted(totals.items())],
+        categories=[out(t, category_id=c, name=names.get(c, "Uncategorized"))
+                    for c, t in sorted(by_cat.items(), key=lambda kv: -kv[1]["debit"])],
+    )
+
+
+@views.route('/goal', methods=['GET', 'POST'])
+@login_required
+def goals():
+    if request.method == 'POST':
+        title = request.form.get('title', '').strip()
+        category_id = request.form.get('category_id')
+        try:
+            target_amount = Decimal(request.form.get('target_amount', '')).quantize(Decimal("0.01"))
+            target_date = datetime.strptime(request.form.get('target_date', ''), "%Y-%m-%d").date()
+        except (ArithmeticError, ValueError):
+            flash("Invalid amount or date.", category='error')
+            return redirect(url_for('views.goals'))
+        if not title or target_amount <= 0:
+            flash("Goal needs a title and a positive target.", category='error')
+            return redirect(url_for('views.goals'))
+
+        category_id = int(category_id) if category_id else None
+        if category_id is not None:
+            cat = Category.query.get_or_404(category_id)
+            if cat.user_id != current_user.id:
+                flash("Not authorized to use this category!", category='error')
+                return redirect(url_for('views.goals'))
+
+        db.session.add(Savings(title=title, target_amount=target_amount, target_date=to_target(target_date),
+                               category_id=category_id, user_id=current_user.id))
+        db.session.commit()
+        invalidate_goals(current_user.id)
+        flash("Goal added!", category="success")
+        return redirect(url_for('views.goals'))
+
+    categories = Category.query.filter_by(user_id=current_user.id).all()
+    return render_template(
+        "goals.html",
+        goals=goal_progress(current_user.id),
+        categories=categories,
+        category_names={c.id: c.name for c in categories},
+        user=current_user,
+    )
+
+
+@views.route('/goal/delete/<int:id>')
+@login_required
+def goal_delete(id):
+    goal = Savings.query.get_or_404(id)
+    if goal.user_id != current_user.id:
+        flash("You are not allowed to delete this goal!", category='error')
+        return redirect(url_for('views.goals'))
+    db.session.delete(goal)
+    db.session.commit()
+    invalidate_goals(current_user.id)
+    flash("Goal deleted!", category='success')
+    return redirect(url_for('views.goals'))
 